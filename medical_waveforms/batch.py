@@ -0,0 +1,442 @@
+import argparse
+import importlib.util
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Type, Union
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel
+
+from medical_waveforms import channels, quality
+from medical_waveforms.features import cycles, segments, waveform
+from medical_waveforms.waveforms import Waveforms
+
+READERS = {
+    ".csv": pd.read_csv,
+    ".parquet": pd.read_parquet,
+    ".feather": pd.read_feather,
+    ".pkl": pd.read_pickle,
+}
+
+WRITERS = {
+    "parquet": lambda df, path: df.to_parquet(path, index=False),
+    "csv": lambda df, path: df.to_csv(path, index=False),
+}
+
+DETECTORS = {
+    "ampd": None,
+    "upstroke": waveform.UpstrokeTroughDetector,
+}
+
+
+def find_recordings(source: Union[str, Path]) -> List[Path]:
+    """Lists the recordings to process.
+
+    Args:
+        source: Either a directory, in which case every file in it with a
+            readable extension (see `READERS`) is a recording, or a manifest
+            file listing one recording path per line. Relative paths in a
+            manifest are relative to the manifest's directory.
+
+    Returns:
+        Paths of the recordings
+    """
+    source = Path(source)
+    if source.is_dir():
+        return sorted(
+            path
+            for path in source.iterdir()
+            if path.is_file() and path.suffix in READERS
+        )
+    with open(source) as manifest:
+        lines = [line.strip() for line in manifest]
+    return [source.parent / line for line in lines if line]
+
+
+def output_paths(
+    recordings: Sequence[Path], output_directory: Path, output_format: str
+) -> List[Path]:
+    """Chooses where to write the per-cycle table of each recording.
+
+    Tables mirror the layout of the recordings below the deepest directory
+    containing them all, so recordings with the same name in different
+    directories (e.g. listed in one manifest) get separate tables.
+
+    Args:
+        recordings: Paths of the recordings (see `find_recordings`)
+        output_directory: Where to write the per-cycle tables
+        output_format: 'parquet' or 'csv'
+
+    Returns:
+        Path of the table for each recording, in the same order
+
+    Raises:
+        ValueError: If two recordings would still share a table, e.g.
+            'a.csv' and 'a.parquet' in the same directory
+    """
+    if not recordings:
+        return []
+    resolved = [Path(path).resolve() for path in recordings]
+    root = Path(os.path.commonpath([path.parent for path in resolved]))
+    paths = [
+        output_directory
+        / path.relative_to(root).with_suffix(f".{output_format}")
+        for path in resolved
+    ]
+    by_output_path: Dict[Path, List[Path]] = {}
+    for recording, path in zip(recordings, paths):
+        by_output_path.setdefault(path, []).append(recording)
+    collisions = [
+        [str(recording) for recording in shared]
+        for shared in by_output_path.values()
+        if len(shared) > 1
+    ]
+    if collisions:
+        raise ValueError(f"Recordings would share output tables: {collisions}")
+    return paths
+
+
+def cycles_table(
+    waveforms: Waveforms, name: str, check_results: pd.DataFrame
+) -> pd.DataFrame:
+    """Gathers the cycle-level features, diffs and signal quality check
+    results for a waveform into one table.
+
+    Args:
+        waveforms: `medical_waveforms.waveforms.Waveforms` instance holding your data
+        name: Name of column in `waveforms` the features are for
+        check_results: Output of `medical_waveforms.quality.check_cycles`
+
+    Returns:
+        DataFrame with one row per cycle
+    """
+    starts, ends = segments.cycle_bounds(
+        waveforms.features.waveform[name]["troughs"]
+    )
+    times = waveforms.times
+    table = {
+        "start_index": starts,
+        "end_index": ends,
+        "start_time": times[starts],
+    }
+    table.update(
+        {
+            feature_name: feature
+            for feature_name, feature in waveforms.features.cycles[
+                name
+            ].items()
+            if feature.ndim == 1
+        }
+    )
+    table.update(
+        {
+            f"{feature_name}_diff": diff
+            for feature_name, diff in waveforms.features.diffs[name].items()
+        }
+    )
+    table.update(
+        {
+            f"check_{check_name}": passed.to_numpy()
+            for check_name, passed in check_results.items()
+        }
+    )
+    return pd.DataFrame(table)
+
+
+def process_recording(
+    path: Union[str, Path],
+    output_path: Union[str, Path],
+    name: str,
+    checks: quality.CheckPlan,
+    feature_extractors: Sequence[Type[cycles.CycleFeatureExtractor]] = (),
+    time_column_name: str = "time",
+    scale: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    detector: Optional[waveform.TroughDetector] = None,
+    output_format: str = "parquet",
+) -> Dict[str, object]:
+    """Runs the full pipeline on one recording and writes out the results.
+
+    Any exception (including running out of memory) is caught and reported
+    in the returned summary, so that one bad recording doesn't stop a batch.
+
+    Args:
+        path: Recording to process
+        output_path: Where to write the per-cycle table (see `cycles_table`)
+        name: Name of the waveform column to process
+        checks: The signal quality checks to run
+        feature_extractors: Extra cycle-level features to extract, beyond
+            those needed by `checks`
+        time_column_name: The name of the timestamps column
+        scale: As for `medical_waveforms.features.waveform.find_troughs`
+        chunk_size: As for `medical_waveforms.features.waveform.find_troughs`
+        detector: As for `medical_waveforms.features.waveform.find_troughs`
+        output_format: 'parquet' or 'csv'
+
+    Returns:
+        Summary of the outcome for this recording
+    """
+    summary = {"path": str(path), "output_path": None, "n_cycles": 0}
+    try:
+        waveforms = Waveforms(
+            READERS[Path(path).suffix](path), time_column_name
+        )
+        waveforms, check_results = channels.process_channel(
+            waveforms,
+            name,
+            channels.ChannelConfig(
+                scale=scale,
+                chunk_size=chunk_size,
+                detector=detector,
+                feature_extractors=tuple(feature_extractors),
+                checks=checks,
+            ),
+        )
+
+        WRITERS[output_format](
+            cycles_table(waveforms, name, check_results), output_path
+        )
+    except Exception as exc:  # including MemoryError
+        summary.update(status="failed", error=repr(exc))
+        return summary
+
+    summary.update(
+        status="succeeded",
+        error=None,
+        output_path=str(output_path),
+        n_cycles=waveforms.features.n_cycles(name),
+    )
+    return summary
+
+
+def run_batch(
+    source: Union[str, Path],
+    output_directory: Union[str, Path],
+    name: str,
+    checks: Optional[Union[BaseModel, quality.CheckPlan]] = None,
+    feature_extractors: Sequence[Type[cycles.CycleFeatureExtractor]] = (),
+    time_column_name: str = "time",
+    scale: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    detector: Optional[waveform.TroughDetector] = None,
+    output_format: str = "parquet",
+    max_workers: Optional[int] = None,
+) -> pd.DataFrame:
+    """Processes many recordings in parallel, writing one per-cycle table
+    (see `cycles_table`) per recording as soon as it is finished.
+
+    Recordings that can't be processed are recorded in the returned summary
+    and skipped. Tables are named after the recordings (see
+    `output_paths`). If a worker process dies outright (e.g. killed by the
+    operating system for using too much memory), the rest of the batch
+    carries on in a new process pool, and only the recordings that were
+    being processed at the time are retried one at a time, so that only the
+    culprit is reported as failed.
+
+    Args:
+        source: Directory or manifest of recordings (see `find_recordings`)
+        output_directory: Where to write the per-cycle tables
+        name: Name of the waveform column to process in each recording
+        checks: The signal quality checks to run. Defaults to
+            `medical_waveforms.quality.ArterialPressureChecks`
+        feature_extractors: Extra cycle-level features to extract, beyond
+            those needed by `checks`
+        time_column_name: The name of the timestamps column
+        scale: As for `medical_waveforms.features.waveform.find_troughs`
+        chunk_size: As for `medical_waveforms.features.waveform.find_troughs`
+        detector: As for `medical_waveforms.features.waveform.find_troughs`.
+            `medical_waveforms.features.waveform.UpstrokeTroughDetector` is
+            much faster for long recordings.
+        output_format: 'parquet' (requires pyarrow) or 'csv'
+        max_workers: Number of worker processes. If None, uses the number of
+            CPUs
+
+    Returns:
+        DataFrame with one row per recording, summarising its outcome
+    """
+    assert (
+        output_format in WRITERS
+    ), f"`output_format` must be in {list(WRITERS)}"
+    if output_format == "parquet" and not importlib.util.find_spec("pyarrow"):
+        raise ImportError("Writing parquet files requires pyarrow")
+
+    output_directory = Path(output_directory)
+    output_directory.mkdir(parents=True, exist_ok=True)
+    if checks is None:
+        checks = quality.ArterialPressureChecks()
+    if not isinstance(checks, quality.CheckPlan):
+        checks = quality.CheckPlan(checks)
+    kwargs = dict(
+        name=name,
+        checks=checks,
+        feature_extractors=tuple(feature_extractors),
+        time_column_name=time_column_name,
+        scale=scale,
+        chunk_size=chunk_size,
+        detector=detector,
+        output_format=output_format,
+    )
+    recordings = find_recordings(source)
+    tasks = list(
+        zip(
+            recordings,
+            output_paths(recordings, output_directory, output_format),
+        )
+    )
+    for _, output_path in tasks:
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    summaries = []
+    crashed = _run_tasks(tasks, kwargs, max_workers, summaries)
+    _retry_tasks(crashed, kwargs, summaries)
+
+    return pd.DataFrame(
+        summaries,
+        columns=["path", "status", "n_cycles", "output_path", "error"],
+    )
+
+
+def _run_tasks(
+    tasks: List[tuple],
+    kwargs: dict,
+    max_workers: Optional[int],
+    summaries: List[dict],
+) -> List[tuple]:
+    """Runs `process_recording` for each of `tasks` in a process pool,
+    appending to `summaries` as each finishes.
+
+    Only `max_workers` tasks are submitted at a time, so that if a worker
+    process dies, the tasks that were in flight are the only ones that may
+    have killed it. The pool is then replaced and the queued tasks carry on
+    in parallel.
+
+    Returns:
+        The tasks that were in flight when a worker process died
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    queued = deque(tasks)
+    crashed = []
+    while queued:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = {}
+            broken = False
+            while in_flight or (queued and not broken):
+                while queued and not broken and len(in_flight) < max_workers:
+                    path, output_path = queued.popleft()
+                    future = executor.submit(
+                        process_recording, path, output_path, **kwargs
+                    )
+                    in_flight[future] = (path, output_path)
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = in_flight.pop(future)
+                    try:
+                        summaries.append(future.result())
+                    except BrokenProcessPool:
+                        # The other tasks in flight fail too, but those that
+                        #  already finished are kept
+                        crashed.append(task)
+                        broken = True
+    return crashed
+
+
+def _retry_tasks(tasks: List[tuple], kwargs: dict, summaries: List[dict]):
+    """Runs `process_recording` for each of `tasks` in turn in a single
+    worker process (see `_run_tasks`), appending to `summaries` as each finishes. The worker is
+    only replaced when it dies, in which case its task is reported as
+    failed."""
+    executor = None
+    try:
+        for path, output_path in tasks:
+            if executor is None:
+                executor = ProcessPoolExecutor(max_workers=1)
+            future = executor.submit(
+                process_recording, path, output_path, **kwargs
+            )
+            try:
+                summaries.append(future.result())
+            except BrokenProcessPool:
+                summaries.append(
+                    {
+                        "path": str(path),
+                        "output_path": None,
+                        "n_cycles": 0,
+                        "status": "failed",
+                        "error": "Worker process died",
+                    }
+                )
+                executor.shutdown()
+                executor = None
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    """Command line entry point for `run_batch`, e.g.
+
+        medical-waveforms-batch recordings/ output/ --name pressure
+
+    Run with --help for all options.
+    """
+    parser = argparse.ArgumentParser(
+        description=(
+            "Find cycles, extract cycle-level features and run arterial "
+            "pressure signal quality checks for many recordings."
+        )
+    )
+    parser.add_argument(
+        "source", help="Directory of recordings, or manifest file"
+    )
+    parser.add_argument("output_directory", help="Where to write results")
+    parser.add_argument(
+        "--name", required=True, help="Name of the waveform column"
+    )
+    parser.add_argument(
+        "--time-column-name", default="time", help="Name of the time column"
+    )
+    parser.add_argument("--scale", type=int, help="Trough finding scale")
+    parser.add_argument(
+        "--chunk-size", type=int, help="Trough finding chunk size"
+    )
+    parser.add_argument(
+        "--detector",
+        choices=list(DETECTORS),
+        default="ampd",
+        help="Trough detection algorithm",
+    )
+    parser.add_argument(
+        "--format", choices=list(WRITERS), default="parquet", dest="format"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="Process count"
+    )
+    args = parser.parse_args(argv)
+    detector_class = DETECTORS[args.detector]
+
+    summary = run_batch(
+        args.source,
+        args.output_directory,
+        name=args.name,
+        time_column_name=args.time_column_name,
+        scale=args.scale,
+        chunk_size=args.chunk_size,
+        detector=detector_class() if detector_class else None,
+        output_format=args.format,
+        max_workers=args.workers,
+    )
+    summary.to_csv(Path(args.output_directory) / "summary.csv", index=False)
+
+    n_failed = int(np.sum(summary.status == "failed"))
+    print(
+        f"Processed {len(summary)} recordings ({n_failed} failed). Summary "
+        f"written to {Path(args.output_directory) / 'summary.csv'}"
+    )
+
+
+if __name__ == "__main__":
+    main()
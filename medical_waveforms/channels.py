@@ -0,0 +1,154 @@
+import concurrent.futures
+from typing import Any, Dict, Optional, Sequence, Tuple, Type, Union
+
+import pandas as pd
+from pydantic import BaseModel
+
+from medical_waveforms import quality
+from medical_waveforms.features import cycles, waveform
+from medical_waveforms.waveforms import Waveforms
+
+
+class ChannelConfig(BaseModel):
+    """How to process one waveform channel (column) of a `Waveforms`.
+
+    Args:
+        scale: As for `medical_waveforms.features.waveform.find_troughs`
+        chunk_size: As for `medical_waveforms.features.waveform.find_troughs`
+        detector: As for `medical_waveforms.features.waveform.find_troughs`
+        feature_extractors: Cycle-level features to extract, beyond those
+            needed by `checks`
+        checks: Signal quality checks to run (see
+            `medical_waveforms.quality.check_cycles`), or None to skip them
+    """
+
+    scale: Optional[int] = None
+    chunk_size: Optional[int] = None
+    detector: Optional[Any] = None
+    feature_extractors: Tuple[Type[cycles.CycleFeatureExtractor], ...] = ()
+    checks: Optional[Any] = None
+
+
+def process_channel(
+    waveforms: Waveforms, name: str, config: ChannelConfig
+) -> Tuple[Waveforms, Optional[pd.DataFrame]]:
+    """Finds troughs, extracts cycle-level features and runs signal quality
+    checks for one waveform.
+
+    Args:
+        waveforms: `medical_waveforms.waveforms.Waveforms` instance holding your data
+        name: Name of column in `waveforms` to process
+        config: How to process the waveform
+
+    Returns:
+        `waveforms` with the troughs and features added
+        Output of `medical_waveforms.quality.check_cycles`, or None if
+            `config.checks` is None
+    """
+    waveforms = waveform.find_troughs(
+        waveforms,
+        name,
+        scale=config.scale,
+        chunk_size=config.chunk_size,
+        detector=config.detector,
+    )
+    for feature_extractor in config.feature_extractors:
+        waveforms = feature_extractor().ensure_feature(waveforms, name)
+    if config.checks is None:
+        return waveforms, None
+    return waveforms, quality.check_cycles(waveforms, name, config.checks)
+
+
+def process_channels(
+    waveforms: Waveforms,
+    configs: Union[ChannelConfig, Dict[str, ChannelConfig]],
+    names: Optional[Sequence[str]] = None,
+    use_processes: bool = False,
+    max_workers: Optional[int] = None,
+) -> Dict[str, Optional[pd.DataFrame]]:
+    """Runs `process_channel` for several waveforms at once.
+
+    By default the waveforms are processed on a thread pool, which is
+    effective because the bulk of the work is done by NumPy, which releases
+    Python's global interpreter lock. With `use_processes`, each waveform is
+    processed in a separate process instead, at the cost of copying it there
+    and copying its features back.
+
+    Args:
+        waveforms: `medical_waveforms.waveforms.Waveforms` instance holding your data
+        configs: How to process each waveform, keyed by waveform name, or a
+            single config to use for all of them
+        names: Names of the waveforms to process. If None, processes every
+            waveform in `configs` (or every waveform in `waveforms`, if
+            `configs` is a single config)
+        use_processes: Whether to use a process pool rather than a thread pool
+        max_workers: Maximum number of threads or processes. If None, uses
+            one per waveform
+
+    Returns:
+        Output of `medical_waveforms.quality.check_cycles` for each waveform
+            (None for waveforms without checks). `waveforms.features` holds
+            the troughs and features of each waveform.
+    """
+    if isinstance(configs, ChannelConfig):
+        configs = {name: configs for name in names or waveforms.names}
+    if names is None:
+        names = list(configs)
+    assert set(names) <= set(
+        waveforms.names
+    ), f"`names` must be a subset of {waveforms.names}"
+
+    executor: concurrent.futures.Executor
+    if use_processes:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers or len(names)
+        )
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers or len(names)
+        )
+
+    with executor:
+        if use_processes:
+            futures = {
+                name: executor.submit(
+                    _process_channel_copy,
+                    waveforms.select([name]),
+                    name,
+                    configs[name],
+                )
+                for name in names
+            }
+        else:
+            futures = {
+                name: executor.submit(
+                    process_channel, waveforms, name, configs[name]
+                )
+                for name in names
+            }
+
+        check_results = {}
+        for name, future in futures.items():
+            if use_processes:
+                features, check_results[name] = future.result()
+                # Troughs first, as setting them truncates derived features
+                waveforms.features.waveform[name].update(features["waveform"])
+                waveforms.features.cycles[name].update(features["cycles"])
+                waveforms.features.diffs[name].update(features["diffs"])
+            else:
+                _, check_results[name] = future.result()
+
+    return check_results
+
+
+def _process_channel_copy(
+    waveforms: Waveforms, name: str, config: ChannelConfig
+) -> Tuple[Dict[str, dict], Optional[pd.DataFrame]]:
+    """Runs `process_channel` on a copy of `waveforms` (e.g. in another
+    process) and returns its features as plain dicts."""
+    waveforms, check_results = process_channel(waveforms, name, config)
+    features = {
+        level: dict(getattr(waveforms.features, level)[name])
+        for level in ("waveform", "cycles", "diffs")
+    }
+    return features, check_results
@@ -0,0 +1,314 @@
+"""Out-of-core processing of recordings too large to hold in memory.
+
+`process_in_chunks` reads a recording as a stream of blocks of samples and
+emits the per-cycle features, absolute differences and signal quality check
+results block by block, holding only a bounded window of samples at once.
+"""
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from medical_waveforms import quality
+from medical_waveforms.batch import cycles_table
+from medical_waveforms.channels import ChannelConfig
+from medical_waveforms.features import waveform
+from medical_waveforms.waveforms import Waveforms
+
+
+def read_blocks(
+    path: Union[str, Path], block_size: int
+) -> Iterator[pd.DataFrame]:
+    """Reads a recording in blocks of `block_size` samples, without reading it
+    all at once.
+
+    Args:
+        path: The recording. Either a '.csv' file, a '.parquet' file (requires
+            pyarrow) or a '.npy' file holding a structured array (which is
+            memory-mapped).
+
+    Returns:
+        Iterator of DataFrames with one column per column in the recording
+    """
+    path = Path(path)
+    if path.suffix == ".csv":
+        yield from pd.read_csv(path, chunksize=block_size)
+    elif path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(block_size):
+            yield batch.to_pandas()
+    elif path.suffix == ".npy":
+        array = np.load(path, mmap_mode="r")
+        for block_start in range(0, array.size, block_size):
+            yield pd.DataFrame(array[block_start : block_start + block_size])
+    else:
+        raise ValueError(f"Can't read blocks from '{path.suffix}' files")
+
+
+def process_in_chunks(
+    blocks: Iterable[pd.DataFrame],
+    name: str,
+    config: Optional[ChannelConfig] = None,
+    chunk_size: int = 2**20,
+    overlap: Optional[int] = None,
+    context_cycles: int = 2,
+    time_column_name: str = "time",
+    hertz: Optional[float] = None,
+    start_time: float = 0.0,
+) -> Iterator[pd.DataFrame]:
+    """Finds troughs, extracts cycle-level features and runs signal quality
+    checks for one waveform in a recording read as a stream of blocks.
+
+    Troughs are found in chunks of `chunk_size` samples, exactly as by
+    `medical_waveforms.features.waveform.find_troughs` with the same
+    `chunk_size` and `overlap`. Features and checks for the cycles completed
+    in each chunk are then derived from just those cycles' samples (and
+    `context_cycles` earlier cycles). The output is the same as an in-memory
+    run of `medical_waveforms.channels.process_channel` with the same
+    `chunk_size`, as long as `context_cycles` covers any dependence of
+    features on earlier cycles. Peak memory depends on `chunk_size`,
+    `overlap` and the length of the longest cycles, not on the length of the
+    recording.
+
+    Args:
+        blocks: Successive blocks of samples of the recording (of any size),
+            e.g. from `read_blocks`. Each holds a timestamps column (unless
+            `hertz` is given) and a column `name`.
+        name: Name of the waveform column to process
+        config: How to process the waveform. If None, uses the default
+            `ChannelConfig`. `config.chunk_size` is ignored in favour of
+            `chunk_size`.
+        chunk_size: As for `find_troughs`
+        overlap: As for `find_troughs`
+        context_cycles: Number of cycles before each chunk's new cycles that
+            are also used to derive their features. Must be at least 1, so
+            that differences between cycles are correct. Features that depend
+            on further earlier cycles need more, e.g. at least 2 * `window`
+            for `medical_waveforms.quality.BaselineCheck`. The context always
+            starts at a multiple of `context_cycles` cycles, so
+            `medical_waveforms.features.morphology.TemplateCorrelation` also
+            matches if `context_cycles` is a multiple of its
+            `update_interval` and at least `update_interval` + `window`.
+        time_column_name: The name of the timestamps column
+        hertz: As for `medical_waveforms.waveforms.Waveforms`
+        start_time: As for `medical_waveforms.waveforms.Waveforms`
+
+    Returns:
+        Iterator of DataFrames in the same format as the output of
+            `medical_waveforms.batch.cycles_table`, one for each chunk with
+            completed cycles, indexed by cycle number. Indices are relative to
+            the start of the recording.
+    """
+    assert context_cycles >= 1, "`context_cycles` must be at least 1"
+    run = _ChunkedRun(
+        name=name,
+        config=ChannelConfig() if config is None else config,
+        chunk_size=chunk_size,
+        overlap=overlap,
+        context_cycles=context_cycles,
+        time_column_name=time_column_name,
+        hertz=hertz,
+        start_time=start_time,
+    )
+    for block in blocks:
+        run.append(block)
+        yield from run.process_chunks(final=False)
+    yield from run.process_chunks(final=True)
+
+
+class _ChunkedRun:
+    """State of `process_in_chunks`: the buffered samples, and the troughs of
+    the cycles that are yet to be emitted (or are context for them)."""
+
+    def __init__(
+        self,
+        name: str,
+        config: ChannelConfig,
+        chunk_size: int,
+        overlap: Optional[int],
+        context_cycles: int,
+        time_column_name: str,
+        hertz: Optional[float],
+        start_time: float,
+    ):
+        assert chunk_size > 0, "`chunk_size` must be positive"
+        self.name = name
+        self.config = config
+        self.detector = waveform._init_detector(config.scale, config.detector)
+        self.checks = (
+            None if config.checks is None else quality._compile(config.checks)
+        )
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.context_cycles = context_cycles
+        self.time_column_name = time_column_name
+        self.hertz = hertz
+        self.start_time = start_time
+        # As `find_troughs` would estimate it from the whole recording
+        self._sampling_rate: Optional[float] = None
+
+        # Samples from `buffer_start` onwards
+        self.buffer: Optional[pd.DataFrame] = None
+        self.buffer_start = 0
+        self.n_samples = 0
+        # Start of the next chunk to find troughs in
+        self.next_chunk = 0
+        # Troughs from cycle number `troughs_start` onwards
+        self.troughs = np.zeros(0, dtype=np.intp)
+        self.troughs_start = 0
+        # The first cycle not yet emitted
+        self.next_cycle = 0
+
+    def append(self, block: pd.DataFrame):
+        if self.buffer is None:
+            self.buffer = block.reset_index(drop=True)
+        else:
+            self.buffer = pd.concat([self.buffer, block], ignore_index=True)
+        self.n_samples += len(block)
+
+    def process_chunks(self, final: bool) -> Iterator[pd.DataFrame]:
+        """Finds troughs in every chunk that can be processed, then emits the
+        cycles that they complete."""
+        if self.n_samples == 0:
+            return
+        if self._sampling_rate is None:
+            if self.n_samples <= 1000 and not final:
+                # Wait for enough samples to estimate the sampling rate
+                return
+            self._sampling_rate = waveform._sampling_rate(
+                Waveforms(
+                    self.buffer.iloc[:1001],
+                    self.time_column_name,
+                    hertz=self.hertz,
+                )
+            )
+        if self.overlap is None:
+            self.overlap = self.detector.context(self._sampling_rate) or (
+                self.chunk_size // 2
+            )
+
+        window_size = self.chunk_size + 2 * self.overlap
+        if (
+            final
+            and self.next_chunk == 0
+            and (self.n_samples <= self.chunk_size)
+        ):
+            # The whole recording fits in one chunk, which isn't padded
+            self._find_troughs(0, self.n_samples)
+            self.next_chunk = self.n_samples
+        # Until the end of the recording, only chunks whose whole window has
+        #  arrived, so that the window isn't shifted or truncated
+        while self.next_chunk < self.n_samples and (
+            final
+            or max(self.next_chunk - self.overlap, 0) + window_size
+            <= self.n_samples
+        ):
+            # As in `waveform._find_troughs_chunked`, windows at the end of
+            #  the recording are shifted inwards
+            window_start = max(
+                min(
+                    self.next_chunk - self.overlap,
+                    self.n_samples - window_size,
+                ),
+                0,
+            )
+            self._find_troughs(
+                window_start, min(window_start + window_size, self.n_samples)
+            )
+            self.next_chunk += self.chunk_size
+
+        cycles = self._emit_cycles()
+        if cycles is not None:
+            yield cycles
+        self._trim(window_size)
+
+    def _find_troughs(self, window_start: int, window_end: int):
+        chunk_end = min(self.next_chunk + self.chunk_size, self.n_samples)
+        x = self.buffer[self.name].to_numpy()[
+            window_start - self.buffer_start : window_end - self.buffer_start
+        ]
+        troughs = window_start + self.detector.detect(x, self._sampling_rate)
+        self.troughs = np.concatenate(
+            [
+                self.troughs,
+                troughs[(troughs >= self.next_chunk) & (troughs < chunk_end)],
+            ]
+        )
+
+    def _emit_cycles(self) -> Optional[pd.DataFrame]:
+        """Derives the features of the cycles completed since the last call,
+        and those of the context cycles before them."""
+        last_cycle = self.troughs_start + self.troughs.size - 2
+        if last_cycle < self.next_cycle:
+            return None
+
+        first_cycle = self._context_start(self.next_cycle)
+        troughs = self.troughs[
+            first_cycle
+            - self.troughs_start : last_cycle
+            + 2
+            - self.troughs_start
+        ]
+        samples = self.buffer.iloc[
+            troughs[0]
+            - self.buffer_start : troughs[-1]
+            + 1
+            - self.buffer_start
+        ].reset_index(drop=True)
+        local_start_time = self.start_time
+        if self.hertz is not None:
+            local_start_time += troughs[0] / self.hertz
+        waveforms = Waveforms(
+            samples,
+            self.time_column_name,
+            hertz=self.hertz,
+            start_time=local_start_time,
+        )
+        waveforms.features.waveform[self.name]["troughs"] = (
+            troughs - troughs[0]
+        )
+
+        for feature_extractor in self.config.feature_extractors:
+            waveforms = feature_extractor().ensure_feature(
+                waveforms, self.name
+            )
+        if self.checks is None:
+            checked = pd.DataFrame(index=pd.RangeIndex(troughs.size - 1))
+        else:
+            checked = self.checks.run(waveforms, self.name)
+
+        table = (
+            cycles_table(waveforms, self.name, checked)
+            .iloc[self.next_cycle - first_cycle :]
+            .copy()
+        )
+        table["start_index"] += troughs[0]
+        table["end_index"] += troughs[0]
+        table.index = pd.RangeIndex(self.next_cycle, last_cycle + 1)
+        self.next_cycle = last_cycle + 1
+        return table
+
+    def _trim(self, window_size: int):
+        """Discards the samples and troughs that no later chunk or cycle
+        needs."""
+        first_cycle = self._context_start(self.next_cycle)
+        self.troughs = self.troughs[max(first_cycle - self.troughs_start, 0) :]
+        self.troughs_start = max(first_cycle, self.troughs_start)
+
+        # The window of the next chunk may be shifted inwards by the end of
+        #  the recording
+        keep_from = max(self.next_chunk - window_size, 0)
+        if self.troughs.size:
+            keep_from = min(keep_from, int(self.troughs[0]))
+        if keep_from > self.buffer_start:
+            self.buffer = self.buffer.iloc[
+                keep_from - self.buffer_start :
+            ].reset_index(drop=True)
+            self.buffer_start = keep_from
+
+    def _context_start(self, cycle: int) -> int:
+        """First context cycle for cycles from `cycle` onwards."""
+        context = self.context_cycles
+        return max((cycle - context) // context * context, 0)
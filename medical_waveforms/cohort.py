@@ -0,0 +1,495 @@
+"""Many recordings held together for cohort-scale processing.
+
+A `Cohort` stores the samples of every recording in one buffer per column,
+with offsets marking where each recording starts, and the troughs and
+cycle-level features of every recording in one flat array each. Troughs are
+found record by record, but cycle-level features, absolute differences and
+signal quality checks are then derived for every cycle of every record at
+once, with segment reductions (see `medical_waveforms.features.segments`)
+over the cycles' bounds in the shared buffer:
+
+    cohort = Cohort({"bed-1": data_1, "bed-2": data_2})
+    cohort.find_troughs("pressure")
+    checked = cohort.check_cycles("pressure", ArterialPressureChecks())
+    checked.loc["bed-2"]
+
+Results are indexed by record and by cycle number within each record, and can
+be split back into one result per record with `Cohort.split`, or taken for a
+single record as a `medical_waveforms.waveforms.Waveforms` with
+`Cohort.record`.
+"""
+from typing import (
+    Callable,
+    Dict,
+    Hashable,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel
+
+from medical_waveforms import quality
+from medical_waveforms.features import cycles, morphology, rolling, waveform
+from medical_waveforms.waveforms import (
+    ColumnStore,
+    UniformTimeAxis,
+    Waveforms,
+    compute_dtype,
+)
+
+
+class Cohort:
+    """Holds many recordings of the same waveforms in shared buffers, for
+    processing them all at once."""
+
+    def __init__(
+        self,
+        records: Union[Mapping[Hashable, ColumnStore], Sequence[ColumnStore]],
+        time_column_name: str = "time",
+        hertz: Optional[float] = None,
+        dtype: Optional[np.dtype] = None,
+    ):
+        """
+        Args:
+            records: The recordings, keyed by record ID, or a sequence of them
+                (in which case their IDs are their positions). Each is as for
+                `medical_waveforms.waveforms.Waveforms`, and all must have the
+                same columns. Their samples are copied into the shared
+                buffers.
+            time_column_name: As for `Waveforms`
+            hertz: As for `Waveforms`, for every recording. Each recording's
+                timestamps then start at 0.
+            dtype: As for `Waveforms`
+        """
+        if not isinstance(records, Mapping):
+            records = dict(enumerate(records))
+        assert records, "`records` mustn't be empty"
+        self.record_ids: Tuple[Hashable, ...] = tuple(records)
+        self.time_column_name = time_column_name
+        self.hertz = hertz
+        self._positions = {
+            record_id: position
+            for position, record_id in enumerate(self.record_ids)
+        }
+
+        recordings = [
+            Waveforms(record, time_column_name, hertz)
+            for record in records.values()
+        ]
+        self.columns = recordings[0].columns
+        for record_id, recording in zip(self.record_ids, recordings):
+            assert recording.columns == self.columns, (
+                f"Record '{record_id}' must have the columns "
+                f"{list(self.columns)}"
+            )
+        self.names = recordings[0].names
+
+        # Record i's samples are [offsets[i], offsets[i + 1]) of each buffer
+        self.offsets = np.zeros(self.n_records + 1, dtype=np.intp)
+        np.cumsum(
+            [recording.n_samples for recording in recordings],
+            out=self.offsets[1:],
+        )
+        self.buffers: Dict[str, np.ndarray] = {
+            column: np.concatenate(
+                [recording.column(column) for recording in recordings],
+                dtype=None if column == time_column_name else dtype,
+            )
+            for column in self.columns
+        }
+
+        # Trough indices (into the buffers) of every record, with record i's
+        #  at [trough_offsets[name][i], trough_offsets[name][i + 1])
+        self.troughs: Dict[str, np.ndarray] = {}
+        self.trough_offsets: Dict[str, np.ndarray] = {}
+        # Cycle-level features and their absolute differences for every cycle
+        #  of every record, with record i's at [cycle_offsets(name)[i],
+        #  cycle_offsets(name)[i + 1])
+        self.cycles: Dict[str, Dict[str, np.ndarray]] = {
+            name: {} for name in self.names
+        }
+        self.diffs: Dict[str, Dict[str, np.ndarray]] = {
+            name: {} for name in self.names
+        }
+
+    def __len__(self) -> int:
+        return self.n_records
+
+    @property
+    def n_records(self) -> int:
+        """The number of recordings."""
+        return len(self.record_ids)
+
+    @property
+    def n_samples(self) -> int:
+        """The total number of samples in each column, across recordings."""
+        return int(self.offsets[-1])
+
+    @property
+    def times(self) -> Union[np.ndarray, UniformTimeAxis]:
+        """Timestamps (seconds) of every sample, as for `Waveforms.times`.
+
+        If `self.hertz` is not None, this is one `UniformTimeAxis` over the
+        whole buffer, so timestamps are measured from the start of the first
+        record. Differences between timestamps within a record (e.g. cycle
+        durations) are still correct.
+        """
+        if self.hertz is not None:
+            return UniformTimeAxis(self.hertz, self.n_samples)
+        return self.buffers[self.time_column_name]
+
+    def record(self, record_id: Hashable) -> Waveforms:
+        """Gets one recording, with its troughs, cycle-level features and
+        absolute differences.
+
+        Args:
+            record_id: ID of the recording
+
+        Returns:
+            `Waveforms` whose columns and features are views of the cohort's
+                buffers and features
+        """
+        position = self._positions[record_id]
+        recording = self._recording(position)
+        start = self.offsets[position]
+        for name in self.troughs:
+            first, last = self.trough_offsets[name][position : position + 2]
+            features = recording.features
+            # Troughs first, as changing them truncates cycle-level features
+            features.waveform[name]["troughs"] = (
+                self.troughs[name][first:last] - start
+            )
+            cycle_slice = self._cycle_slice(name, position)
+            features.cycles[name].update(
+                (key, feature[cycle_slice])
+                for key, feature in self.cycles[name].items()
+            )
+            features.diffs[name].update(
+                (key, feature[cycle_slice])
+                for key, feature in self.diffs[name].items()
+            )
+        return recording
+
+    def find_troughs(
+        self,
+        name: str,
+        scale: Optional[int] = None,
+        chunk_size: Optional[int] = None,
+        overlap: Optional[int] = None,
+        detector: Optional[waveform.TroughDetector] = None,
+    ) -> "Cohort":
+        """Finds the troughs of a waveform in each recording, as
+        `medical_waveforms.features.waveform.find_troughs` does. Any
+        features previously derived for the waveform are discarded.
+
+        Args:
+            name: Name of the waveform to find troughs in
+            scale: As for `find_troughs`
+            chunk_size: As for `find_troughs`
+            overlap: As for `find_troughs`
+            detector: As for `find_troughs`
+
+        Returns:
+            This cohort, with the troughs at `self.troughs[name]`
+        """
+        troughs = []
+        for position in range(self.n_records):
+            recording = waveform.find_troughs(
+                self._recording(position),
+                name,
+                scale=scale,
+                chunk_size=chunk_size,
+                overlap=overlap,
+                detector=detector,
+            )
+            troughs.append(
+                self.offsets[position]
+                + recording.features.waveform[name].get(
+                    "troughs", np.zeros(0, dtype=np.intp)
+                )
+            )
+        self.troughs[name] = np.concatenate(troughs).astype(np.intp)
+        self.trough_offsets[name] = np.zeros(self.n_records + 1, np.intp)
+        np.cumsum(
+            [record_troughs.size for record_troughs in troughs],
+            out=self.trough_offsets[name][1:],
+        )
+        self.cycles[name] = {}
+        self.diffs[name] = {}
+        return self
+
+    def cycle_offsets(self, name: str) -> np.ndarray:
+        """Where each record's cycles start in the flat arrays of cycle-level
+        features of waveform `name`, followed by the total number of
+        cycles."""
+        self._require_troughs(name)
+        n_cycles = np.maximum(np.diff(self.trough_offsets[name]) - 1, 0)
+        offsets = np.zeros(self.n_records + 1, dtype=np.intp)
+        np.cumsum(n_cycles, out=offsets[1:])
+        return offsets
+
+    def n_cycles(self, name: str) -> int:
+        """The total number of cycles of waveform `name`, across recordings."""
+        return int(self.cycle_offsets(name)[-1])
+
+    def cycle_bounds(self, name: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Makes the start and end sample indices (into the buffers) of every
+        cycle of every record, as for
+        `medical_waveforms.features.segments.cycle_bounds`.
+
+        Successive troughs only bound a cycle if they are in the same record,
+        so the cycles leave gaps where one record ends and the next starts.
+        """
+        self._require_troughs(name)
+        troughs = self.troughs[name]
+        in_record = np.ones(max(troughs.size - 1, 0), dtype=bool)
+        # The last trough of each record and the first of the next
+        last_troughs = self.trough_offsets[name][1:-1] - 1
+        in_record[
+            last_troughs[(last_troughs >= 0) & (last_troughs < in_record.size)]
+        ] = False
+        return troughs[:-1][in_record], troughs[1:][in_record]
+
+    def cycle_index(self, name: str) -> pd.MultiIndex:
+        """Index of every cycle of waveform `name`, by record ID ('record')
+        and cycle number within the record ('cycle')."""
+        offsets = self.cycle_offsets(name)
+        n_cycles = np.diff(offsets)
+        positions = np.repeat(np.arange(self.n_records), n_cycles)
+        return pd.MultiIndex(
+            levels=[
+                pd.Index(self.record_ids),
+                pd.RangeIndex(int(n_cycles.max(initial=0))),
+            ],
+            codes=[positions, np.arange(offsets[-1]) - offsets[positions]],
+            names=["record", "cycle"],
+        )
+
+    def extract_feature(
+        self,
+        name: str,
+        feature_extractor: Type[cycles.CycleFeatureExtractor],
+    ) -> np.ndarray:
+        """Extracts a cycle-level feature for every cycle of every record,
+        unless it is already held.
+
+        Features that depend only on each cycle's own samples (those of
+        `medical_waveforms.features.cycles.SegmentFeatureExtractor`s and
+        `medical_waveforms.features.morphology.MorphologyFeatureExtractor`s
+        that don't override `_compute_from_cycle`) are computed for the whole
+        cohort at once. Others, such as
+        `medical_waveforms.features.morphology.TemplateCorrelation`, depend on
+        neighbouring cycles, so are extracted record by record.
+
+        Args:
+            name: Name of the waveform to extract the feature from
+            feature_extractor: Extractor class for the feature
+
+        Returns:
+            The feature for every cycle, which is also held at
+                `self.cycles[name][feature_extractor.class_name]`
+        """
+        fe = feature_extractor()
+        features = self.cycles[name]
+        if fe.class_name in features:
+            return features[fe.class_name]
+
+        if _depends_only_on_own_cycle(fe, cycles.SegmentFeatureExtractor):
+            starts, ends = self.cycle_bounds(name)
+            if starts.size == 0:
+                feature = np.empty(
+                    0, dtype=compute_dtype(self.buffers[name].dtype)
+                )
+            else:
+                feature = fe.compute(
+                    values=self.buffers[name],
+                    times=self.times,
+                    starts=starts,
+                    ends=ends,
+                )
+        elif _depends_only_on_own_cycle(
+            fe, morphology.MorphologyFeatureExtractor
+        ):
+            feature = fe.compute(
+                resampled=self.extract_feature(name, fe.resampled_cycles),
+                durations=self.extract_feature(name, cycles.Duration),
+            )
+        else:
+            feature = self._derive_by_record(
+                name, fe.class_name, lambda wf: fe.ensure_feature(wf, name)
+            )
+        features[fe.class_name] = feature
+        return feature
+
+    def calculate_absolute_diffs(
+        self,
+        name: str,
+        feature_extractor: Type[cycles.CycleFeatureExtractor],
+    ) -> np.ndarray:
+        """Calculates the absolute differences between successive values of a
+        cycle-level feature within each record, as
+        `medical_waveforms.features.diffs.calculate_absolute_diffs` does,
+        unless they are already held.
+
+        Args:
+            name: Name of the waveform to extract the feature from
+            feature_extractor: Extractor class for the feature
+
+        Returns:
+            The differences for every cycle (0 for the first cycle of each
+                record), which are also held at
+                `self.diffs[name][feature_extractor.class_name]`
+        """
+        fe = feature_extractor()
+        if fe.class_name in self.diffs[name]:
+            return self.diffs[name][fe.class_name]
+
+        feature = self.extract_feature(name, feature_extractor)
+        differences = np.abs(np.diff(feature, prepend=feature[:1]))
+        # The first cycle of each record has no previous cycle
+        first_cycles = self.cycle_offsets(name)[:-1]
+        differences[first_cycles[first_cycles < differences.size]] = 0
+        self.diffs[name][fe.class_name] = differences
+        return differences
+
+    def check_cycles(
+        self, name: str, checks: Union[BaseModel, quality.CheckPlan]
+    ) -> pd.DataFrame:
+        """Runs signal quality checks for every cycle of every record at once,
+        as `medical_waveforms.quality.check_cycles` does for one recording.
+
+        Features and differences are derived with `extract_feature` and
+        `calculate_absolute_diffs`, reusing any that are already held.
+        Deviations from rolling baselines (for
+        `medical_waveforms.quality.BaselineCheck`s) are calculated record by
+        record.
+
+        Args:
+            name: Name of the waveform to check
+            checks: As for `check_cycles`
+
+        Returns:
+            DataFrame in the same format as the output of `check_cycles`, but
+                with a row for every cycle of every record, indexed by
+                `cycle_index`
+        """
+        plan = quality._compile(checks)
+        sources = []
+        for level, feature_extractor, *window in plan.sources:
+            if level == "cycles":
+                sources.append(self.extract_feature(name, feature_extractor))
+            elif level == "diffs":
+                sources.append(
+                    self.calculate_absolute_diffs(name, feature_extractor)
+                )
+            else:
+                sources.append(
+                    self._baseline_deviation(name, feature_extractor, *window)
+                )
+        passed = plan._compare(sources, self.n_cycles(name))
+        checked_df = pd.DataFrame(
+            dict(zip(plan.check_names, passed)), index=self.cycle_index(name)
+        )
+        checked_df["all"] = passed.all(axis=0)
+        return checked_df
+
+    def split(
+        self, name: str, values: Union[np.ndarray, pd.DataFrame]
+    ) -> Dict[Hashable, Union[np.ndarray, pd.DataFrame]]:
+        """Splits results for every cycle of waveform `name` (e.g. a feature,
+        or the output of `check_cycles`) into the results for each record.
+
+        Returns:
+            Mapping from record ID to that record's results: views of array
+                `values`, or rows of DataFrame `values` indexed by cycle
+                number within the record
+        """
+        offsets = self.cycle_offsets(name)
+        assert len(values) == offsets[-1], (
+            f"`values` must have one element per cycle ({offsets[-1]}), "
+            f"not {len(values)}"
+        )
+        split = {}
+        for position, record_id in enumerate(self.record_ids):
+            cycle_slice = slice(offsets[position], offsets[position + 1])
+            if isinstance(values, pd.DataFrame):
+                split[record_id] = values.iloc[cycle_slice].reset_index(
+                    drop=True
+                )
+            else:
+                split[record_id] = values[cycle_slice]
+        return split
+
+    def _recording(self, position: int) -> Waveforms:
+        """The recording at `position`, without any features."""
+        start, end = self.offsets[position : position + 2]
+        return Waveforms(
+            {
+                column: self.buffers[column][start:end]
+                for column in self.columns
+            },
+            self.time_column_name,
+            self.hertz,
+        )
+
+    def _cycle_slice(self, name: str, position: int) -> slice:
+        offsets = self.cycle_offsets(name)
+        return slice(offsets[position], offsets[position + 1])
+
+    def _require_troughs(self, name: str):
+        assert (
+            name in self.troughs
+        ), f"Troughs haven't been found for '{name}': see `find_troughs`"
+
+    def _derive_by_record(
+        self, name: str, key: str, derive: Callable[[Waveforms], Waveforms]
+    ) -> np.ndarray:
+        """Derives a cycle-level feature for each record with cycles in turn,
+        with `derive`, and joins them."""
+        n_cycles = np.diff(self.cycle_offsets(name))
+        features = [
+            derive(self.record(record_id)).features.cycles[name][key]
+            for record_id, record_n_cycles in zip(self.record_ids, n_cycles)
+            if record_n_cycles > 0
+        ]
+        return np.concatenate(features) if features else np.zeros(0)
+
+    def _baseline_deviation(
+        self,
+        name: str,
+        feature_extractor: Type[cycles.CycleFeatureExtractor],
+        window: Optional[int],
+        span: Optional[float],
+    ) -> np.ndarray:
+        """As for `medical_waveforms.features.rolling.
+        calculate_baseline_deviation`, for every cycle of every record."""
+        key = rolling.rolling_key(feature_extractor, "deviation", window, span)
+        if key not in self.cycles[name]:
+            # The feature itself is extracted for the whole cohort at once
+            self.extract_feature(name, feature_extractor)
+            self.cycles[name][key] = self._derive_by_record(
+                name,
+                key,
+                lambda wf: rolling.calculate_baseline_deviation(
+                    wf, name, feature_extractor, window, span
+                ),
+            )
+        return self.cycles[name][key]
+
+
+def _depends_only_on_own_cycle(
+    fe: cycles.CycleFeatureExtractor, base: type
+) -> bool:
+    """Whether `fe` is a `base` whose feature for each cycle depends only on
+    that cycle, i.e. that doesn't override `base._compute_from_cycle` (as
+    `medical_waveforms.features.morphology.TemplateCorrelation` does)."""
+    return (
+        isinstance(fe, base)
+        and type(fe)._compute_from_cycle is base._compute_from_cycle
+    )
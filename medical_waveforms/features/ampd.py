@@ -0,0 +1,236 @@
+"""Trough finding with the automatic multiscale-based peak detection (AMPD)
+algorithm.
+
+This follows the extended AMPD implementation in the pyampd package
+(`pyampd.ampd.find_peaks`), applied to troughs rather than peaks, and finds
+the same troughs. Unlike pyampd:
+
+- The signal is only ever read (through views), so it may be shared with
+  other threads or be memory-mapped, and no full-size copy of it is made.
+- The (scale, timestep) local scalogram matrix is never stored. It is
+  computed block by block twice: once to count the troughs at each scale,
+  and once to find the troughs that persist on all scales up to the scale
+  with the most. So working memory is bounded by `max_bytes`, whatever the
+  length of the signal and the scale.
+- If no scale is given, it is estimated from the signal's dominant cycle
+  length rather than set to half the length of the signal.
+"""
+from typing import Optional
+
+import numpy as np
+
+DEFAULT_MAX_BYTES = 2**21
+
+# Working memory per timestep of a block: a float64 index and float64
+#  differences, plus Boolean comparisons, scale results and trough results
+BYTES_PER_TIMESTEP = 8 + 8 + 1 + 1 + 1
+
+# Working memory per sample of the excerpt used to estimate the scale: a
+#  float64 copy of it, its complex128 real Fourier transform (half as long)
+#  and the float64 power spectrum (also half as long), with headroom for the
+#  Fourier transform's own work space
+BYTES_PER_SPECTRUM_SAMPLE = 2 * (8 + 8 + 4)
+
+MAX_SPECTRUM_SAMPLES = 2**16
+
+
+def find_troughs(
+    x: np.ndarray,
+    scale: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+) -> np.ndarray:
+    """Finds troughs in a quasi-periodic signal with AMPD.
+
+    Args:
+        x: The signal. This isn't modified.
+        scale: The maximum scale window size is (2 * scale + 1). Time taken is
+            proportional to len(`x`) * `scale`. If None, uses
+            `estimate_scale`.
+        max_bytes: Upper limit on working memory (bytes), excluding `x` and
+            the trough indices. Smaller limits process the signal in
+            smaller blocks, which is slower. If None, uses
+            `DEFAULT_MAX_BYTES`.
+
+    Returns:
+        Sorted indices of the troughs in `x`
+    """
+    if max_bytes is None:
+        max_bytes = DEFAULT_MAX_BYTES
+    n_timesteps = x.size
+    if scale is None:
+        scale = estimate_scale(x, max_bytes)
+    n_scales = min(scale, n_timesteps // 2)
+    if n_scales == 0:
+        return np.zeros(0, dtype=np.intp)
+
+    # The number of troughs at each scale and their weights are int64
+    scales_bytes = 2 * 8 * n_scales
+    block_size = (max_bytes - scales_bytes) // BYTES_PER_TIMESTEP
+    if block_size < 1:
+        raise ValueError(
+            f"`max_bytes` must be more than {scales_bytes} for this `scale`"
+        )
+    block_size = min(block_size, n_timesteps)
+    buffers = _Buffers(block_size)
+    slope = _trend_slope(x, buffers)
+
+    # Count the troughs at each scale
+    n_troughs = np.zeros(n_scales, dtype=np.int64)
+    for block_start in range(0, n_timesteps, block_size):
+        block_end = min(block_start + block_size, n_timesteps)
+        for k in range(1, n_scales + 1):
+            n_troughs[k - 1] += np.count_nonzero(
+                _is_trough_at_scale(
+                    x, k, slope, block_start, block_end, buffers
+                )
+            )
+
+    # Find the scale with the most troughs, adjusting for edge regions
+    n_troughs *= np.arange(n_timesteps // 2, n_timesteps // 2 - n_scales, -1)
+    trough_scale = int(np.argmax(n_troughs))
+    if trough_scale == 0:
+        return np.zeros(0, dtype=np.intp)
+
+    # Keep the troughs that persist on all scales up to `trough_scale`
+    troughs = np.empty(64, dtype=np.intp)
+    n_found = 0
+    for block_start in range(0, n_timesteps, block_size):
+        block_end = min(block_start + block_size, n_timesteps)
+        persistent = buffers.persistent[: block_end - block_start]
+        persistent.fill(True)
+        for k in range(1, trough_scale + 1):
+            persistent &= _is_trough_at_scale(
+                x, k, slope, block_start, block_end, buffers
+            )
+        block_troughs = np.flatnonzero(persistent)
+        if n_found + block_troughs.size > troughs.size:
+            troughs = np.concatenate(
+                [
+                    troughs[:n_found],
+                    np.empty(max(n_found, block_troughs.size), dtype=np.intp),
+                ]
+            )
+        troughs[n_found : n_found + block_troughs.size] = (
+            block_start + block_troughs
+        )
+        n_found += block_troughs.size
+    return troughs[:n_found].copy()
+
+
+def estimate_scale(x: np.ndarray, max_bytes: Optional[int] = None) -> int:
+    """Estimates a suitable AMPD `scale` for a signal, as the length of its
+    dominant cycle.
+
+    The dominant cycle is found from the power spectrum of (at most
+    `MAX_SPECTRUM_SAMPLES` of) the start of the signal, ignoring cycles too
+    long to repeat at least twice in that excerpt.
+
+    Args:
+        x: The signal. This isn't modified.
+        max_bytes: As for `find_troughs`
+
+    Returns:
+        Estimated scale (timesteps)
+    """
+    if max_bytes is None:
+        max_bytes = DEFAULT_MAX_BYTES
+    n_samples = min(
+        x.size, MAX_SPECTRUM_SAMPLES, max_bytes // BYTES_PER_SPECTRUM_SAMPLE
+    )
+    if n_samples < 8:
+        return x.size // 2
+
+    excerpt = np.array(x[:n_samples], dtype=float)
+    excerpt -= excerpt.mean()
+    spectrum = np.fft.rfft(excerpt)
+    del excerpt
+    power = np.abs(spectrum, out=np.empty(spectrum.size))
+    power **= 2
+    # Skip the constant and single-cycle components
+    cycles_per_excerpt = 2 + int(np.argmax(power[2:]))
+    return int(np.ceil(n_samples / cycles_per_excerpt))
+
+
+class _Buffers:
+    """Preallocated working arrays for processing blocks of a signal."""
+
+    def __init__(self, block_size: int):
+        self.index = np.arange(block_size, dtype=float)
+        self.differences = np.empty(block_size, dtype=float)
+        self.comparison = np.empty(block_size, dtype=bool)
+        self.is_trough = np.empty(block_size, dtype=bool)
+        self.persistent = np.empty(block_size, dtype=bool)
+
+
+def _is_trough_at_scale(
+    x: np.ndarray,
+    k: int,
+    slope: float,
+    block_start: int,
+    block_end: int,
+    buffers: _Buffers,
+) -> np.ndarray:
+    """Finds where the detrended `x` is lower than both its neighbours `k`
+    timesteps away, for timesteps [`block_start`, `block_end`). This is one
+    block of one row of the local scalogram matrix. Returns a view of
+    `buffers.is_trough`.
+
+    Subtracting the linear trend (`slope` per timestep) from both sides of a
+    comparison between timesteps i and i + k just offsets their difference by
+    `slope` * k, so the detrended signal is never needed.
+    """
+    n_timesteps = x.size
+    offset = slope * k
+    is_trough = buffers.is_trough[: block_end - block_start]
+    is_trough.fill(True)
+
+    # Right neighbours: x[i + k] - x[i] > offset, for i < n_timesteps - k
+    #  (differences are taken in float64, so integer samples can't overflow)
+    end = min(block_end, n_timesteps - k)
+    if end > block_start:
+        n = end - block_start
+        np.subtract(
+            x[block_start + k : end + k],
+            x[block_start:end],
+            out=buffers.differences[:n],
+            dtype=float,
+        )
+        np.greater(buffers.differences[:n], offset, out=buffers.comparison[:n])
+        is_trough[:n] &= buffers.comparison[:n]
+
+    # Left neighbours: x[i] - x[i - k] < offset, for i >= k
+    start = max(block_start, k)
+    if block_end > start:
+        n = block_end - start
+        np.subtract(
+            x[start:block_end],
+            x[start - k : block_end - k],
+            out=buffers.differences[:n],
+            dtype=float,
+        )
+        np.less(buffers.differences[:n], offset, out=buffers.comparison[:n])
+        is_trough[start - block_start :] &= buffers.comparison[:n]
+
+    return is_trough
+
+
+def _trend_slope(x: np.ndarray, buffers: _Buffers) -> float:
+    """Slope of the least-squares linear fit to `x` against timestep index,
+    accumulated block by block."""
+    n_timesteps = x.size
+    if n_timesteps < 2:
+        return 0.0
+    block_size = buffers.index.size
+    total, weighted_total = 0.0, 0.0
+    for block_start in range(0, n_timesteps, block_size):
+        block = x[block_start : block_start + block_size]
+        n = block.size
+        block_total = float(block.sum(dtype=float))
+        np.multiply(block, buffers.index[:n], out=buffers.differences[:n])
+        total += block_total
+        weighted_total += (
+            block_start * block_total + buffers.differences[:n].sum()
+        )
+    mean_index = (n_timesteps - 1) / 2
+    sum_of_squares = n_timesteps * (n_timesteps**2 - 1) / 12
+    return (weighted_total - mean_index * total) / sum_of_squares
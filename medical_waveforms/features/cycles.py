@@ -1,35 +1,141 @@
 from abc import ABC, abstractmethod
-from typing import List
+from collections.abc import Sequence
+from typing import Iterator, List, NamedTuple, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
 
-from ..waveforms import Waveforms
+from ..waveforms import UniformTimeAxis, Waveforms, compute_dtype
+from . import segments
 
 
-def get_cycles(waveforms: Waveforms, name: str) -> List[pd.DataFrame]:
-    """Makes a list of the individual cycles from a waveform. This is useful
-    for per-cycle feature extraction.
+class Cycle(NamedTuple):
+    """The samples of one cycle, including the troughs at its start and end."""
+
+    times: np.ndarray
+    values: np.ndarray
+
+
+class CycleViews(Sequence):
+    """The cycles of a waveform, as a lazy sequence of `Cycle`s.
+
+    Each cycle's values are a NumPy view of the waveform, made only when that
+    cycle is accessed, so there is no per-cycle copying or pandas overhead.
+    Its timestamps are also a view, unless the waveform has a
+    `medical_waveforms.waveforms.UniformTimeAxis`, in which case they are
+    worked out on demand. Slicing gives another `CycleViews`.
+    """
+
+    def __init__(
+        self,
+        values: np.ndarray,
+        times: Union[np.ndarray, UniformTimeAxis],
+        starts: np.ndarray,
+        ends: np.ndarray,
+    ):
+        """
+        Args:
+            values: Waveform samples
+            times: Timestamps (seconds) corresponding to `values`
+            starts: Index of the starting trough of each cycle
+            ends: Index of the ending trough of each cycle
+        """
+        self.values = values
+        self.times = times
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self) -> int:
+        return self.starts.size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return CycleViews(
+                self.values, self.times, self.starts[index], self.ends[index]
+            )
+        return self._cycle(self.starts[index], self.ends[index])
+
+    def __iter__(self) -> Iterator[Cycle]:
+        for start, end in zip(self.starts, self.ends):
+            yield self._cycle(start, end)
+
+    def batches(
+        self, batch_size: int
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+        """Iterates over the cycles in batches, for bulk processing.
+
+        Args:
+            batch_size: Number of cycles per batch
+
+        Yields:
+            The samples spanned by a batch of cycles (as views) and the cycles'
+                bounds within them, i.e. the arguments of
+                `SegmentFeatureExtractor.compute`
+        """
+        for first in range(0, len(self), batch_size):
+            starts = self.starts[first : first + batch_size]
+            ends = self.ends[first : first + batch_size]
+            start, end = starts.min(), ends.max() + 1
+            yield (
+                self.values[start:end],
+                self.times[start:end],
+                starts - start,
+                ends - start,
+            )
+
+    def _cycle(self, start: int, end: int) -> Cycle:
+        return Cycle(
+            times=np.asarray(self.times[start : end + 1]),
+            values=self.values[start : end + 1],
+        )
+
+
+def get_cycles(
+    waveforms: Waveforms, name: str, as_dataframes: bool = False
+) -> Union[CycleViews, List[pd.DataFrame]]:
+    """Gets the individual cycles from a waveform. This is useful for per-cycle
+    feature extraction.
 
     Each cycle includes the troughs at its start and end.
 
     Args:
         waveforms: `medical_waveforms.waveforms.Waveforms` instance holding your data
         name: Name of column in `waveforms` to get cycles for
+        as_dataframes: If True, makes a list of DataFrames instead, each
+            holding every column of `waveforms` for one cycle. This is much
+            slower and uses more memory for long recordings.
 
     Returns:
         Each element contains data from one cycle (e.g. a heartbeat)
     """
-    return [
-        waveforms.waveforms.iloc[
-            waveforms.features.waveform[name]["troughs"][
-                cycle_i
-            ] : waveforms.features.waveform[name]["troughs"][cycle_i + 1]
-            + 1
+    starts, ends = segments.cycle_bounds(
+        waveforms.features.waveform[name]["troughs"]
+    )
+    if not as_dataframes:
+        return CycleViews(
+            waveforms.column(name), waveforms.times, starts, ends
+        )
+    if (
+        isinstance(waveforms.waveforms, pd.DataFrame)
+        and waveforms.hertz is None
+    ):
+        return [
+            waveforms.waveforms.iloc[start : end + 1]
+            for start, end in zip(starts, ends)
         ]
-        for cycle_i in range(
-            waveforms.features.waveform[name]["troughs"].size - 1
+    return [
+        pd.DataFrame(
+            {
+                waveforms.time_column_name: np.asarray(
+                    waveforms.times[start : end + 1]
+                ),
+                **{
+                    column: waveforms.column(column)[start : end + 1]
+                    for column in waveforms.names
+                },
+            }
         )
+        for start, end in zip(starts, ends)
     ]
 
 
@@ -58,101 +164,244 @@ class CycleFeatureExtractor(ABC):
         """
         pass
 
+    def extend_feature(self, waveforms: Waveforms, name: str) -> Waveforms:
+        """Extends a feature that has only been extracted for the first few
+        cycles (e.g. because more cycles have since been found with
+        `medical_waveforms.features.waveform.update_troughs`) to cover every
+        cycle.
 
-class Duration(CycleFeatureExtractor):
-    """Calculates duration (seconds) of each cycle in the waveform."""
+        Subclasses that can compute their feature for a subset of cycles
+        should override this to do so; by default the feature is extracted
+        again for every cycle.
+
+        Args:
+            waveforms: `medical_waveforms.waveforms.Waveforms` instance holding your
+                data
+            name: Name of column in `waveforms` to extract feature from
+
+        Returns:
+            `waveforms` with the feature at
+                `waveforms.features.cycle[`name`][`self.class_name`]` updated
+                to cover every cycle
+        """
+        return self.extract_feature(waveforms, name)
+
+    def ensure_feature(self, waveforms: Waveforms, name: str) -> Waveforms:
+        """Makes sure that the feature is available for every cycle, reusing
+        any part of it that has already been extracted.
+
+        Args:
+            waveforms: `medical_waveforms.waveforms.Waveforms` instance holding your
+                data
+            name: Name of column in `waveforms` to extract feature from
+
+        Returns:
+            `waveforms` with the feature at
+                `waveforms.features.cycle[`name`][`self.class_name`]`
+        """
+        waveforms.features.check_column(name, waveforms.column(name))
+        if waveforms.features.is_current(name, self.class_name):
+            return waveforms
+        if self.class_name in waveforms.features.cycles[name]:
+            return self.extend_feature(waveforms, name)
+        return self.extract_feature(waveforms, name)
+
+
+class SegmentFeatureExtractor(CycleFeatureExtractor):
+    """Abstract base class for per-cycle feature extraction classes whose
+    feature can be computed for all cycles at once with segment reductions
+    over the trough indices, rather than cycle by cycle."""
 
     def extract_feature(self, waveforms: Waveforms, name: str) -> Waveforms:
-        feature = [
-            cycle[waveforms.time_column_name].values[-1]
-            - cycle[waveforms.time_column_name].values[0]
-            for cycle in get_cycles(waveforms, name)
-        ]
-        waveforms.features.cycles[name][self.class_name] = np.array(feature)
+        waveforms.features.cycles[name][
+            self.class_name
+        ] = self._compute_from_cycle(waveforms, name, 0)
         return waveforms
 
+    def extend_feature(self, waveforms: Waveforms, name: str) -> Waveforms:
+        previous = waveforms.features.cycles[name].get(self.class_name)
+        if previous is None:
+            return self.extract_feature(waveforms, name)
+
+        first_cycle = len(previous)
+        waveforms.features.extend(
+            "cycles",
+            name,
+            self.class_name,
+            first_cycle,
+            self._compute_from_cycle(waveforms, name, first_cycle),
+        )
+        return waveforms
 
-class CyclesPerMinute(CycleFeatureExtractor):
+    def _compute_from_cycle(
+        self, waveforms: Waveforms, name: str, first_cycle: int
+    ) -> np.ndarray:
+        """Computes the feature for every cycle from `first_cycle` onwards."""
+        troughs = waveforms.features.waveform[name]["troughs"][first_cycle:]
+        if troughs.size < 2:
+            # Of the same dtype as the features of the waveform's samples, so
+            #  that extending a feature with it doesn't promote the feature
+            return np.empty(
+                0, dtype=compute_dtype(waveforms.column(name).dtype)
+            )
+
+        # Only pass on the samples spanned by these cycles (as views)
+        start, end = troughs[0], troughs[-1] + 1
+        starts, ends = segments.cycle_bounds(troughs - start)
+        return self.compute(
+            values=waveforms.column(name)[start:end],
+            times=waveforms.times[start:end],
+            starts=starts,
+            ends=ends,
+        )
+
+    @abstractmethod
+    def compute(
+        self,
+        values: np.ndarray,
+        times: np.ndarray,
+        starts: np.ndarray,
+        ends: np.ndarray,
+    ) -> np.ndarray:
+        """Computes the feature for a set of cycles.
+
+        Args:
+            values: Waveform samples
+            times: Timestamps (seconds) corresponding to `values`, either as
+                an array or as a `medical_waveforms.waveforms.UniformTimeAxis`
+            starts: Index of the starting trough of each cycle
+            ends: Index of the ending trough of each cycle
+
+        Returns:
+            Array of shape (n_cycles,) where each element is the feature for
+                the corresponding cycle
+        """
+        pass
+
+
+class PerCycleFeatureExtractor(SegmentFeatureExtractor):
+    """Abstract base class for per-cycle feature extraction classes that
+    compute their feature one cycle at a time from a `Cycle`, which is
+    simpler to write than a vectorized `SegmentFeatureExtractor.compute`.
+
+    Features are float64, as `compute_cycle` may do anything with the
+    samples. Subclasses can set `dtype` to another dtype, or to None for the
+    compute dtype of the samples (see
+    `medical_waveforms.waveforms.compute_dtype`).
+    """
+
+    dtype: Optional[type] = np.float64
+
+    def compute(self, values, times, starts, ends) -> np.ndarray:
+        return np.fromiter(
+            (
+                self.compute_cycle(cycle)
+                for cycle in CycleViews(values, times, starts, ends)
+            ),
+            dtype=(
+                compute_dtype(values.dtype)
+                if self.dtype is None
+                else self.dtype
+            ),
+            count=starts.size,
+        )
+
+    @abstractmethod
+    def compute_cycle(self, cycle: Cycle) -> float:
+        """Computes the feature for one cycle.
+
+        Args:
+            cycle: The cycle's samples
+
+        Returns:
+            The feature
+        """
+        pass
+
+
+class Duration(SegmentFeatureExtractor):
+    """Calculates duration (seconds) of each cycle in the waveform."""
+
+    def compute(self, values, times, starts, ends) -> np.ndarray:
+        return segments.segment_duration(times, starts, ends)
+
+
+class CyclesPerMinute(SegmentFeatureExtractor):
     """Calculates rate (cycles per minute) for each cycle in the waveform."""
 
     def extract_feature(self, waveforms: Waveforms, name: str) -> Waveforms:
-        feature = [
-            cycle[waveforms.time_column_name].values[-1]
-            - cycle[waveforms.time_column_name].values[0]
-            for cycle in get_cycles(waveforms, name)
-        ]
-        waveforms.features.cycles[name][self.class_name] = 60 / np.array(
-            feature
+        # Reuse the cycle durations, as they are often needed anyway
+        duration = Duration()
+        waveforms = duration.ensure_feature(waveforms, name)
+        waveforms.features.cycles[name][self.class_name] = (
+            60 / waveforms.features.cycles[name][duration.class_name]
         )
         return waveforms
 
+    def compute(self, values, times, starts, ends) -> np.ndarray:
+        return 60 / segments.segment_duration(times, starts, ends)
+
 
-class MaximumValue(CycleFeatureExtractor):
+class MaximumValue(SegmentFeatureExtractor):
     """Calculates maximum value of each cycle in the waveform."""
 
-    def extract_feature(self, waveforms: Waveforms, name: str) -> Waveforms:
-        feature = [cycle[name].max() for cycle in get_cycles(waveforms, name)]
-        waveforms.features.cycles[name][self.class_name] = np.array(feature)
-        return waveforms
+    def compute(self, values, times, starts, ends) -> np.ndarray:
+        return segments.segment_max(values, starts, ends)
 
 
-class MinimumValue(CycleFeatureExtractor):
+class MinimumValue(SegmentFeatureExtractor):
     """Calculates minimum value of each cycle in the waveform."""
 
-    def extract_feature(self, waveforms: Waveforms, name: str) -> Waveforms:
-        feature = [cycle[name].min() for cycle in get_cycles(waveforms, name)]
-        waveforms.features.cycles[name][self.class_name] = np.array(feature)
-        return waveforms
+    def compute(self, values, times, starts, ends) -> np.ndarray:
+        return segments.segment_min(values, starts, ends)
 
 
-class MaximumMinusMinimumValue(CycleFeatureExtractor):
+class MaximumMinusMinimumValue(SegmentFeatureExtractor):
     """Calculates maximum minus minimum value of each cycle in the waveform."""
 
-    def extract_feature(self, waveforms: Waveforms, name: str) -> Waveforms:
-        feature = [
-            cycle[name].max() - cycle[name].min()
-            for cycle in get_cycles(waveforms, name)
-        ]
-        waveforms.features.cycles[name][self.class_name] = np.array(feature)
-        return waveforms
+    def compute(self, values, times, starts, ends) -> np.ndarray:
+        return segments.segment_max(
+            values, starts, ends
+        ) - segments.segment_min(values, starts, ends)
 
 
-class MeanValue(CycleFeatureExtractor):
+class MeanValue(SegmentFeatureExtractor):
     """Calculates mean value of each cycle in the waveform."""
 
-    def extract_feature(self, waveforms: Waveforms, name: str) -> Waveforms:
-        feature = [cycle[name].mean() for cycle in get_cycles(waveforms, name)]
-        waveforms.features.cycles[name][self.class_name] = np.array(feature)
-        return waveforms
+    def compute(self, values, times, starts, ends) -> np.ndarray:
+        return segments.segment_mean(values, starts, ends)
 
 
-class MeanNegativeFirstDifference(CycleFeatureExtractor):
+class MeanNegativeFirstDifference(SegmentFeatureExtractor):
     """Calculates the mean of only the negative first differences for each cycle
     in the waveform. This feature is similar to `mean_dyneg` from
     https://bit.ly/3AwtazE"""
 
-    def extract_feature(self, waveforms: Waveforms, name: str) -> Waveforms:
-        feature = [
-            np.mean(
-                self._remove_zeros(
-                    np.clip(
-                        np.diff(cycle[name].values, n=1, axis=0),
-                        a_min=None,
-                        a_max=0,
-                    )
-                )
-            )
-            for cycle in get_cycles(waveforms, name)
-        ]
+    def compute(self, values, times, starts, ends) -> np.ndarray:
+        # The first differences within a cycle are at indices [start, end) of
+        #  `first_differences`. They are taken in the compute dtype, so that
+        #  integer samples can't overflow, and summed in float64.
+        dtype = compute_dtype(values.dtype)
+        first_differences = np.subtract(values[1:], values[:-1], dtype=dtype)
+        negative = first_differences < 0
+        sums = segments.segment_reduce(
+            np.add,
+            np.where(negative, first_differences, 0),
+            starts,
+            ends,
+            include_end=False,
+            dtype=np.float64,
+        )
+        counts = segments.segment_reduce(
+            np.add,
+            negative.astype(np.intp),
+            starts,
+            ends,
+            include_end=False,
+        )
         # TODO: See https://github.com/UCL-Chimera/medical-waveforms/issues/16
 
-        waveforms.features.cycles[name][self.class_name] = np.array(feature)
-        return waveforms
-
-    @staticmethod
-    def _remove_zeros(array: np.ndarray) -> np.ndarray:
-        zeros_removed = array[array < 0]
-        if zeros_removed.size > 0:
-            return zeros_removed
         # if no negative differences, indicates poor quality waveform
-        return np.array([-np.inf])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(counts > 0, sums / counts, -np.inf)
+        return means.astype(dtype, copy=False)
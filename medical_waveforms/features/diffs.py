@@ -18,6 +18,9 @@ def calculate_absolute_diffs(
     length as waveforms.features.cycles[`name`][`feature_extractor.class_name`]
     as always has first element 0.0
 
+    Any differences that have already been calculated (for the same cycles)
+    are reused.
+
     Args:
         waveforms: `medical_waveforms.waveforms.Waveforms` instance holding your
             data
@@ -30,12 +33,18 @@ def calculate_absolute_diffs(
             waveforms.features.diffs[`name`][`feature_extractor.class_name`]
     """
     fe = feature_extractor()
-    if not fe.class_name in wf.features.cycles[name].keys():
-        wf = fe.extract_feature(wf, name)
-    wf.features.diffs[name][fe.class_name] = np.zeros(
-        wf.features.cycles[name][fe.class_name].size
-    )
-    wf.features.diffs[name][fe.class_name][1:] = np.abs(
-        np.diff(wf.features.cycles[name][fe.class_name])
-    )
+    wf.features.check_column(name, wf.column(name))
+    if wf.features.is_current(name, fe.class_name, level="diffs"):
+        return wf
+
+    wf = fe.ensure_feature(wf, name)
+    feature = wf.features.cycles[name][fe.class_name]
+
+    # Only calculate the differences that aren't already held. Differences
+    #  keep the feature's dtype, e.g. float32.
+    n_previous = len(wf.features.diffs[name].get(fe.class_name, ()))
+    new = np.abs(np.diff(feature[max(n_previous - 1, 0) :]))
+    if n_previous == 0 and feature.size > 0:
+        new = np.concatenate([np.zeros(1, dtype=feature.dtype), new])
+    wf.features.extend("diffs", name, fe.class_name, n_previous, new)
     return wf
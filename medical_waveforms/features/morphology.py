@@ -0,0 +1,274 @@
+from abc import abstractmethod
+
+import numpy as np
+
+from ..waveforms import Waveforms
+from . import segments
+from .cycles import CycleFeatureExtractor, Duration, SegmentFeatureExtractor
+
+
+class ResampledCycles(SegmentFeatureExtractor):
+    """Resamples each cycle in the waveform onto `length` evenly spaced
+    points, from its starting trough to its ending trough.
+
+    Unlike other cycle-level features, this is an array of shape (n_cycles,
+    `length`) (float32) rather than (n_cycles,). It lets shape-based
+    features of every cycle be computed at once by subclasses of
+    `MorphologyFeatureExtractor`. Subclass this and change `length` for a
+    different resolution.
+    """
+
+    length: int = 100
+
+    def compute(self, values, times, starts, ends) -> np.ndarray:
+        return segments.segment_resample(values, starts, ends, self.length)
+
+
+class MorphologyFeatureExtractor(CycleFeatureExtractor):
+    """Abstract base class for per-cycle feature extraction classes that
+    compute their feature from the shape of every cycle at once, using
+    `ResampledCycles` and `Duration`."""
+
+    resampled_cycles = ResampledCycles
+
+    def extract_feature(self, waveforms: Waveforms, name: str) -> Waveforms:
+        waveforms.features.cycles[name][
+            self.class_name
+        ] = self._compute_from_cycle(waveforms, name, 0)
+        return waveforms
+
+    def extend_feature(self, waveforms: Waveforms, name: str) -> Waveforms:
+        previous = waveforms.features.cycles[name].get(self.class_name)
+        if previous is None:
+            return self.extract_feature(waveforms, name)
+
+        first_cycle = len(previous)
+        waveforms.features.extend(
+            "cycles",
+            name,
+            self.class_name,
+            first_cycle,
+            self._compute_from_cycle(waveforms, name, first_cycle),
+        )
+        return waveforms
+
+    def _compute_from_cycle(
+        self, waveforms: Waveforms, name: str, first_cycle: int
+    ) -> np.ndarray:
+        """Computes the feature for every cycle from `first_cycle` onwards."""
+        resampled_cycles, duration = self.resampled_cycles(), Duration()
+        for feature_extractor in resampled_cycles, duration:
+            waveforms = feature_extractor.ensure_feature(waveforms, name)
+        features = waveforms.features.cycles[name]
+        return self.compute(
+            resampled=features[resampled_cycles.class_name][first_cycle:],
+            durations=features[duration.class_name][first_cycle:],
+        )
+
+    @abstractmethod
+    def compute(
+        self, resampled: np.ndarray, durations: np.ndarray
+    ) -> np.ndarray:
+        """Computes the feature for a set of cycles.
+
+        Args:
+            resampled: Array of shape (n_cycles, length) where each row is a
+                cycle resampled by `ResampledCycles`
+            durations: Duration (seconds) of each cycle
+
+        Returns:
+            Array of shape (n_cycles,) where each element is the feature for
+                the corresponding cycle
+        """
+        pass
+
+
+class TimeToPeak(MorphologyFeatureExtractor):
+    """Calculates time (seconds) from the start of each cycle in the waveform
+    to its maximum value."""
+
+    def compute(self, resampled, durations) -> np.ndarray:
+        peaks = np.argmax(resampled, axis=1)
+        return peaks / (resampled.shape[1] - 1) * durations
+
+
+class AreaUnderCurve(MorphologyFeatureExtractor):
+    """Calculates area under each cycle in the waveform (units * seconds),
+    above that cycle's minimum value, with the trapezoidal rule."""
+
+    def compute(self, resampled, durations) -> np.ndarray:
+        heights = resampled - resampled.min(axis=1, keepdims=True)
+        area = heights.sum(axis=1, dtype=np.float64) - 0.5 * (
+            heights[:, 0].astype(np.float64) + heights[:, -1]
+        )
+        return area * durations / (resampled.shape[1] - 1)
+
+
+class MaximumUpstrokeSlope(MorphologyFeatureExtractor):
+    """Calculates the steepest rate of rise (units per second) within each
+    cycle in the waveform, e.g. the systolic upstroke of an arterial pressure
+    cycle."""
+
+    def compute(self, resampled, durations) -> np.ndarray:
+        rises = np.diff(resampled, axis=1).max(axis=1).astype(np.float64)
+        return rises * (resampled.shape[1] - 1) / durations
+
+
+class DicroticNotchTime(MorphologyFeatureExtractor):
+    """Calculates time (seconds) from the start of each cycle in the waveform
+    to the dicrotic notch of an arterial pressure cycle.
+
+    The notch is searched for between the cycle's maximum value and
+    `search_end` (as a fraction of the cycle). It is the first local minimum
+    there if there is one, otherwise the point of greatest upward curvature.
+    The feature is NaN if the search region is empty.
+    """
+
+    search_end: float = 0.75
+
+    def compute(self, resampled, durations) -> np.ndarray:
+        length = resampled.shape[1]
+        first_differences = np.diff(resampled, axis=1)
+        # Interior points, at which the second difference is defined
+        points = np.arange(1, length - 1)
+        in_search = (points > np.argmax(resampled, axis=1)[:, np.newaxis]) & (
+            points < self.search_end * (length - 1)
+        )
+
+        local_minima = (
+            (first_differences[:, :-1] < 0)
+            & (first_differences[:, 1:] >= 0)
+            & in_search
+        )
+        curvature = np.where(
+            in_search, np.diff(first_differences, axis=1), -np.inf
+        )
+        notches = np.where(
+            local_minima.any(axis=1),
+            points[np.argmax(local_minima, axis=1)],
+            points[np.argmax(curvature, axis=1)],
+        )
+        times = notches / (length - 1) * durations
+        return np.where(in_search.any(axis=1), times, np.nan)
+
+
+class TemplateCorrelation(MorphologyFeatureExtractor):
+    """Calculates the Pearson correlation between each cycle in the waveform
+    and a template cycle. Low correlations indicate damped or distorted
+    cycles.
+
+    Templates are the pointwise median of up to `window` consecutive cycles.
+    They are updated every `update_interval` cycles (which is much faster
+    than updating them for every cycle), at the first cycle and every
+    `update_interval`th cycle after it, from the `window` cycles up to and
+    including the cycle where they are updated. So the cycle where a
+    template is updated is part of its own template, and the first
+    `update_interval` cycles share a template that is just the first cycle.
+    As templates never use later cycles, correlations don't change as more
+    cycles are found with `medical_waveforms.features.waveform.update_troughs`.
+
+    Each cycle is shifted by up to `max_shift` of its duration relative to
+    its template, and the highest correlation is kept. This allows for
+    troughs that are found a few timesteps early or late in noisy
+    waveforms, which would otherwise misalign the steep upstroke.
+    """
+
+    window: int = 30
+    update_interval: int = 30
+    max_shift: float = 0.08
+    batch_size: int = 1024
+
+    def _compute_from_cycle(
+        self, waveforms: Waveforms, name: str, first_cycle: int
+    ) -> np.ndarray:
+        resampled_cycles = self.resampled_cycles()
+        waveforms = resampled_cycles.ensure_feature(waveforms, name)
+        # Include the earlier cycles that the new cycles' templates are from
+        first_update = (
+            first_cycle // self.update_interval * self.update_interval
+        )
+        first_needed = max(first_update - self.window + 1, 0)
+        correlations = self._correlations(
+            waveforms.features.cycles[name][resampled_cycles.class_name][
+                first_needed:
+            ],
+            first_needed,
+        )
+        return correlations[first_cycle - first_needed :]
+
+    def compute(self, resampled, durations) -> np.ndarray:
+        return self._correlations(resampled, 0)
+
+    def _correlations(
+        self, resampled: np.ndarray, first_cycle: int
+    ) -> np.ndarray:
+        """Correlates each of `resampled`, which are the resampled cycles from
+        `first_cycle` onwards, with its template. Cycles whose template would
+        be updated before `first_cycle` get NaN."""
+        n_cycles = len(resampled)
+        # Positions in `resampled` of each template update
+        updates = np.arange(
+            -first_cycle % self.update_interval,
+            n_cycles,
+            self.update_interval,
+        )
+        templates = np.empty((updates.size, resampled.shape[1]))
+
+        # Templates without a full window of earlier cycles
+        n_partial = int(np.sum(updates < self.window - 1))
+        for template, update in enumerate(updates[:n_partial]):
+            templates[template] = np.median(resampled[: update + 1], axis=0)
+        # (n_cycles - window + 1, length, window) view of every full window
+        if n_cycles >= self.window:
+            windows = np.lib.stride_tricks.sliding_window_view(
+                resampled, self.window, axis=0
+            )
+            for first in range(n_partial, updates.size, self.batch_size):
+                batch = slice(first, first + self.batch_size)
+                templates[batch] = np.median(
+                    windows[updates[batch] - self.window + 1], axis=-1
+                )
+
+        correlations = np.full(n_cycles, np.nan)
+        if updates.size == 0:
+            return correlations
+        templated = np.arange(updates[0], n_cycles)
+        template_indices = (templated - updates[0]) // self.update_interval
+        max_lag = int(round(self.max_shift * resampled.shape[1]))
+        for first in range(0, templated.size, self.batch_size):
+            batch = slice(first, first + self.batch_size)
+            correlations[templated[batch]] = _shifted_correlate(
+                resampled[templated[batch]],
+                templates[template_indices[batch]],
+                max_lag,
+            )
+        return correlations
+
+
+def _shifted_correlate(
+    a: np.ndarray, b: np.ndarray, max_lag: int
+) -> np.ndarray:
+    """Highest Pearson correlation between corresponding rows of `a` and `b`
+    when `a` is shifted by up to `max_lag` columns either way, over the
+    columns where they overlap."""
+    length = a.shape[1]
+    correlations = np.full(len(a), -np.inf)
+    for lag in range(-max_lag, max_lag + 1):
+        shifted = _correlate(
+            a[:, max(lag, 0) : length + min(lag, 0)],
+            b[:, max(-lag, 0) : length - max(lag, 0)],
+        )
+        # Ignoring NaNs from flat overlaps, unless every lag gives NaN
+        correlations = np.fmax(correlations, shifted)
+    correlations[np.isneginf(correlations)] = np.nan
+    return correlations
+
+
+def _correlate(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pearson correlation between corresponding rows of `a` and `b`."""
+    a = a - a.mean(axis=1, keepdims=True, dtype=np.float64)
+    b = b - b.mean(axis=1, keepdims=True, dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.einsum("ij,ij->i", a, b) / np.sqrt(
+            np.einsum("ij,ij->i", a, a) * np.einsum("ij,ij->i", b, b)
+        )
@@ -0,0 +1,263 @@
+from bisect import bisect_left, insort
+from typing import List, Optional, Type
+
+import numpy as np
+import pandas as pd
+
+from ..waveforms import Waveforms
+from .cycles import CycleFeatureExtractor
+
+STATISTICS = ("median", "mad", "mean", "std")
+
+# Scales the median absolute deviation to estimate the standard deviation of
+#  normally distributed data
+MAD_TO_STD = 1.4826
+
+
+def rolling(
+    values: np.ndarray,
+    statistic: str,
+    window: Optional[int] = None,
+    times: Optional[np.ndarray] = None,
+    span: Optional[float] = None,
+) -> np.ndarray:
+    """Calculates a statistic over a trailing window of each element of
+    `values`, including that element.
+
+    Uses pandas' rolling windows, which take O(n) time for the mean and
+    standard deviation and O(n log k) for the median (for windows of k
+    elements), rather than O(n * k). The median absolute deviation keeps each
+    window sorted, and also takes O(n log k) time (see `_rolling_mad`).
+
+    Args:
+        values: Per-cycle values, e.g. a cycle-level feature
+        statistic: One of `STATISTICS`. 'mad' is the median absolute
+            deviation of each window, i.e. the median of the absolute
+            deviations of its elements from its median.
+        window: Number of elements in each window
+        times: Timestamp (seconds) of each element, e.g. cycle start times.
+            Only needed if `span` is given.
+        span: Duration (seconds) of each window, instead of `window`
+
+    Returns:
+        The statistic for each element. Early elements are summarised over
+            the (shorter) windows available.
+    """
+    assert statistic in STATISTICS, f"`statistic` must be in {STATISTICS}"
+    assert (window is None) != (
+        span is None
+    ), "Exactly one of `window` and `span` must be given"
+
+    def rolling_windows(series: pd.Series):
+        if span is not None:
+            return series.rolling(pd.Timedelta(seconds=span), min_periods=1)
+        return series.rolling(window, min_periods=1)
+
+    if statistic == "mad":
+        values = np.asarray(values, dtype=float)
+        if span is None:
+            starts = np.maximum(np.arange(values.size) - window + 1, 0)
+        else:
+            # As for pandas, windows include elements after `time - span`
+            times = np.asarray(times, dtype=float)
+            starts = np.searchsorted(times, times - span, side="right")
+        return _rolling_mad(values, starts)
+
+    series = pd.Series(values, dtype=float)
+    if span is not None:
+        series.index = pd.to_timedelta(times, unit="s")
+    return getattr(rolling_windows(series), statistic)().to_numpy()
+
+
+def _rolling_mad(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Median absolute deviation of each window `values[starts[i] : i + 1]`,
+    ignoring NaNs.
+
+    The window is kept sorted as it slides, with a binary search for each
+    element that enters or leaves it (the list insertions and deletions move
+    up to k pointers, which is negligible next to the per-element overhead).
+    Each window's median absolute deviation is then found in O(log k) time
+    by `_sorted_mad`.
+    """
+    mads = np.full(values.size, np.nan)
+    window = []
+    values_list = values.tolist()
+    start = 0
+    for i, (value, new_start) in enumerate(zip(values_list, starts.tolist())):
+        if value == value:  # Not NaN
+            insort(window, value)
+        for old in values_list[start:new_start]:
+            if old == old:
+                del window[bisect_left(window, old)]
+        start = new_start
+        if window:
+            mads[i] = _sorted_mad(window)
+    return mads
+
+
+def _sorted_mad(window: List[float]) -> float:
+    """Median absolute deviation of a non-empty sorted list, in O(log n)
+    time."""
+    n = len(window)
+    half = n // 2
+    median = (window[(n - 1) // 2] + window[half]) / 2
+    # The deviations of window[half - 1], window[half - 2], ... below the
+    #  median increase, as do those of window[half], window[half + 1], ...
+    #  above it. Binary search for how many of the `n_lower` smallest
+    #  deviations (up to the median deviation) are from below the median.
+    n_lower = (n - 1) // 2 + 1
+    lo, hi = max(0, n_lower - (n - half)), min(n_lower, half)
+    while lo < hi:
+        i = (lo + hi) // 2
+        below = median - window[half - 1 - i]
+        if below >= window[half + n_lower - 1 - i] - median:
+            hi = i
+        else:
+            lo = i + 1
+    n_above = n_lower - lo
+    mad = max(
+        median - window[half - lo] if lo > 0 else 0.0,
+        window[half + n_above - 1] - median if n_above > 0 else 0.0,
+    )
+    if n % 2:
+        return mad
+    # Average with the next smallest deviation, from below or above
+    next_deviation = min(
+        median - window[half - 1 - lo] if lo < half else np.inf,
+        window[half + n_above] - median if half + n_above < n else np.inf,
+    )
+    return (mad + next_deviation) / 2
+
+
+def rolling_key(
+    feature_extractor: Type[CycleFeatureExtractor],
+    statistic: str,
+    window: Optional[int] = None,
+    span: Optional[float] = None,
+) -> str:
+    """The name that `calculate_rolling_statistic` stores a rolling statistic
+    under, e.g. 'MeanValue_rolling_median_100' or 'MeanValue_rolling_mad_60s'.
+    """
+    size = f"{window}" if span is None else f"{span:g}s"
+    return f"{feature_extractor().class_name}_rolling_{statistic}_{size}"
+
+
+def calculate_rolling_statistic(
+    waveforms: Waveforms,
+    name: str,
+    feature_extractor: Type[CycleFeatureExtractor],
+    statistic: str,
+    window: Optional[int] = None,
+    span: Optional[float] = None,
+) -> Waveforms:
+    """Calculates a rolling statistic of a cycle-level feature over a trailing
+    window of cycles (see `rolling`).
+
+    Any part of the statistic that has already been calculated is reused, so
+    after more cycles are found only the new cycles (and enough earlier cycles
+    to fill their windows) are processed.
+
+    Args:
+        waveforms: `medical_waveforms.waveforms.Waveforms` instance holding your
+            data
+        name: Name of column in `waveforms` to extract feature from
+        feature_extractor: Extractor class for the cycle-level feature
+        statistic: As for `rolling`
+        window: Number of cycles in each window
+        span: Duration (seconds) of each window, instead of `window`. Cycles
+            are in a window if they start within it.
+
+    Returns:
+        `waveforms` with the statistic at
+            waveforms.features.cycles[`name`][`rolling_key(...)`]
+    """
+    key = rolling_key(feature_extractor, statistic, window, span)
+    waveforms.features.check_column(name, waveforms.column(name))
+    if waveforms.features.is_current(name, key):
+        return waveforms
+
+    waveforms = feature_extractor().ensure_feature(waveforms, name)
+    feature = waveforms.features.cycles[name][feature_extractor().class_name]
+    first_cycle = len(waveforms.features.cycles[name].get(key, ()))
+
+    start_times = None
+    if span is None:
+        first_needed = max(first_cycle - (window - 1), 0)
+    else:
+        start_times = waveforms.features.cycle_index(
+            name, waveforms.times
+        ).start_times
+        first_needed = (
+            int(
+                np.searchsorted(
+                    start_times,
+                    start_times[first_cycle] - span,
+                    side="right",
+                )
+            )
+            if first_cycle < feature.size
+            else first_cycle
+        )
+        start_times = start_times[first_needed:]
+
+    new = rolling(feature[first_needed:], statistic, window, start_times, span)
+    waveforms.features.extend(
+        "cycles", name, key, first_cycle, new[first_cycle - first_needed :]
+    )
+    return waveforms
+
+
+def calculate_baseline_deviation(
+    waveforms: Waveforms,
+    name: str,
+    feature_extractor: Type[CycleFeatureExtractor],
+    window: Optional[int] = None,
+    span: Optional[float] = None,
+) -> Waveforms:
+    """Calculates how far each value of a cycle-level feature deviates from the
+    rolling baseline of recent cycles, as a robust z-score: the absolute
+    deviation from the rolling median, divided by the rolling median absolute
+    deviation (scaled to estimate a standard deviation).
+
+    Args:
+        waveforms: `medical_waveforms.waveforms.Waveforms` instance holding your
+            data
+        name: Name of column in `waveforms` to extract feature from
+        feature_extractor: Extractor class for the cycle-level feature
+        window: As for `calculate_rolling_statistic`
+        span: As for `calculate_rolling_statistic`
+
+    Returns:
+        `waveforms` with the deviations at
+            waveforms.features.cycles[`name`][`rolling_key(feature_extractor,
+            'deviation', ...)`]. Deviations are 0 where the feature equals its
+            baseline, and infinite where it differs from a baseline with no
+            spread.
+    """
+    key = rolling_key(feature_extractor, "deviation", window, span)
+    waveforms.features.check_column(name, waveforms.column(name))
+    if waveforms.features.is_current(name, key):
+        return waveforms
+
+    for statistic in "median", "mad":
+        waveforms = calculate_rolling_statistic(
+            waveforms, name, feature_extractor, statistic, window, span
+        )
+    # Only calculate the deviations of new cycles
+    features = waveforms.features.cycles[name]
+    first_cycle = len(features.get(key, ()))
+    deviations = np.abs(
+        features[feature_extractor().class_name][first_cycle:]
+        - features[rolling_key(feature_extractor, "median", window, span)][
+            first_cycle:
+        ]
+    )
+    scales = MAD_TO_STD * (
+        features[rolling_key(feature_extractor, "mad", window, span)][
+            first_cycle:
+        ]
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        new = np.where(deviations == 0, 0.0, deviations / scales)
+    waveforms.features.extend("cycles", name, key, first_cycle, new)
+    return waveforms
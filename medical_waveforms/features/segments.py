@@ -0,0 +1,175 @@
+from typing import Optional, Tuple, Union
+
+import numpy as np
+
+from ..waveforms import UniformTimeAxis, compute_dtype
+
+
+def cycle_bounds(troughs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Makes the start and end sample indices of each cycle from the trough
+    indices of a waveform.
+
+    Each cycle includes the troughs at its start and end, so the end of one
+    cycle is the start of the next.
+
+    Args:
+        troughs: Sorted trough indices, e.g. from
+            `waveforms.features.waveform[name]['troughs']`
+
+    Returns:
+        Start index of each cycle
+        End index (inclusive) of each cycle
+    """
+    troughs = np.asarray(troughs, dtype=np.intp)
+    return troughs[:-1], troughs[1:]
+
+
+def segment_reduce(
+    ufunc: np.ufunc,
+    values: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    include_end: bool = True,
+    dtype: Optional[np.dtype] = None,
+) -> np.ndarray:
+    """Reduces `values` over each segment [`starts`[i], `ends`[i]] in a single
+    vectorized pass, without slicing out the individual segments.
+
+    Segments may share boundary samples (as adjacent cycles do), overlap or
+    leave gaps, but each must contain more than one sample, i.e. `starts` <
+    `ends`.
+
+    Args:
+        ufunc: Binary NumPy ufunc to reduce with, e.g. `np.fmax` or `np.add`
+        values: 1D array of samples
+        starts: Index of the first sample in each segment
+        ends: Index of the last sample in each segment
+        include_end: If False, the sample at `ends`[i] is excluded from the
+            segment (and `ends`[i] may then be one past the last sample)
+        dtype: If not None, the reduction is accumulated in this dtype, e.g.
+            float64 to sum float32 samples without losing precision
+
+    Returns:
+        Array of shape (n_segments,) with the reduction for each segment
+    """
+    starts = np.asarray(starts, dtype=np.intp)
+    ends = np.asarray(ends, dtype=np.intp)
+    if starts.size == 0:
+        return np.empty(
+            0, dtype=np.result_type(values) if dtype is None else dtype
+        )
+
+    # Interleaving the starts and ends means that every even-indexed element
+    #  of the `reduceat` output covers [start, end). The odd-indexed elements
+    #  span the gaps between segments and are discarded.
+    indices = np.empty(2 * starts.size, dtype=np.intp)
+    indices[0::2] = starts
+    indices[1::2] = ends
+    if indices[-1] == len(values):
+        # An exclusive end one past the last sample: the final segment then
+        #  simply runs to the end of `values`
+        indices = indices[:-1]
+    reduced = ufunc.reduceat(values, indices, dtype=dtype)[0::2]
+
+    if include_end:
+        reduced = ufunc(reduced, values[ends], dtype=dtype)
+    return reduced
+
+
+def segment_max(
+    values: np.ndarray, starts: np.ndarray, ends: np.ndarray
+) -> np.ndarray:
+    """Maximum of each segment, ignoring NaNs (like `pandas.Series.max`)."""
+    return segment_reduce(np.fmax, values, starts, ends).astype(
+        compute_dtype(values.dtype), copy=False
+    )
+
+
+def segment_min(
+    values: np.ndarray, starts: np.ndarray, ends: np.ndarray
+) -> np.ndarray:
+    """Minimum of each segment, ignoring NaNs (like `pandas.Series.min`)."""
+    return segment_reduce(np.fmin, values, starts, ends).astype(
+        compute_dtype(values.dtype), copy=False
+    )
+
+
+def segment_mean(
+    values: np.ndarray, starts: np.ndarray, ends: np.ndarray
+) -> np.ndarray:
+    """Mean of each segment, ignoring NaNs (like `pandas.Series.mean`).
+
+    Sums are accumulated in float64 whatever the dtype of `values`, and the
+    means are then rounded to `compute_dtype` of it.
+    """
+    starts = np.asarray(starts, dtype=np.intp)
+    ends = np.asarray(ends, dtype=np.intp)
+    dtype = compute_dtype(values.dtype)
+    nans = np.isnan(values)
+    if not nans.any():
+        sums = segment_reduce(np.add, values, starts, ends, dtype=np.float64)
+        return (sums / (ends - starts + 1)).astype(dtype, copy=False)
+
+    sums = segment_reduce(
+        np.add, np.where(nans, 0, values), starts, ends, dtype=np.float64
+    )
+    counts = segment_reduce(np.add, (~nans).astype(np.intp), starts, ends)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    return means.astype(dtype, copy=False)
+
+
+def segment_duration(
+    times: Union[np.ndarray, UniformTimeAxis],
+    starts: np.ndarray,
+    ends: np.ndarray,
+) -> np.ndarray:
+    """Time elapsed (seconds) between the first and last sample of each
+    segment. For uniformly sampled data this is worked out from the sample
+    indices alone."""
+    if isinstance(times, UniformTimeAxis):
+        return (np.asarray(ends) - np.asarray(starts)) / times.hertz
+    return times[ends] - times[starts]
+
+
+def segment_resample(
+    values: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    length: int,
+    batch_size: int = 4096,
+) -> np.ndarray:
+    """Linearly interpolates each segment onto `length` evenly spaced points,
+    from its first to its last sample, so that segments of different lengths
+    can be compared point by point.
+
+    Args:
+        values: 1D array of samples
+        starts: Index of the first sample in each segment
+        ends: Index of the last sample in each segment
+        length: Number of points to resample each segment onto
+        batch_size: Number of segments to interpolate at once, which bounds
+            the size of intermediate arrays
+
+    Returns:
+        float32 array of shape (n_segments, `length`)
+    """
+    starts = np.asarray(starts, dtype=np.intp)
+    ends = np.asarray(ends, dtype=np.intp)
+    resampled = np.empty((starts.size, length), dtype=np.float32)
+    fractions = np.linspace(0.0, 1.0, length)
+
+    for first in range(0, starts.size, batch_size):
+        batch = slice(first, first + batch_size)
+        batch_starts = starts[batch, np.newaxis]
+        batch_ends = ends[batch, np.newaxis]
+        positions = batch_starts + (batch_ends - batch_starts) * fractions
+        lower = np.floor(positions).astype(np.intp)
+        upper = np.minimum(lower + 1, batch_ends)
+        # Interpolating in float64 means that integer samples can't overflow
+        lower_values = values[lower].astype(np.float64, copy=False)
+        resampled[batch] = lower_values + (values[upper] - lower_values) * (
+            positions - lower
+        )
+
+    return resampled
@@ -1,13 +1,173 @@
+from abc import ABC, abstractmethod
 from typing import Optional
 from warnings import warn
 
-from pyampd import ampd
+import numpy as np
 
-from ..waveforms import Waveforms
+from ..waveforms import Waveforms, compute_dtype
+from . import ampd
+
+
+class TroughDetector(ABC):
+    """Abstract base class for trough detection algorithms, which can be used
+    by `find_troughs` and `update_troughs`."""
+
+    @abstractmethod
+    def detect(self, x: np.ndarray, hertz: float) -> np.ndarray:
+        """Finds troughs in a waveform.
+
+        Args:
+            x: The waveform. This must not be modified.
+            hertz: Sampling rate (hertz)
+
+        Returns:
+            Sorted indices of the troughs in `x`
+        """
+        pass
+
+    def context(self, hertz: float) -> Optional[int]:
+        """Number of timesteps either side of a trough that this detector
+        needs to see to find it reliably, or None if unknown. Used to decide
+        how far chunks of a waveform should overlap."""
+        return None
+
+
+class AMPDTroughDetector(TroughDetector):
+    """Finds troughs with the automatic multiscale-based peak detection (AMPD)
+    algorithm (see `medical_waveforms.features.ampd`). Its time and memory use
+    are proportional to the length of the waveform times `scale`."""
+
+    def __init__(
+        self, scale: Optional[int] = None, max_bytes: Optional[int] = None
+    ):
+        """
+        Args:
+            scale: The maximum scale window size is (2 * scale + 1) during
+                trough finding. See `find_troughs`.
+            max_bytes: Upper limit on the working memory (bytes) used to find
+                troughs. See `medical_waveforms.features.ampd.find_troughs`.
+        """
+        self.scale = scale
+        self.max_bytes = max_bytes
+
+    def detect(self, x: np.ndarray, hertz: float) -> np.ndarray:
+        return ampd.find_troughs(x, scale=self.scale, max_bytes=self.max_bytes)
+
+    def context(self, hertz: float) -> Optional[int]:
+        return 2 * self.scale if self.scale else None
+
+
+class UpstrokeTroughDetector(TroughDetector):
+    """Finds troughs as the lowest point before each upstroke, in time
+    proportional to the length of the waveform.
+
+    The slope of the waveform is measured over `smoothing` seconds, which
+    suppresses sample-to-sample noise. An upstroke starts wherever the slope
+    rises above `threshold` times its `quantile`th quantile, and its trough
+    is the minimum of the (likewise smoothed) waveform within
+    `refractory_period` before it. Upstrokes that rise less than
+    `min_amplitude` times the median rise are ignored, as are upstrokes that
+    start within `refractory_period`, or `refractory_fraction` times the
+    median interval between upstrokes if that is longer, of the previous
+    one. This suits waveforms with a sharp rise at the start of each cycle,
+    such as arterial pressure and photoplethysmography. Troughs at the very
+    end of a waveform (with no upstroke following them) aren't found.
+    """
+
+    def __init__(
+        self,
+        refractory_period: float = 0.25,
+        threshold: float = 0.5,
+        quantile: float = 0.99,
+        smoothing: float = 0.05,
+        min_amplitude: float = 0.5,
+        refractory_fraction: float = 0.5,
+    ):
+        """
+        Args:
+            refractory_period: Shortest plausible cycle duration (seconds).
+                The default suits heart rates of up to 240 beats per minute.
+            threshold: Fraction of the `quantile`th quantile of the slope
+                that marks the start of an upstroke
+            quantile: Quantile of the slope used to scale `threshold`
+            smoothing: Time (seconds) over which the slope is measured and
+                the waveform is averaged when locating troughs. Longer times
+                suppress more noise, but blur sharp troughs.
+            min_amplitude: Fraction of the median rise of the upstrokes
+                (from trough to the highest point within `refractory_period`
+                after the upstroke starts) that an upstroke must rise by
+            refractory_fraction: Fraction of the median interval between
+                upstrokes within which a later upstroke is ignored, so that
+                the refractory period adapts to the heart rate
+        """
+        self.refractory_period = refractory_period
+        self.threshold = threshold
+        self.quantile = quantile
+        self.smoothing = smoothing
+        self.min_amplitude = min_amplitude
+        self.refractory_fraction = refractory_fraction
+
+    def detect(self, x: np.ndarray, hertz: float) -> np.ndarray:
+        span = max(int(round(self.smoothing * hertz)), 1)
+        if x.size < span + 2:
+            return np.zeros(0, dtype=np.intp)
+        # In the compute dtype, so that integer samples can't overflow
+        slope = np.subtract(x[span:], x[:-span], dtype=compute_dtype(x.dtype))
+        rising = slope > self.threshold * np.nanquantile(slope, self.quantile)
+        onsets = np.flatnonzero(rising[1:] & ~rising[:-1]) + 1
+        if rising[0]:
+            onsets = np.concatenate([[0], onsets])
+        smoothed = _moving_average(x, span)
+
+        refractory = max(int(round(self.refractory_period * hertz)), 1)
+        candidates = np.empty(onsets.size, dtype=np.intp)
+        rises = np.empty(onsets.size)
+        for i, onset in enumerate(onsets):
+            start = max(onset - refractory, 0)
+            candidates[i] = start + int(
+                np.argmin(smoothed[start : onset + span + 1])
+            )
+            rises[i] = (
+                np.max(smoothed[onset : onset + refractory])
+                - smoothed[candidates[i]]
+            )
+        if onsets.size:
+            keep = rises >= self.min_amplitude * np.nanmedian(rises)
+            onsets, candidates = onsets[keep], candidates[keep]
+        if onsets.size > 2:
+            refractory = max(
+                refractory,
+                int(self.refractory_fraction * np.median(np.diff(onsets))),
+            )
+
+        half = span // 2
+        troughs = []
+        previous_onset = -refractory
+        for onset, candidate in zip(onsets, candidates):
+            if onset - previous_onset < refractory:
+                continue
+            previous_onset = onset
+            # The lowest sample near the smoothed trough
+            start = max(candidate - half, troughs[-1] + 1 if troughs else 0)
+            start = min(start, candidate)
+            troughs.append(
+                start + int(np.argmin(x[start : candidate + half + 1]))
+            )
+        return np.array(troughs, dtype=np.intp)
+
+    def context(self, hertz: float) -> Optional[int]:
+        return 2 * int(np.ceil(self.refractory_period * hertz)) + int(
+            np.ceil(self.smoothing * hertz)
+        )
 
 
 def find_troughs(
-    waveforms: Waveforms, name: str, scale: Optional[int] = None
+    waveforms: Waveforms,
+    name: str,
+    scale: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    overlap: Optional[int] = None,
+    detector: Optional[TroughDetector] = None,
 ) -> Waveforms:
     """Finds indices of troughs in a waveform.
 
@@ -15,25 +175,181 @@ def find_troughs(
         waveforms: `medical_waveforms.waveforms.Waveforms` instance holding your data
         name: Name of column in `waveforms` to find troughs in
         scale : The maximum scale window size is (2 * scale + 1) during trough
-            finding. Higher values require more memory. If None, sets `scale`
-            to number_of_timesteps // 2 but often much lower values are
-            adequate if your data contain many cycle. E.g.
-            https://link.springer.com/chapter/10.1007/978-3-319-65798-1_39 uses
-            `scale` values around one quarter of the cycle length for#
-            intracranial pressure waveforms.
+            finding. Higher values take longer. If None, `scale` is estimated
+            from the length of the dominant cycle in the waveform (see
+            `medical_waveforms.features.ampd.estimate_scale`). Only used by
+            the default detector.
+        chunk_size: If not None, troughs are found separately in successive
+            chunks of this many timesteps, so that peak memory use depends on
+            `chunk_size` and `scale` rather than on the length of the
+            waveform. Useful for recordings that are many hours long.
+        overlap: Number of timesteps either side of each chunk that are also
+            passed to the trough finder, so that troughs near the chunk edges
+            are found reliably. Only troughs within the chunk itself are
+            kept, so there are no duplicates where chunks meet. If None, uses
+            `detector.context`, e.g. 2 * `scale` for the default detector, or
+            `chunk_size` // 2 if that is None as well.
+        detector: The trough detection algorithm. If None, uses
+            `AMPDTroughDetector(scale)`. `UpstrokeTroughDetector` is much
+            faster for long recordings.
+
+    The waveform itself is only read, never modified, so several threads can
+    find troughs in shared (e.g. read-only memory-mapped) data at once.
 
     Returns:
         `waveforms` with trough indices added to
             `waveforms.features.waveform[`name`]['troughs']`
     """
-    waveforms.waveforms[name] *= -1  # invert signal, so troughs become peaks
+    detector = _init_detector(scale, detector)
+    hertz = _sampling_rate(waveforms)
+    waveforms.features.check_column(name, waveforms.column(name))
 
     try:
-        waveforms.features.waveform[name]["troughs"] = ampd.find_peaks(
-            x=waveforms.waveforms[name], scale=scale
-        )
+        if chunk_size is not None and chunk_size < waveforms.n_samples:
+            troughs = _find_troughs_chunked(
+                x=waveforms.column(name),
+                detector=detector,
+                hertz=hertz,
+                chunk_size=chunk_size,
+                overlap=overlap,
+            )
+        else:
+            troughs = detector.detect(waveforms.column(name), hertz)
     except MemoryError:
-        warn("Ran out of memory. Try setting `scale` to a lower value.")
+        warn("Ran out of memory. Try setting `chunk_size`.")
+        return waveforms
+
+    waveforms.features.waveform[name]["troughs"] = troughs
+    return waveforms
+
+
+def _init_detector(
+    scale: Optional[int], detector: Optional[TroughDetector]
+) -> TroughDetector:
+    if detector is None:
+        return AMPDTroughDetector(scale)
+    assert scale is None, "`scale` can't be used with a custom `detector`"
+    return detector
+
+
+def _moving_average(x: np.ndarray, width: int) -> np.ndarray:
+    """Centred moving average of `x` over `width` samples (fewer at its
+    ends), as float64. NaNs are left out of the averages."""
+    missing = np.isnan(x)
+    sums = np.concatenate(
+        [[0.0], np.cumsum(np.where(missing, 0.0, x), dtype=np.float64)]
+    )
+    counts = np.concatenate([[0], np.cumsum(~missing)])
+    index = np.arange(x.size)
+    starts = np.maximum(index - width // 2, 0)
+    ends = np.minimum(index + width // 2 + 1, x.size)
+    with np.errstate(invalid="ignore"):
+        return (sums[ends] - sums[starts]) / (counts[ends] - counts[starts])
+
+
+def _sampling_rate(waveforms: Waveforms) -> float:
+    """The sampling rate (hertz) of `waveforms`, estimated from its first
+    timestamps if it doesn't have a uniform time axis."""
+    if waveforms.hertz is not None:
+        return waveforms.hertz
+    times = waveforms.times[:1001]
+    if len(times) < 2:
+        return 1.0
+    return 1 / float(np.median(np.diff(times)))
+
+
+def _find_troughs_chunked(
+    x: np.ndarray,
+    detector: TroughDetector,
+    hertz: float,
+    chunk_size: int,
+    overlap: Optional[int],
+) -> np.ndarray:
+    """Finds troughs in overlapping windows of `x` and stitches them together.
+
+    The chunks partition `x`, and each window is a chunk padded with `overlap`
+    timesteps either side. Each trough is kept only by the chunk it falls in.
+    Windows at the ends of `x` are shifted inwards rather than truncated, so
+    that every window is the same length.
+    """
+    assert chunk_size > 0, "`chunk_size` must be positive"
+    if overlap is None:
+        overlap = detector.context(hertz) or chunk_size // 2
+
+    n_timesteps = x.size
+    window_size = chunk_size + 2 * overlap
+    troughs = []
+    for chunk_start in range(0, n_timesteps, chunk_size):
+        chunk_end = min(chunk_start + chunk_size, n_timesteps)
+        window_start = max(
+            min(chunk_start - overlap, n_timesteps - window_size), 0
+        )
+        window_end = min(window_start + window_size, n_timesteps)
+
+        window_troughs = window_start + detector.detect(
+            x[window_start:window_end], hertz
+        )
+        troughs.append(
+            window_troughs[
+                (window_troughs >= chunk_start) & (window_troughs < chunk_end)
+            ]
+        )
+
+    return np.concatenate(troughs)
+
+
+def update_troughs(
+    waveforms: Waveforms,
+    name: str,
+    scale: Optional[int] = None,
+    overlap: Optional[int] = None,
+    detector: Optional[TroughDetector] = None,
+) -> Waveforms:
+    """Updates the troughs of a waveform after new samples have been appended
+    with `Waveforms.append`.
+
+    Only the unfinished tail of the waveform (from the last known trough
+    onwards) is re-examined, so the cost depends on the amount of new data
+    rather than on the length of the recording. The last known trough is
+    re-examined too, as it may have been found only because it was at the end
+    of the data. All earlier troughs are kept as they are.
+
+    Args:
+        waveforms: `medical_waveforms.waveforms.Waveforms` instance holding your data
+        name: Name of column in `waveforms` to find troughs in
+        scale: As for `find_troughs`
+        overlap: Number of timesteps before the last known trough that are
+            also passed to the trough finder, to give it some context. If
+            None, uses the length of the last two cycles or
+            `detector.context`, whichever is greater.
+        detector: As for `find_troughs`
+
+    Returns:
+        `waveforms` with updated trough indices at
+            `waveforms.features.waveform[`name`]['troughs']`
+    """
+    troughs = waveforms.features.waveform[name].get("troughs")
+    if troughs is None or troughs.size < 2:
+        return find_troughs(waveforms, name, scale=scale, detector=detector)
+    waveforms.features.check_column(name, waveforms.column(name))
+
+    detector = _init_detector(scale, detector)
+    hertz = _sampling_rate(waveforms)
+    if overlap is None:
+        overlap = max(
+            detector.context(hertz) or 0,
+            troughs[-1] - troughs[max(-3, -len(troughs))],
+        )
 
-    waveforms.waveforms[name] *= -1  # un-invert signal
+    x = waveforms.column(name)
+    tail_start = troughs[-1]
+    window_start = max(tail_start - overlap, 0)
+    tail_troughs = window_start + detector.detect(x[window_start:], hertz)
+    tail_troughs = tail_troughs[tail_troughs >= tail_start]
+    if tail_troughs.size == 0:
+        # Keep the last known trough rather than lose it
+        tail_troughs = troughs[-1:]
+    waveforms.features.extend(
+        "waveform", name, "troughs", troughs.size - 1, tail_troughs
+    )
     return waveforms
@@ -0,0 +1,214 @@
+"""Lazily built pipelines that derive only what requested outputs need.
+
+Rather than finding troughs, extracting every feature and running every
+signal quality check in turn, state the outputs you want for each waveform
+and let `Pipeline` work out the smallest set of steps that produce them:
+
+    pipeline = Pipeline(ChannelConfig(checks=ArterialPressureChecks()))
+    pipeline.request("pressure", cycles.MeanValue, "heart_rate")
+    results = pipeline.run(waveforms)
+
+Here only the troughs, the `MeanValue` feature and the features used by the
+'heart_rate' check are derived; the other checks are skipped. Steps share
+their intermediate results through `waveforms.features`, so e.g. a feature
+that is both requested and used by a check is only extracted once, and
+anything already held there (such as troughs) is reused.
+"""
+from typing import Dict, List, NamedTuple, Optional, Tuple, Type, Union
+
+import pandas as pd
+from pydantic import BaseModel
+
+from medical_waveforms import quality
+from medical_waveforms.channels import ChannelConfig
+from medical_waveforms.features import cycles, diffs, waveform
+from medical_waveforms.waveforms import Waveforms
+
+
+class Diff(NamedTuple):
+    """Requests the absolute differences between successive values of a
+    cycle-level feature (see
+    `medical_waveforms.features.diffs.calculate_absolute_diffs`)."""
+
+    feature: Type[cycles.CycleFeatureExtractor]
+
+
+Output = Union[Type[cycles.CycleFeatureExtractor], Diff, str]
+
+# A step is 'troughs', 'cycles', 'diffs' or 'checks', and what it derives
+Step = Tuple[str, Optional[Union[Type[cycles.CycleFeatureExtractor], str]]]
+
+
+class Pipeline:
+    """Builds and runs the steps needed for a set of requested outputs.
+
+    Outputs are requested per waveform, and can be:
+
+    - a cycle-level feature extractor class, for that feature
+    - `Diff(feature extractor class)`, for the absolute differences of that
+      feature
+    - the name of a check in the waveform's `ChannelConfig.checks`, for
+      whether each cycle passed that check
+    - 'all', for whether each cycle passed every check
+
+    A pipeline can be reused for many recordings, and compiles each
+    waveform's checks only once.
+    """
+
+    def __init__(
+        self,
+        configs: Optional[
+            Union[ChannelConfig, Dict[str, ChannelConfig]]
+        ] = None,
+    ):
+        """
+        Args:
+            configs: How to find troughs in and check each waveform, keyed by
+                waveform name, or a single config to use for all of them. If
+                None, uses the default `ChannelConfig`.
+                `ChannelConfig.feature_extractors` is ignored, as only the
+                requested features are extracted.
+        """
+        self.configs = ChannelConfig() if configs is None else configs
+        self._outputs: Dict[str, List[Output]] = {}
+        self._check_plans: Dict[str, quality.CheckPlan] = {}
+
+    def request(self, name: str, *outputs: Output) -> "Pipeline":
+        """Requests outputs for waveform `name`. Nothing is derived until
+        `run`.
+
+        Returns:
+            This pipeline, so that requests can be chained
+        """
+        requested = self._outputs.setdefault(name, [])
+        for output in outputs:
+            if isinstance(output, str):
+                assert output == "all" or output in _check_names(
+                    self._config(name).checks
+                ), f"'{output}' isn't a check for waveform '{name}'"
+            if output not in requested:
+                requested.append(output)
+        self._check_plans.pop(name, None)
+        return self
+
+    def steps(self, name: str) -> List[Step]:
+        """The steps that `run` will take for waveform `name`, in order.
+
+        Features needed by the checks are derived by the 'checks' step.
+        """
+        outputs = self._outputs.get(name, [])
+        if not outputs:
+            return []
+        steps: List[Step] = [("troughs", None)]
+        for output in outputs:
+            if isinstance(output, Diff):
+                steps.append(("diffs", output.feature))
+            elif not isinstance(output, str):
+                steps.append(("cycles", output))
+        check_names = self._check_plan(name).check_names
+        steps.extend(("checks", check_name) for check_name in check_names)
+        return steps
+
+    def run(self, waveforms: Waveforms) -> Dict[str, pd.DataFrame]:
+        """Derives the requested outputs.
+
+        Args:
+            waveforms: `medical_waveforms.waveforms.Waveforms` instance holding
+                your data
+
+        Returns:
+            For each waveform with requested outputs, a DataFrame with one row
+                per cycle and one column per requested output, in the order
+                requested. Feature columns are named after the feature
+                extractor's `class_name`, and difference columns have '_diff'
+                appended to that. `waveforms.features` holds everything that
+                was derived.
+        """
+        results = {}
+        for name, outputs in self._outputs.items():
+            waveforms, checked = self._run_steps(waveforms, name)
+            table = {}
+            for output in outputs:
+                if isinstance(output, str):
+                    table[output] = checked[output].to_numpy()
+                elif isinstance(output, Diff):
+                    fe = output.feature()
+                    table[f"{fe.class_name}_diff"] = waveforms.features.diffs[
+                        name
+                    ][fe.class_name]
+                else:
+                    feature = waveforms.features.cycles[name][
+                        output().class_name
+                    ]
+                    table[output().class_name] = (
+                        feature if feature.ndim == 1 else list(feature)
+                    )
+            results[name] = pd.DataFrame(
+                table, index=pd.RangeIndex(waveforms.features.n_cycles(name))
+            )
+        return results
+
+    def _run_steps(
+        self, waveforms: Waveforms, name: str
+    ) -> Tuple[Waveforms, Optional[pd.DataFrame]]:
+        config = self._config(name)
+        checked = None
+        for level, step in self.steps(name):
+            if level == "troughs":
+                if "troughs" not in waveforms.features.waveform[name]:
+                    waveforms = waveform.find_troughs(
+                        waveforms,
+                        name,
+                        scale=config.scale,
+                        chunk_size=config.chunk_size,
+                        detector=config.detector,
+                    )
+            elif level == "cycles":
+                waveforms = step().ensure_feature(waveforms, name)
+            elif level == "diffs":
+                waveforms = diffs.calculate_absolute_diffs(
+                    waveforms, name, step
+                )
+            elif checked is None:
+                # All the checks are run together, in one pass
+                checked = self._check_plan(name).run(waveforms, name)
+        if checked is None and "all" in self._outputs[name]:
+            # There are no checks, so every cycle passes
+            checked = self._check_plan(name).run(waveforms, name)
+        return waveforms, checked
+
+    def _config(self, name: str) -> ChannelConfig:
+        if isinstance(self.configs, ChannelConfig):
+            return self.configs
+        return self.configs[name]
+
+    def _check_plan(self, name: str) -> quality.CheckPlan:
+        """Compiles the checks for waveform `name` that the requested outputs
+        need: all of them if 'all' is requested, else just those requested."""
+        if name not in self._check_plans:
+            checks = self._config(name).checks
+            requested = {
+                output
+                for output in self._outputs.get(name, [])
+                if isinstance(output, str)
+            }
+            if checks is None:
+                checks = BaseModel()
+            elif isinstance(checks, quality.CheckPlan):
+                # Already compiled, so all of its checks are run
+                self._check_plans[name] = checks
+                return checks
+            elif "all" not in requested:
+                checks = checks.copy(include=requested)
+            self._check_plans[name] = quality.CheckPlan(checks)
+        return self._check_plans[name]
+
+
+def _check_names(
+    checks: Optional[Union[BaseModel, quality.CheckPlan]]
+) -> List[str]:
+    if checks is None:
+        return []
+    if isinstance(checks, quality.CheckPlan):
+        return checks.check_names
+    return quality.CheckPlan(checks).check_names
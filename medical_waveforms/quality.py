@@ -1,10 +1,11 @@
-from typing import Optional, Type
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Type, Union
 
 import numpy as np
 import pandas as pd
 from pydantic import BaseModel, Extra
 
-from medical_waveforms.features import cycles, diffs
+from medical_waveforms.features import cycles, diffs, morphology, rolling
 from medical_waveforms.waveforms import Waveforms
 
 
@@ -50,6 +51,59 @@ class DiffCheck(BaseModel):
     description: Optional[str] = None
 
 
+class TemplateCheck(BaseModel):
+    """A signal quality check that compares the shape of each cycle in a signal
+    with a template made from the median of recent cycles. This catches e.g.
+    damped or distorted cycles whose other features look plausible. It can be
+    added to preset checks, e.g. `ArterialPressureChecks(template=
+    TemplateCheck())`.
+
+    Args:
+        feature: The class that extracts the correlation between each cycle
+            and its template. Subclass
+            `medical_waveforms.features.morphology.TemplateCorrelation` to
+            change the number of cycles in each template.
+        threshold: The minimum acceptable correlation in order for the check
+            to pass for that cycle
+        description: A description of the check (optional and just for
+            documentation purposes)
+    """
+
+    feature: Type[
+        morphology.TemplateCorrelation
+    ] = morphology.TemplateCorrelation
+    threshold: float = 0.9
+    description: Optional[str] = None
+
+
+class BaselineCheck(BaseModel):
+    """A signal quality check that compares a feature of each cycle in a
+    signal with its rolling baseline over recent cycles. This catches sudden
+    changes that are within physiological limits for the population but not
+    for the patient, and adapts to slow trends.
+
+    Each cycle's deviation from the baseline is a robust z-score (see
+    `medical_waveforms.features.rolling.calculate_baseline_deviation`).
+
+    Args:
+        feature: The class that extracts the feature for each cycle
+        window: The number of cycles in the rolling baseline (up to and
+            including each cycle)
+        span: If not None, the duration (seconds) of the rolling baseline,
+            used instead of `window`
+        threshold: The maximum acceptable deviation from the baseline in order
+            for the check to pass for that cycle
+        description: A description of the check (optional and just for
+            documentation purposes)
+    """
+
+    feature: Type[cycles.CycleFeatureExtractor]
+    window: int = 100
+    span: Optional[float] = None
+    threshold: float = 5.0
+    description: Optional[str] = None
+
+
 class ArterialPressureChecks(BaseModel):
     """Some preset checks for use with adult human arterial pressure signals."""
 
@@ -96,8 +150,302 @@ class ArterialPressureChecks(BaseModel):
         extra = Extra.allow
 
 
+class CheckPlan:
+    """A set of signal quality checks compiled for efficient, repeated use.
+
+    Compiling finds the distinct features that the checks need (so that e.g.
+    a feature used by both a `CycleCheck` and a `DiffCheck` is only extracted
+    once) and gathers all the thresholds into arrays, so that every check can
+    be evaluated for every cycle in a single vectorized comparison. A plan can
+    be reused across many recordings.
+    """
+
+    def __init__(self, checks: BaseModel):
+        """
+        Args:
+            checks: The checks to compile. This should subclass pydantic's
+                `BaseModel` and should have attributes which are instances of
+                `CycleCheck`, `DiffCheck`, `TemplateCheck` and/or
+                `BaselineCheck`, each of which defines a check.
+        """
+        self.check_names: List[str] = []
+        self.sources: List[Tuple] = []
+        source_indices, lower, upper = [], [], []
+
+        for check_name, check in vars(checks).items():
+            if isinstance(check, CycleCheck):
+                source = ("cycles", check.feature)
+                bounds = (check.min, check.max)
+            elif isinstance(check, DiffCheck):
+                source = ("diffs", check.feature)
+                bounds = (-np.inf, check.threshold)
+            elif isinstance(check, TemplateCheck):
+                source = ("cycles", check.feature)
+                bounds = (check.threshold, np.inf)
+            elif isinstance(check, BaselineCheck):
+                if check.span is None:
+                    source = ("baseline", check.feature, check.window, None)
+                else:
+                    source = ("baseline", check.feature, None, check.span)
+                bounds = (-np.inf, check.threshold)
+            else:
+                continue
+            if source not in self.sources:
+                self.sources.append(source)
+            self.check_names.append(check_name)
+            source_indices.append(self.sources.index(source))
+            lower.append(bounds[0])
+            upper.append(bounds[1])
+
+        self._source_indices = np.array(source_indices, dtype=np.intp)
+        self._lower = np.array(lower, dtype=float)[:, np.newaxis]
+        self._upper = np.array(upper, dtype=float)[:, np.newaxis]
+
+    def run(
+        self, waveforms: Waveforms, name: str, first_cycle: int = 0
+    ) -> pd.DataFrame:
+        """Runs the checks for each cycle in a signal.
+
+        Args:
+            waveforms: `medical_waveforms.waveforms.Waveforms` instance holding
+                your data
+            name: Name of column in `waveforms` to perform signal quality
+                checks on
+            first_cycle: Only return results from this cycle onwards
+
+        Returns:
+            DataFrame in the same format as the output of `check_cycles`,
+                indexed by cycle number
+        """
+        passed = self._passed(waveforms, name, first_cycle)
+        index = pd.RangeIndex(first_cycle, first_cycle + passed.shape[1])
+        checked_df = pd.DataFrame(
+            dict(zip(self.check_names, passed)), index=index
+        )
+        checked_df["all"] = passed.all(axis=0)
+        return checked_df
+
+    def run_packed(
+        self, waveforms: Waveforms, name: str, first_cycle: int = 0
+    ) -> "PackedCheckResults":
+        """As for `run`, but returns the results as a `PackedCheckResults`
+        without building a DataFrame."""
+        return PackedCheckResults.pack(
+            self.check_names,
+            self._passed(waveforms, name, first_cycle),
+            first_cycle,
+        )
+
+    def _passed(
+        self, waveforms: Waveforms, name: str, first_cycle: int
+    ) -> np.ndarray:
+        """Boolean array of shape (n_checks, n_cycles - `first_cycle`) which
+        is True where a check passed for a cycle."""
+        keys = []
+        for level, feature_extractor, *window in self.sources:
+            if level == "cycles":
+                # Flag unphysiological cycles
+                waveforms = feature_extractor().ensure_feature(waveforms, name)
+                keys.append((level, feature_extractor().class_name))
+            elif level == "diffs":
+                # Flag unphysiological cycle-to-cycle changes
+                waveforms = diffs.calculate_absolute_diffs(
+                    waveforms, name, feature_extractor
+                )
+                keys.append((level, feature_extractor().class_name))
+            else:
+                # Flag sudden changes from recent cycles
+                waveforms = rolling.calculate_baseline_deviation(
+                    waveforms, name, feature_extractor, *window
+                )
+                keys.append(
+                    (
+                        "cycles",
+                        rolling.rolling_key(
+                            feature_extractor, "deviation", *window
+                        ),
+                    )
+                )
+
+        return self._compare(
+            [
+                getattr(waveforms.features, level)[name][key][first_cycle:]
+                for level, key in keys
+            ],
+            n_cycles=max(waveforms.features.n_cycles(name) - first_cycle, 0),
+        )
+
+    def _compare(self, sources: List[np.ndarray], n_cycles: int) -> np.ndarray:
+        """Compares the values of each of `self.sources` for `n_cycles`
+        cycles with the checks' bounds, as for `_passed`."""
+        if not self.check_names:
+            return np.ones((0, n_cycles), dtype=bool)
+        values = np.stack(sources)[self._source_indices]
+        return (values > self._lower) & (values < self._upper)
+
+
+class PackedCheckResults:
+    """Compact per-cycle signal quality check results, holding each cycle's
+    results as a bitmask in one unsigned integer rather than one Boolean
+    column per check.
+
+    Bit i of a cycle's mask is set if check `check_names[i]` failed for that
+    cycle, so `check_names` is the registry mapping checks to bits. A cycle
+    passed all checks if its mask is 0. Masks are 1, 2, 4 or 8 bytes per
+    cycle (for up to 8, 16, 32 or 64 checks), compared with one byte per check
+    (plus 'all') per cycle in the output of `check_cycles`.
+    """
+
+    def __init__(
+        self,
+        check_names: Sequence[str],
+        failures: np.ndarray,
+        first_cycle: int = 0,
+    ):
+        """
+        Args:
+            check_names: Name of the check for each bit, from the lowest
+            failures: Bitmask of failed checks for each cycle
+            first_cycle: Number of the first cycle in `failures`
+        """
+        self.check_names = tuple(check_names)
+        self.failures = np.asarray(failures)
+        self.first_cycle = first_cycle
+        assert self.failures.dtype == _mask_dtype(
+            len(self.check_names)
+        ), "`failures` has the wrong dtype for the number of checks"
+
+    @classmethod
+    def pack(
+        cls,
+        check_names: Sequence[str],
+        passed: np.ndarray,
+        first_cycle: int = 0,
+    ) -> "PackedCheckResults":
+        """Packs check results.
+
+        Args:
+            check_names: Name of each check
+            passed: Boolean array of shape (n_checks, n_cycles) which is True
+                where a check passed for a cycle
+            first_cycle: Number of the first cycle in `passed`
+        """
+        dtype = _mask_dtype(len(check_names))
+        failures = np.zeros(passed.shape[1], dtype=dtype)
+        for bit, check_passed in enumerate(passed):
+            failures |= (~check_passed).astype(dtype) << dtype.type(bit)
+        return cls(check_names, failures, first_cycle)
+
+    @classmethod
+    def from_dataframe(cls, checked: pd.DataFrame) -> "PackedCheckResults":
+        """Packs the output of `check_cycles` or `update_check_cycles`."""
+        check_names = [column for column in checked if column != "all"]
+        first_cycle = int(checked.index[0]) if len(checked) else 0
+        return cls.pack(
+            check_names,
+            checked[check_names].to_numpy(dtype=bool).T,
+            first_cycle,
+        )
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Unpacks the results into the same format as the output of
+        `check_cycles`."""
+        checked_df = pd.DataFrame(
+            {
+                check_name: self.passed(check_name)
+                for check_name in self.check_names
+            },
+            index=pd.RangeIndex(
+                self.first_cycle, self.first_cycle + len(self)
+            ),
+        )
+        checked_df["all"] = self.passed()
+        return checked_df
+
+    def __len__(self) -> int:
+        return self.failures.size
+
+    def passed(self, check_name: Optional[str] = None) -> np.ndarray:
+        """Whether each cycle passed check `check_name`, or all checks if
+        None."""
+        if check_name is None:
+            return self.failures == 0
+        return (self.failures & self._bit(check_name)) == 0
+
+    def failed_checks(self, cycle: int) -> List[str]:
+        """Names of the checks that cycle number `cycle` failed."""
+        mask = int(self.failures[cycle - self.first_cycle])
+        return [
+            check_name
+            for bit, check_name in enumerate(self.check_names)
+            if mask >> bit & 1
+        ]
+
+    def failure_counts(self) -> pd.Series:
+        """Number of cycles that failed each check, and that failed any check
+        (as 'all')."""
+        counts = {
+            check_name: len(self) - np.count_nonzero(self.passed(check_name))
+            for check_name in self.check_names
+        }
+        counts["all"] = np.count_nonzero(self.failures)
+        return pd.Series(counts, dtype=np.int64)
+
+    def failure_runs(self, check_name: Optional[str] = None) -> pd.DataFrame:
+        """Finds runs of consecutive cycles that failed check `check_name`, or
+        any check if None.
+
+        Returns:
+            DataFrame with one row for each run, with columns 'first_cycle'
+                (the number of the first cycle in the run) and 'n_cycles'
+        """
+        edges = np.diff(
+            (~self.passed(check_name)).astype(np.int8), prepend=0, append=0
+        )
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        return pd.DataFrame(
+            {
+                "first_cycle": self.first_cycle + starts,
+                "n_cycles": ends - starts,
+            }
+        )
+
+    def save(self, path: Union[str, Path]):
+        """Saves the results to a compressed NumPy `.npz` file."""
+        np.savez_compressed(
+            path,
+            check_names=np.array(self.check_names, dtype=str),
+            failures=self.failures,
+            first_cycle=self.first_cycle,
+        )
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "PackedCheckResults":
+        """Loads results saved with `save`."""
+        with np.load(path, allow_pickle=False) as saved:
+            return cls(
+                saved["check_names"].tolist(),
+                saved["failures"],
+                int(saved["first_cycle"]),
+            )
+
+    def _bit(self, check_name: str) -> int:
+        return 1 << self.check_names.index(check_name)
+
+
+def _mask_dtype(n_checks: int) -> np.dtype:
+    """Smallest unsigned integer type with a bit for each of `n_checks`."""
+    for dtype in np.uint8, np.uint16, np.uint32, np.uint64:
+        if n_checks <= np.iinfo(dtype).bits:
+            return np.dtype(dtype)
+    raise ValueError("At most 64 checks can be packed")
+
+
 def check_cycles(
-    waveforms: Waveforms, name: str, checks: Type[BaseModel]
+    waveforms: Waveforms,
+    name: str,
+    checks: Union[Type[BaseModel], CheckPlan],
 ) -> pd.DataFrame:
     """Runs signal quality checks for each cycle in a signal.
 
@@ -105,8 +453,14 @@ def check_cycles(
         waveforms: `medical_waveforms.waveforms.Waveforms` instance holding your data
         name: Name of column in `waveforms` to perform signal quality checks on
         checks: The checks to run. This should subclass pydantic's `BaseModel`
-            and should have attributes which are instances of `CycleCheck`
-            and/or `DiffCheck`, each of which defines a check.
+            and should have attributes which are instances of `CycleCheck`,
+            `DiffCheck`, `TemplateCheck` and/or `BaselineCheck`, each of which
+            defines a check. Alternatively, a `CheckPlan` compiled from such
+            checks, which saves repeating the compilation when checking many
+            signals.
+
+    Features that are already held in `waveforms.features` are reused rather
+    than extracted again.
 
     Returns:
         DataFrame with one row for each cycle in the signal. Has one Boolean
@@ -114,33 +468,176 @@ def check_cycles(
             cycle, else False. Also has an 'all' column which is positive if
             all checks passed for that cycle.
     """
-    checked = {}
-
-    for check_name, check in vars(checks).items():
-        if isinstance(check, CycleCheck):
-            # Flag unphysiological cycles
-            feature_extractor = check.feature()
-            waveforms = check.feature().extract_feature(waveforms, name)
-            checked[check_name] = (
-                waveforms.features.cycles[name][feature_extractor.class_name]
-                > check.min
-            ) & (
-                waveforms.features.cycles[name][feature_extractor.class_name]
-                < check.max
-            )
+    return _compile(checks).run(waveforms, name)
 
-        elif isinstance(check, DiffCheck):
-            # Flag unphysiological cycle-to-cycle changes
-            feature_extractor = check.feature()
-            waveforms = diffs.calculate_absolute_diffs(
-                waveforms, name, check.feature
-            )
-            checked[check_name] = (
-                waveforms.features.diffs[name][feature_extractor.class_name]
-                < check.threshold
-            )
 
-    checked_df = pd.DataFrame(checked)
-    checked_df["all"] = checked_df.all(axis=1)
+def update_check_cycles(
+    waveforms: Waveforms,
+    name: str,
+    checks: Union[Type[BaseModel], CheckPlan],
+    checked: pd.DataFrame,
+) -> pd.DataFrame:
+    """Updates the results of `check_cycles` after new cycles have been found
+    with `medical_waveforms.features.waveform.update_troughs`.
+
+    Features, differences and checks are only recalculated from the last
+    previously checked cycle onwards (as its ending trough may have changed).
+
+    Args:
+        waveforms: `medical_waveforms.waveforms.Waveforms` instance holding your data
+        name: Name of column in `waveforms` to perform signal quality checks on
+        checks: The checks to run, as for `check_cycles`
+        checked: The previous output of `check_cycles` or
+            `update_check_cycles` for `waveforms`, `name` and `checks`
+
+    Returns:
+        DataFrame in the same format as the output of `check_cycles`, with
+            one row for each cycle in the updated signal
+    """
+    first_cycle = max(len(checked) - 1, 0)
+    new_checked_df = _compile(checks).run(waveforms, name, first_cycle)
+    return pd.concat([checked.iloc[:first_cycle], new_checked_df])
+
+
+def signal_quality_index(
+    waveforms: Waveforms,
+    name: str,
+    checked: pd.DataFrame,
+    windows: Sequence[float] = (10.0, 60.0, 300.0),
+    origin: float = 0.0,
+) -> Dict[float, pd.DataFrame]:
+    """Aggregates the per-cycle results of `check_cycles` into signal quality
+    indices over fixed windows of time, e.g. the fraction of cycles that
+    passed all checks in each minute.
+
+    Cycles are assigned to the window that they start in. Windows of each
+    size are aligned to `origin` and cover the signal from its first to its
+    last checked cycle. Each window size takes one vectorized pass over the
+    cycles' start times.
+
+    Args:
+        waveforms: `medical_waveforms.waveforms.Waveforms` instance holding your
+            data
+        name: Name of column in `waveforms` that was checked
+        checked: The output of `check_cycles` or `update_check_cycles` for
+            `waveforms` and `name`
+        windows: Durations (seconds) of windows to aggregate over
+        origin: Time (seconds) at which windows start
+
+    Returns:
+        Dictionary mapping each of `windows` to a DataFrame with one row for
+            each window, indexed by the window's start time. Has an
+            'n_cycles' column with the number of cycles starting in that
+            window, and a column for each column of `checked` with the
+            fraction of those cycles that passed (NaN for windows without
+            cycles).
+    """
+    start_times = _start_times(waveforms, name, checked)
+    return {
+        window: _aggregate(start_times, checked, window, origin)
+        for window in windows
+    }
+
+
+def update_signal_quality_index(
+    waveforms: Waveforms,
+    name: str,
+    checked: pd.DataFrame,
+    sqi: Dict[float, pd.DataFrame],
+    origin: float = 0.0,
+) -> Dict[float, pd.DataFrame]:
+    """Updates the output of `signal_quality_index` after new cycles have been
+    checked with `update_check_cycles`.
+
+    Only the last previously aggregated window of each size (which may have
+    been incomplete, or may hold a cycle whose result has changed) and any
+    later windows are recalculated.
+
+    Args:
+        waveforms: `medical_waveforms.waveforms.Waveforms` instance holding your
+            data
+        name: Name of column in `waveforms` that was checked
+        checked: The updated output of `update_check_cycles`
+        sqi: The previous output of `signal_quality_index` or
+            `update_signal_quality_index` for `waveforms` and `name`
+        origin: As for `signal_quality_index`
+
+    Returns:
+        Dictionary in the same format as the output of
+            `signal_quality_index`, with the same window sizes as `sqi`
+    """
+    start_times = _start_times(waveforms, name, checked)
+    updated = {}
+    for window, aggregated in sqi.items():
+        if aggregated.empty:
+            updated[window] = _aggregate(start_times, checked, window, origin)
+            continue
+        first_cycle = int(
+            np.searchsorted(start_times, aggregated.index[-1], side="left")
+        )
+        updated[window] = pd.concat(
+            [
+                aggregated.iloc[:-1],
+                _aggregate(
+                    start_times[first_cycle:],
+                    checked.iloc[first_cycle:],
+                    window,
+                    origin,
+                ),
+            ]
+        )
+    return updated
+
+
+def _start_times(
+    waveforms: Waveforms, name: str, checked: pd.DataFrame
+) -> np.ndarray:
+    """Start time of each cycle in `checked`."""
+    cycle_index = waveforms.features.cycle_index(name, waveforms.times)
+    return cycle_index.start_times[: len(checked)]
+
+
+def _aggregate(
+    start_times: np.ndarray,
+    checked: pd.DataFrame,
+    window: float,
+    origin: float,
+) -> pd.DataFrame:
+    """Counts the cycles starting in each window of duration `window`, and the
+    fraction of them that passed each check in `checked`."""
+    bins = np.floor((start_times - origin) / window).astype(np.int64)
+    if bins.size == 0:
+        return pd.DataFrame(
+            columns=["n_cycles", *checked.columns],
+            index=pd.Index([], dtype=float, name="window_start"),
+        )
+
+    # Cycles are in time order, so each window's cycles are contiguous
+    first_bin = bins[0]
+    bins -= first_bin
+    occupied = np.flatnonzero(np.diff(bins, prepend=-1))
+    passed = np.zeros((bins[-1] + 1, checked.shape[1]))
+    passed[bins[occupied]] = np.add.reduceat(
+        checked.to_numpy(dtype=float), occupied, axis=0
+    )
+    n_cycles = np.zeros(bins[-1] + 1, dtype=np.int64)
+    n_cycles[bins[occupied]] = np.diff(np.append(occupied, bins.size))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fractions = passed / n_cycles[:, np.newaxis]
+    aggregated = pd.DataFrame(
+        fractions,
+        columns=checked.columns,
+        index=pd.Index(
+            origin + (first_bin + np.arange(bins[-1] + 1)) * window,
+            name="window_start",
+        ),
+    )
+    aggregated.insert(0, "n_cycles", n_cycles)
+    return aggregated
+
 
-    return checked_df
+def _compile(checks: Union[Type[BaseModel], CheckPlan]) -> CheckPlan:
+    if isinstance(checks, CheckPlan):
+        return checks
+    return CheckPlan(checks)
@@ -0,0 +1,416 @@
+"""An asyncio service that assesses many live waveform streams at once.
+
+Each bed (monitor) streams blocks of samples to a `StreamingService`, which
+keeps that bed's trough, cycle and signal quality state (see
+`medical_waveforms.chunked.process_in_chunks`) and pushes the results for
+each completed cycle to subscribers. The NumPy work is run on a thread pool
+rather than on the event loop, and each bed's blocks are processed in turn by
+its own task, so one slow bed doesn't hold up the others.
+
+Streams can be fed in-process (`StreamingService.feed`) or over a local TCP or
+Unix socket (`StreamingService.serve`), with one JSON message per line:
+
+- `{"bed": "bed-1", "samples": {"time": [...], "pressure": [...]}}` adds a
+  block of samples to a bed's stream
+- `{"bed": "bed-1", "end": true}` ends a bed's stream
+- `{"subscribe": "bed-1"}` (or `null` for every bed) makes the server write
+  each completed cycle's results to the connection, one JSON object per line.
+  Missing (NaN) and infinite values are written as `null`.
+
+Messages that can't be handled (e.g. malformed JSON, missing keys, lines
+longer than the server's limit, or samples for a bed whose processing has
+failed) get an `{"error": "..."}` reply, and the connection stays open.
+
+`simulate_monitor` feeds a socket with synthetic arterial pressure data, e.g.
+for testing.
+"""
+import asyncio
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from medical_waveforms import synthetic
+from medical_waveforms.channels import ChannelConfig
+from medical_waveforms.chunked import _ChunkedRun
+
+
+class _Bed:
+    """A bed's pending blocks of samples, processing state and worker task,
+    and the exception that processing failed with (if it has)."""
+
+    def __init__(self, run: _ChunkedRun, max_pending_blocks: int):
+        self.run = run
+        self.blocks: asyncio.Queue = asyncio.Queue(max_pending_blocks)
+        self.task: Optional[asyncio.Task] = None
+        self.error: Optional[Exception] = None
+
+
+class StreamingService:
+    """Runs trough finding, feature extraction and signal quality checks on
+    many concurrent streams of samples, and publishes the results.
+
+    Results for a cycle are published once the chunk of samples that
+    completes it (plus its overlap, see
+    `medical_waveforms.features.waveform.find_troughs`) has arrived, so the
+    latency is bounded by `chunk_size` + `overlap` samples plus the time
+    taken to process them.
+
+    If processing a bed's samples fails (e.g. a block is missing the waveform
+    column), the error is published to its subscribers as
+    `{'bed': ..., 'error': ...}`, and feeding that bed raises a
+    `RuntimeError` until its stream is ended. Other beds carry on.
+    """
+
+    def __init__(
+        self,
+        name: str = "pressure",
+        config: Optional[ChannelConfig] = None,
+        chunk_size: int = 1000,
+        overlap: Optional[int] = None,
+        context_cycles: int = 2,
+        time_column_name: str = "time",
+        hertz: Optional[float] = None,
+        max_workers: Optional[int] = None,
+        max_pending_blocks: int = 16,
+        max_pending_results: int = 1024,
+    ):
+        """
+        Args:
+            name: Name of the waveform column in each stream
+            config: How to process each stream, as for
+                `medical_waveforms.chunked.process_in_chunks`. Short chunks
+                suit
+                `medical_waveforms.features.waveform.UpstrokeTroughDetector`
+                better than the default trough detector.
+            chunk_size: As for `medical_waveforms.chunked.process_in_chunks`
+            overlap: As for `medical_waveforms.chunked.process_in_chunks`
+            context_cycles: As for
+                `medical_waveforms.chunked.process_in_chunks`
+            time_column_name: The name of the timestamps column
+            hertz: As for `medical_waveforms.waveforms.Waveforms`
+            max_workers: Number of threads processing streams. If None, uses
+                the default for `concurrent.futures.ThreadPoolExecutor`.
+            max_pending_blocks: Maximum number of blocks waiting to be
+                processed for each bed. Feeding a bed with a full queue waits
+                until there is space, which slows down only that bed's feed.
+            max_pending_results: Maximum number of results waiting to be read
+                by each subscriber. When a subscriber falls this far behind,
+                its oldest results are dropped rather than delaying any bed.
+        """
+        self.name = name
+        self.config = ChannelConfig() if config is None else config
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.context_cycles = context_cycles
+        self.time_column_name = time_column_name
+        self.hertz = hertz
+        self.max_pending_blocks = max_pending_blocks
+        self.max_pending_results = max_pending_results
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._beds: Dict[str, _Bed] = {}
+        self._subscribers: Dict[asyncio.Queue, Optional[str]] = {}
+
+    async def feed(self, bed: str, block: pd.DataFrame):
+        """Adds a block of samples to the stream of `bed`, starting a new
+        stream if it hasn't got one.
+
+        Raises:
+            RuntimeError: If processing the stream of `bed` has failed. End
+                the stream (see `end`) to start a new one.
+        """
+        if bed not in self._beds:
+            state = _Bed(
+                _ChunkedRun(
+                    name=self.name,
+                    config=self.config,
+                    chunk_size=self.chunk_size,
+                    overlap=self.overlap,
+                    context_cycles=self.context_cycles,
+                    time_column_name=self.time_column_name,
+                    hertz=self.hertz,
+                    start_time=0.0,
+                ),
+                self.max_pending_blocks,
+            )
+            state.task = asyncio.create_task(self._process_bed(bed, state))
+            self._beds[bed] = state
+        state = self._beds[bed]
+        _raise_if_failed(bed, state)
+        await state.blocks.put(block)
+
+    async def end(self, bed: str):
+        """Ends the stream of `bed`, once its remaining cycles have been
+        published.
+
+        Raises:
+            RuntimeError: If processing the stream of `bed` has failed
+        """
+        state = self._beds.pop(bed, None)
+        if state is None:
+            return
+        await state.blocks.put(None)
+        await state.task
+        _raise_if_failed(bed, state)
+
+    def subscribe(self, bed: Optional[str] = None) -> asyncio.Queue:
+        """Subscribes to the results for each cycle of `bed`, or of every bed
+        if None.
+
+        Returns:
+            Queue that receives one dictionary per cycle, holding the bed
+                ('bed'), the cycle number ('cycle') and the cycle's row of
+                `medical_waveforms.batch.cycles_table`
+        """
+        results: asyncio.Queue = asyncio.Queue(self.max_pending_results)
+        self._subscribers[results] = bed
+        return results
+
+    def unsubscribe(self, results: asyncio.Queue):
+        """Stops publishing to a queue returned by `subscribe`."""
+        self._subscribers.pop(results, None)
+
+    async def serve(
+        self,
+        path: Optional[Union[str, Path]] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        max_message_bytes: int = 2**24,
+    ) -> asyncio.AbstractServer:
+        """Starts accepting streams and subscriptions over a socket (see the
+        module docstring for the protocol).
+
+        Args:
+            path: Path of a Unix socket to listen on. If None, listens on a
+                TCP socket instead.
+            host: Host of the TCP socket
+            port: Port of the TCP socket. If 0, an unused port is chosen (see
+                `server.sockets[0].getsockname()`).
+            max_message_bytes: Maximum length of a message (line). Longer
+                messages are discarded with an error reply.
+
+        Returns:
+            The server, which should be closed when no longer needed
+        """
+        if path is not None:
+            return await asyncio.start_unix_server(
+                self._handle_connection,
+                path=str(path),
+                limit=max_message_bytes,
+            )
+        return await asyncio.start_server(
+            self._handle_connection,
+            host=host,
+            port=port,
+            limit=max_message_bytes,
+        )
+
+    async def close(self):
+        """Ends every stream and stops the worker threads. Streams whose
+        processing has failed are ended too, without raising."""
+        for bed in list(self._beds):
+            try:
+                await self.end(bed)
+            except RuntimeError:
+                pass
+        self._executor.shutdown()
+
+    async def _process_bed(self, bed: str, state: _Bed):
+        loop = asyncio.get_running_loop()
+        while True:
+            block = await state.blocks.get()
+            if state.error is None:
+                try:
+                    tables = await loop.run_in_executor(
+                        self._executor, _process_block, state.run, block
+                    )
+                except Exception as exc:
+                    # Discard the bed's later blocks, so that feeding it
+                    #  never waits for space in its queue
+                    state.error = exc
+                    self._publish_error(bed, exc)
+                else:
+                    for table in tables:
+                        self._publish(bed, table)
+            if block is None:
+                return
+
+    def _publish(self, bed: str, table: pd.DataFrame):
+        records = table.rename_axis("cycle").reset_index().to_dict("records")
+        self._publish_records(bed, records)
+
+    def _publish_error(self, bed: str, error: Exception):
+        self._publish_records(bed, [{"error": repr(error)}])
+
+    def _publish_records(self, bed: str, records: List[Dict[str, Any]]):
+        for results, subscribed_bed in self._subscribers.items():
+            if subscribed_bed is not None and subscribed_bed != bed:
+                continue
+            for record in records:
+                if results.full():
+                    results.get_nowait()
+                results.put_nowait({"bed": bed, **record})
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        forwarders: List[asyncio.Task] = []
+        try:
+            while True:
+                try:
+                    line = await _read_line(reader)
+                    if not line:
+                        break
+                    forwarder = await self._handle_message(line, writer)
+                except (ValueError, KeyError, RuntimeError) as exc:
+                    writer.write(
+                        (json.dumps({"error": repr(exc)}) + "\n").encode()
+                    )
+                    await writer.drain()
+                    continue
+                if forwarder is not None:
+                    forwarders.append(forwarder)
+            # Keep publishing to subscribers until they disconnect
+            await asyncio.gather(*forwarders)
+        except ConnectionError:
+            pass
+        finally:
+            for forwarder in forwarders:
+                forwarder.cancel()
+            writer.close()
+
+    async def _handle_message(
+        self, line: bytes, writer: asyncio.StreamWriter
+    ) -> Optional[asyncio.Task]:
+        """Acts on one message from a connection. Returns the task forwarding
+        results to `writer` if the message is a subscription."""
+        message = json.loads(line)
+        if not isinstance(message, dict):
+            raise ValueError(f"Messages must be JSON objects, not {line!r}")
+        if "subscribe" in message:
+            return asyncio.create_task(
+                self._forward(self.subscribe(message["subscribe"]), writer)
+            )
+        if message.get("end"):
+            await self.end(message["bed"])
+        else:
+            await self.feed(message["bed"], pd.DataFrame(message["samples"]))
+        return None
+
+    async def _forward(
+        self, results: asyncio.Queue, writer: asyncio.StreamWriter
+    ):
+        """Writes each result published to `results` to `writer`."""
+        try:
+            while True:
+                record = await results.get()
+                record = {
+                    key: _to_json(value) for key, value in record.items()
+                }
+                writer.write((json.dumps(record) + "\n").encode())
+                await writer.drain()
+        finally:
+            self.unsubscribe(results)
+
+
+def _raise_if_failed(bed: str, state: _Bed):
+    if state.error is not None:
+        raise RuntimeError(
+            f"Processing the stream of {bed!r} failed"
+        ) from state.error
+
+
+def _process_block(
+    run: _ChunkedRun, block: Optional[pd.DataFrame]
+) -> List[pd.DataFrame]:
+    """Processes a block of samples (or the end of the stream, if None) on a
+    worker thread."""
+    if block is None:
+        return list(run.process_chunks(final=True))
+    run.append(block)
+    return list(run.process_chunks(final=False))
+
+
+async def _read_line(reader: asyncio.StreamReader) -> bytes:
+    """Reads a line from a connection (b"" at its end). A line longer than
+    the reader's limit is discarded, and raises `ValueError`."""
+    try:
+        return await reader.readuntil(b"\n")
+    except asyncio.IncompleteReadError as exc:
+        return exc.partial
+    except asyncio.LimitOverrunError as exc:
+        overrun = exc
+    # Discard the line, a limit's worth at a time
+    while True:
+        await reader.readexactly(overrun.consumed)
+        try:
+            await reader.readuntil(b"\n")
+            break
+        except asyncio.IncompleteReadError:
+            break
+        except asyncio.LimitOverrunError as exc:
+            overrun = exc
+    raise ValueError("Message is longer than the server's limit")
+
+
+def _to_json(value: Any) -> Any:
+    """A value of a result in a form that JSON can represent, i.e. with NumPy
+    scalars as Python values and with NaNs and infinities as None."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+async def simulate_monitor(
+    bed: str,
+    path: Optional[Union[str, Path]] = None,
+    host: str = "127.0.0.1",
+    port: int = 0,
+    data: Optional[pd.DataFrame] = None,
+    block_size: int = 100,
+    speed: Optional[float] = 1.0,
+    **synthetic_kwargs,
+):
+    """Streams synthetic arterial pressure data to a `StreamingService`
+    socket, as a bedside monitor would.
+
+    Args:
+        bed: Name of the bed to stream as
+        path: As for `StreamingService.serve`
+        host: As for `StreamingService.serve`
+        port: As for `StreamingService.serve`
+        data: Samples to stream. If None, generates them with
+            `medical_waveforms.synthetic.synthetic_arterial_pressure_data`
+            and `synthetic_kwargs`.
+        block_size: Number of samples sent in each message
+        speed: How many times faster than real time to stream the samples.
+            If None, streams them as fast as possible.
+        synthetic_kwargs: Arguments for `synthetic_arterial_pressure_data`
+    """
+    if data is None:
+        data = synthetic.synthetic_arterial_pressure_data(**synthetic_kwargs)
+    if path is not None:
+        _, writer = await asyncio.open_unix_connection(str(path))
+    else:
+        _, writer = await asyncio.open_connection(host, port)
+
+    sample_period = float(np.median(np.diff(data["time"].to_numpy()[:1001])))
+    try:
+        for block_start in range(0, len(data), block_size):
+            block = data.iloc[block_start : block_start + block_size]
+            message = {"bed": bed, "samples": block.to_dict("list")}
+            writer.write((json.dumps(message) + "\n").encode())
+            await writer.drain()
+            if speed is not None:
+                await asyncio.sleep(len(block) * sample_period / speed)
+        writer.write((json.dumps({"bed": bed, "end": True}) + "\n").encode())
+        await writer.drain()
+    finally:
+        writer.close()
+        await writer.wait_closed()
@@ -0,0 +1,213 @@
+"""Saving and loading derived features in columnar formats.
+
+Each waveform's features are saved as one table per level in its own
+subdirectory of the output directory:
+
+- `troughs`: the trough indices
+- `cycles`: one column per cycle-level feature
+- `diffs`: one column per absolute difference feature
+- `quality`: one Boolean column per signal quality check, plus 'all'
+
+Tables are written in Arrow IPC ('.arrow') format, which can be memory-mapped
+when loading so that features are read without being copied, or in Parquet
+('.parquet') format, which is smaller on disk. Both require pyarrow.
+"""
+import importlib.util
+from pathlib import Path
+from typing import Dict, Mapping, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from medical_waveforms.quality import PackedCheckResults
+from medical_waveforms.waveforms import Waveforms
+
+if importlib.util.find_spec("pyarrow"):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+FILE_FORMATS = (".arrow", ".parquet")
+
+LEVELS = ("troughs", "cycles", "diffs", "quality")
+
+
+def save_features(
+    waveforms: Waveforms,
+    directory: Union[str, Path],
+    checked: Optional[
+        Mapping[str, Union[pd.DataFrame, PackedCheckResults]]
+    ] = None,
+    file_format: str = ".arrow",
+    chunk_size: Optional[int] = None,
+):
+    """Saves the troughs, cycle-level features, absolute differences and
+    (optionally) signal quality check results of every waveform.
+
+    Only features that are current for every cycle (see
+    `medical_waveforms.waveforms.FeaturesContainer.is_current`) are saved, as
+    any others would be recalculated anyway. Columns are built from the
+    feature arrays without copying them. Features with more than one value
+    per cycle (e.g.
+    `medical_waveforms.features.morphology.ResampledCycles`) are saved as
+    fixed-size lists.
+
+    Args:
+        waveforms: `medical_waveforms.waveforms.Waveforms` instance holding your
+            data
+        directory: Where to save the features
+        checked: Signal quality check results for each waveform, as output by
+            `medical_waveforms.quality.check_cycles` or as
+            `medical_waveforms.quality.PackedCheckResults`
+        file_format: One of `FILE_FORMATS`
+        chunk_size: If not None, each table is written in chunks (Arrow record
+            batches or Parquet row groups) of this many rows, so that large
+            records are never converted all at once. Loading a chunked Arrow
+            table needs a copy of each feature to join its chunks, so leave
+            this as None to have memory-mapped loading without copies.
+    """
+    _require_pyarrow()
+    assert (
+        file_format in FILE_FORMATS
+    ), f"`file_format` must be in {FILE_FORMATS}"
+    directory = Path(directory)
+    features = waveforms.features
+    for name in waveforms.names:
+        tables = {}
+        troughs = features.waveform[name].get("troughs")
+        if troughs is not None:
+            tables["troughs"] = {"troughs": troughs}
+        for level in "cycles", "diffs":
+            tables[level] = {
+                key: feature
+                for key, feature in getattr(features, level)[name].items()
+                if features.is_current(name, key, level)
+            }
+        if checked is not None and name in checked:
+            checked_df = checked[name]
+            if isinstance(checked_df, PackedCheckResults):
+                checked_df = checked_df.to_dataframe()
+            tables["quality"] = {
+                column: checked_df[column].to_numpy() for column in checked_df
+            }
+
+        (directory / name).mkdir(parents=True, exist_ok=True)
+        for level, columns in tables.items():
+            if columns:
+                _write_table(
+                    _to_table(columns),
+                    directory / name / f"{level}{file_format}",
+                    chunk_size,
+                )
+
+
+def load_features(
+    waveforms: Waveforms, directory: Union[str, Path]
+) -> Waveforms:
+    """Loads features saved with `save_features` into `waveforms`, replacing
+    any features that it already holds for the saved waveforms.
+
+    Arrow files are memory-mapped, so features are only read from disk as they
+    are used, and aren't copied unless they were saved in chunks. Loaded
+    features are read-only.
+
+    Args:
+        waveforms: `medical_waveforms.waveforms.Waveforms` instance holding the
+            data that the features were derived from
+        directory: Where the features were saved
+
+    Returns:
+        `waveforms` with the loaded features in `waveforms.features`
+    """
+    for name in waveforms.names:
+        tables = _read_tables(Path(directory) / name)
+        if not tables:
+            continue
+        waveforms.features.invalidate(name)
+        # Troughs first, as changing them truncates cycle-level features
+        if "troughs" in tables:
+            waveforms.features.waveform[name]["troughs"] = tables["troughs"][
+                "troughs"
+            ]
+        for level in "cycles", "diffs":
+            getattr(waveforms.features, level)[name].update(
+                tables.get(level, {})
+            )
+    return waveforms
+
+
+def load_check_results(
+    directory: Union[str, Path], name: str
+) -> Optional[pd.DataFrame]:
+    """Loads the signal quality check results of waveform `name` saved with
+    `save_features`, in the same format as the output of
+    `medical_waveforms.quality.check_cycles`, or None if none were saved."""
+    quality = _read_tables(Path(directory) / name).get("quality")
+    if quality is None:
+        return None
+    return pd.DataFrame(quality)
+
+
+def _require_pyarrow():
+    if not importlib.util.find_spec("pyarrow"):
+        raise ImportError("Saving and loading features requires pyarrow")
+
+
+def _to_table(columns: Mapping[str, np.ndarray]) -> "pa.Table":
+    arrays = {}
+    for key, feature in columns.items():
+        feature = np.ascontiguousarray(feature)
+        if feature.ndim > 1:
+            arrays[key] = pa.FixedSizeListArray.from_arrays(
+                pa.array(feature.reshape(-1)), feature.shape[1]
+            )
+        else:
+            arrays[key] = pa.array(feature)
+    return pa.table(arrays)
+
+
+def _write_table(table: "pa.Table", path: Path, chunk_size: Optional[int]):
+    if path.suffix == ".parquet":
+        pq.write_table(table, path, row_group_size=chunk_size)
+        return
+    with pa.OSFile(str(path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            for batch in table.to_batches(max_chunksize=chunk_size):
+                writer.write_batch(batch)
+
+
+def _read_tables(directory: Path) -> Dict[str, Dict[str, np.ndarray]]:
+    """Reads every saved table in `directory`, as a mapping from level to a
+    mapping from column name to array."""
+    tables = {}
+    for level in LEVELS:
+        for file_format in FILE_FORMATS:
+            path = directory / f"{level}{file_format}"
+            if path.exists():
+                _require_pyarrow()
+                table = _read_table(path)
+                tables[level] = {
+                    key: _to_numpy(column)
+                    for key, column in zip(table.column_names, table.columns)
+                }
+    return tables
+
+
+def _read_table(path: Path) -> "pa.Table":
+    if path.suffix == ".parquet":
+        return pq.read_table(path, memory_map=True)
+    return pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+
+
+def _to_numpy(column: "pa.ChunkedArray") -> np.ndarray:
+    """Converts `column` to a NumPy array, without copying it if it is a single
+    chunk of fixed-width numbers."""
+    array = (
+        column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+    )
+    if pa.types.is_fixed_size_list(array.type):
+        return (
+            array.flatten()
+            .to_numpy(zero_copy_only=False)
+            .reshape(-1, array.type.list_size)
+        )
+    return array.to_numpy(zero_copy_only=False)
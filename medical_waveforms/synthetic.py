@@ -102,6 +102,7 @@ def synthetic_arterial_pressure_data(
     heart_rate: float,
     n_beats_target: float,
     hertz: float,
+    dtype: np.dtype = np.float64,
 ) -> pd.DataFrame:
     """Make synthetic arterial pressure data.
 
@@ -114,6 +115,9 @@ def synthetic_arterial_pressure_data(
             different from the target unless each beat fits exactly within a
             whole number of samples.
         hertz: Sampling rate (hertz)
+        dtype: dtype of the pressure column, e.g. np.float32, or an integer
+            dtype to mimic raw ADC counts (in which case pressures are
+            rounded). Timestamps are always float64.
 
     Returns:
         Synthetic arterial pressure data with corresponding timestamps.
@@ -140,4 +144,8 @@ def synthetic_arterial_pressure_data(
     waveform *= systolic_pressure - diastolic_pressure
     waveform += diastolic_pressure
 
-    return pd.DataFrame({"time": timestamps, "pressure": waveform})
+    if np.issubdtype(dtype, np.integer):
+        waveform = np.rint(waveform)
+    return pd.DataFrame(
+        {"time": timestamps, "pressure": waveform.astype(dtype, copy=False)}
+    )
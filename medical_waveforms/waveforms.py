@@ -1,62 +1,773 @@
-from typing import Dict, Tuple
+from collections import UserDict
+from pathlib import Path
+from typing import Callable, Dict, Mapping, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import pandas as pd
 
+ColumnStore = Union[pd.DataFrame, Mapping[str, np.ndarray], np.ndarray]
+
+# Number of samples of a waveform compared to tell whether it has changed
+FINGERPRINT_SAMPLES = 1024
+
+
+def compute_dtype(dtype: np.dtype) -> np.dtype:
+    """The dtype that features are computed in for waveform samples of
+    `dtype`.
+
+    Floating-point samples keep their own precision, so float32 waveforms give
+    float32 features with half the memory and bandwidth of float64. Integer
+    samples (e.g. raw ADC counts) of up to 16 bits are computed in float32,
+    which holds them exactly, and wider integers in float64.
+
+    With float32 samples, features are within these bounds of the same
+    features computed in float64 from the same samples:
+
+    - `MaximumValue`, `MinimumValue`: exact
+    - `MaximumMinusMinimumValue`: rounded once (0.5 ulp)
+    - `MeanValue`: accumulated in float64, then rounded once (1 ulp)
+    - `MeanNegativeFirstDifference`: each difference rounded once, and the
+      mean of the rounded differences accumulated in float64 (1 ulp plus 0.5
+      ulp of the largest difference)
+    - `Duration`, `CyclesPerMinute` and rolling statistics: float64
+    - `ResampledCycles`: float32, as it always is
+    - `medical_waveforms.features.morphology` features: float64, from
+      float32 `ResampledCycles`
+    - absolute differences of features: the bounds of the two features
+      differenced, plus 0.5 ulp of the difference
+
+    Signal quality checks compare the stored features with their bounds
+    exactly, so a cycle passes a check in float32 unless its feature is
+    within the bounds above of the check's threshold.
+
+    Args:
+        dtype: dtype of the waveform samples
+
+    Returns:
+        A floating-point dtype
+    """
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.floating):
+        return dtype
+    if np.issubdtype(dtype, np.integer) and dtype.itemsize <= 2:
+        return np.dtype(np.float32)
+    return np.dtype(np.float64)
+
+
+class UniformTimeAxis:
+    """Timestamps (seconds) of data sampled at a fixed rate, worked out on
+    demand from sample indices rather than stored.
+
+    Can be indexed like a 1D array of timestamps, e.g. `times[troughs]`.
+    """
+
+    def __init__(self, hertz: float, n_samples: int, start_time: float = 0.0):
+        """
+        Args:
+            hertz: Sampling rate (hertz)
+            n_samples: Number of samples
+            start_time: Timestamp of the first sample (seconds)
+        """
+        assert hertz > 0, "`hertz` must be positive"
+        self.hertz = hertz
+        self.n_samples = n_samples
+        self.start_time = start_time
+
+    def __len__(self) -> int:
+        return self.n_samples
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.n_samples)
+            assert step == 1, "Only contiguous slices are supported"
+            return UniformTimeAxis(
+                self.hertz, max(stop - start, 0), self[start]
+            )
+        index = np.asarray(index)
+        index = np.where(index < 0, index + self.n_samples, index)
+        return self.start_time + index / self.hertz
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        return np.asarray(self[np.arange(self.n_samples)], dtype=dtype)
+
 
 class Waveforms:
     """Holds waveforms for downstream processing."""
 
     def __init__(
-        self, waveforms: pd.DataFrame, time_column_name: str = "time"
+        self,
+        waveforms: ColumnStore,
+        time_column_name: str = "time",
+        hertz: Optional[float] = None,
+        start_time: float = 0.0,
+        dtype: Optional[np.dtype] = None,
     ):
         """
         Args:
             waveforms: Contains a timestamps column (in seconds) and one or more
-                waveform columns (arbitrary units)
+                waveform columns (arbitrary units). Either a pandas DataFrame,
+                a mapping from column name to 1D array (e.g. a dict of
+                `np.memmap`s) or a NumPy structured array (which may also be
+                memory-mapped). Arrays are used as they are, without copying.
             time_column_name: The name of the timestamps column in `waveforms`
+            hertz: If the data are sampled at this fixed rate, `waveforms`
+                needn't contain a timestamps column. Timestamps are instead
+                worked out from the sample indices when needed.
+            start_time: Timestamp of the first sample (seconds), if `hertz` is
+                not None
+            dtype: If not None, the waveform columns (but not the timestamps)
+                are converted to this dtype once, up front, e.g. float32 to
+                halve the memory used by float64 data. Otherwise they keep
+                their own dtype, and features are computed in
+                `compute_dtype` of it.
         """
         self.waveforms = waveforms
         self.time_column_name = time_column_name
+        self.hertz = hertz
+        self.start_time = start_time
+        self.dtype = None if dtype is None else np.dtype(dtype)
         self._validate_arguments()
         self.names = self._init_names()
+        if self.dtype is not None:
+            self.waveforms = self._converted_waveforms()
         self.features = FeaturesContainer(self.names)
+        # Growable buffers holding the columns, once samples are appended
+        self._buffers: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def from_npy(
+        cls,
+        paths: Union[str, Path, Mapping[str, Union[str, Path]]],
+        time_column_name: str = "time",
+        hertz: Optional[float] = None,
+        start_time: float = 0.0,
+        dtype: Optional[np.dtype] = None,
+    ) -> "Waveforms":
+        """Memory-maps waveforms saved as .npy files, so that they are read
+        from disk as they are needed rather than all loaded at once.
+
+        Args:
+            paths: Path to a single .npy file containing a structured array
+                with one field per column, or a mapping from column name to
+                the path of a .npy file containing that column as a 1D array
+            time_column_name: As for `Waveforms`
+            hertz: As for `Waveforms`
+            start_time: As for `Waveforms`
+            dtype: As for `Waveforms`. Converting the columns reads them into
+                memory.
+
+        Returns:
+            Waveforms backed by the memory-mapped files
+        """
+        if isinstance(paths, Mapping):
+            waveforms = {
+                column: np.load(path, mmap_mode="r")
+                for column, path in paths.items()
+            }
+        else:
+            waveforms = np.load(paths, mmap_mode="r")
+        return cls(waveforms, time_column_name, hertz, start_time, dtype)
+
+    @property
+    def columns(self) -> Tuple[str, ...]:
+        """Names of all the columns held in `self.waveforms`."""
+        if isinstance(self.waveforms, np.ndarray):
+            return tuple(self.waveforms.dtype.names)
+        return tuple(self.waveforms.keys())
+
+    @property
+    def n_samples(self) -> int:
+        """The number of samples in each column."""
+        return len(self._stored_column(self.columns[0]))
+
+    @property
+    def times(self) -> Union[np.ndarray, UniformTimeAxis]:
+        """Timestamps (seconds) of each sample. Either the timestamps column,
+        or a `UniformTimeAxis` if `self.hertz` is not None."""
+        if self.hertz is not None:
+            return UniformTimeAxis(self.hertz, self.n_samples, self.start_time)
+        return self._stored_column(self.time_column_name)
+
+    def column(self, name: str) -> np.ndarray:
+        """Gets a column as a NumPy array, without copying it where possible.
+
+        Args:
+            name: Name of the column. The timestamps column is always
+                available, even if `self.hertz` is not None (in which case it
+                is worked out on demand).
+
+        Returns:
+            The column's values. This may be a view of (or a memory-mapped
+                file underlying) `self.waveforms`, so shouldn't be modified.
+        """
+        if name == self.time_column_name:
+            return np.asarray(self.times)
+        return self._stored_column(name)
+
+    def select(self, names: Sequence[str]) -> "Waveforms":
+        """Makes a new `Waveforms` (without any features) holding only some of
+        the waveform columns. Columns are shared, not copied.
+
+        Args:
+            names: Names of the waveform columns to keep
+
+        Returns:
+            `Waveforms` holding `names` and the timestamps
+        """
+        columns = list(names)
+        if self.hertz is None:
+            columns.insert(0, self.time_column_name)
+        return Waveforms(
+            {column: self._stored_column(column) for column in columns},
+            self.time_column_name,
+            self.hertz,
+            self.start_time,
+            self.dtype,
+        )
+
+    def append(self, new_waveforms: ColumnStore):
+        """Appends newly recorded samples, e.g. from a live monitor.
+
+        Existing features are left as they are, so that they can be updated
+        for just the new data with `medical_waveforms.features.waveform.
+        update_troughs` and friends.
+
+        Each column is copied into a buffer with spare capacity the first time
+        samples are appended, and the buffer's capacity is doubled whenever it
+        fills up, so appending takes time proportional to the number of new
+        samples (amortized) rather than to the length of the recording.
+        Afterwards, `self.waveforms` holds views of the buffers, in the same
+        kind of column store (except that a structured array becomes a
+        mapping from column name to array).
+
+        Args:
+            new_waveforms: Contains the same columns as `self.waveforms`, with
+                timestamps following on from those already held
+        """
+        new_waveforms = Waveforms(
+            new_waveforms, self.time_column_name, self.hertz, dtype=self.dtype
+        )
+        assert (
+            new_waveforms.columns == self.columns
+        ), f"`new_waveforms` must have the columns {list(self.columns)}"
+        n_samples = self.n_samples
+        columns = {}
+        for column in self.columns:
+            self._buffers[column] = _extend_buffer(
+                self._buffers.get(column),
+                self._stored_column(column),
+                n_samples,
+                new_waveforms._stored_column(column),
+            )
+            columns[column] = self._buffers[column][
+                : n_samples + new_waveforms.n_samples
+            ]
+        if isinstance(self.waveforms, pd.DataFrame):
+            # Wraps the buffers' views without copying them
+            self.waveforms = pd.DataFrame(columns, copy=False)
+        else:
+            self.waveforms = columns
+
+    def _stored_column(self, name: str) -> np.ndarray:
+        if isinstance(self.waveforms, pd.DataFrame):
+            return self.waveforms[name].to_numpy()
+        column = self.waveforms[name]
+        if isinstance(column, np.ndarray):
+            return column
+        return np.asarray(column)
+
+    def _converted_waveforms(self) -> ColumnStore:
+        """`self.waveforms` with the waveform columns converted to
+        `self.dtype`, in the same kind of column store. Columns that already
+        have that dtype aren't copied."""
+        if isinstance(self.waveforms, pd.DataFrame):
+            return self.waveforms.astype(
+                {name: self.dtype for name in self.names}
+            )
+        if isinstance(self.waveforms, np.ndarray):
+            return self.waveforms.astype(
+                [
+                    (
+                        column,
+                        self.dtype
+                        if column in self.names
+                        else self.waveforms.dtype[column],
+                    )
+                    for column in self.columns
+                ],
+                copy=False,
+            )
+        return {
+            column: (
+                self._stored_column(column).astype(self.dtype, copy=False)
+                if column in self.names
+                else self.waveforms[column]
+            )
+            for column in self.columns
+        }
 
     def _validate_arguments(self):
         assert isinstance(
-            self.waveforms, pd.DataFrame
-        ), "`waveforms` must be a pandas DataFrame"
-        assert self.time_column_name in self.waveforms.columns, (
-            "`waveforms` must contain a column called "
-            f"'{self.time_column_name}'"
+            self.waveforms, (pd.DataFrame, Mapping)
+        ) or _is_structured_array(self.waveforms), (
+            "`waveforms` must be a pandas DataFrame, a mapping of column "
+            "names to arrays or a structured array"
         )
+        if self.hertz is None:
+            assert self.time_column_name in self.columns, (
+                "`waveforms` must contain a column called "
+                f"'{self.time_column_name}'"
+            )
+        else:
+            assert self.time_column_name not in self.columns, (
+                "`waveforms` mustn't contain a timestamps column "
+                f"('{self.time_column_name}') if `hertz` is given"
+            )
+        if isinstance(self.waveforms, Mapping):
+            lengths = {
+                column: self._stored_column(column).shape
+                for column in self.columns
+            }
+            assert len(set(lengths.values())) == 1 and all(
+                len(shape) == 1 for shape in lengths.values()
+            ), f"`waveforms` columns must be 1D and equal length: {lengths}"
 
     def _init_names(self) -> Tuple[str, ...]:
         """Makes a tuple of names of the waveform-containing columns in
         self.waveforms"""
         return tuple(
-            name
-            for name in self.waveforms.columns
-            if name is not self.time_column_name
+            name for name in self.columns if name != self.time_column_name
         )
 
 
+def _is_structured_array(array) -> bool:
+    return isinstance(array, np.ndarray) and array.dtype.names is not None
+
+
 class FeaturesContainer:
-    """Holds features of the waveform data."""
+    """Holds features of the waveform data.
+
+    Acts as a cache for features that have already been derived. Features
+    depend on each other as troughs -> cycles -> diffs, so when the troughs of
+    a waveform change, cycle-level features (and their diffs) are truncated to
+    the cycles whose troughs are unchanged. Likewise when a cycle-level feature
+    changes, its diffs and rolling statistics (see
+    `medical_waveforms.features.rolling`) are truncated to the cycles where
+    it is unchanged.
+
+    Cycle-level features and diffs are also discarded when the waveform they
+    were derived from changes (see `check_column`), e.g. when it is rescaled
+    in place or replaced.
+
+    Features that are extended with `extend` are held as views of buffers
+    with spare capacity, so that they grow in time proportional to the number
+    of new elements. Elements of those views that are beyond the part kept by
+    a later `extend` may be overwritten, so copy a feature that you want to
+    keep as it is.
+    """
 
     def __init__(self, waveform_names: Tuple[str, ...]):
         """
         Args:
             waveform_names: Names of each of the waveform columns
         """
-        self.waveform = self._init_features_container(waveform_names)
-        self.cycles = self._init_features_container(waveform_names)
+        self.waveform = self._init_features_container(
+            waveform_names, self._on_waveform_feature_change
+        )
+        self.cycles = self._init_features_container(
+            waveform_names, self._on_cycles_feature_change
+        )
         self.diffs = self._init_features_container(waveform_names)
+        self._cycle_indices: Dict[str, CycleIndex] = {}
+        # Growable buffers holding extended features, by (level, name, key)
+        self._buffers: Dict[Tuple[str, str, str], np.ndarray] = {}
+        # Length, sampled positions and values at them of each waveform, as
+        #  last seen by `check_column`
+        self._fingerprints: Dict[str, Tuple[int, np.ndarray, np.ndarray]] = {}
+
+    def cycle_index(
+        self, name: str, times: Union[np.ndarray, UniformTimeAxis]
+    ) -> "CycleIndex":
+        """Gets the `CycleIndex` of waveform `name`, building it if its troughs
+        have changed since it was last built.
+
+        Args:
+            name: Name of the waveform
+            times: Timestamps of the waveform, i.e. `Waveforms.times`
+
+        Returns:
+            The cycle index
+        """
+        if name not in self._cycle_indices:
+            self._cycle_indices[name] = CycleIndex(
+                self.waveform[name]["troughs"], times
+            )
+        return self._cycle_indices[name]
+
+    def n_cycles(self, name: str) -> int:
+        """The number of cycles in waveform `name`, or 0 if its troughs haven't
+        been found yet."""
+        troughs = self.waveform[name].get("troughs")
+        if troughs is None:
+            return 0
+        return max(troughs.size - 1, 0)
+
+    def is_current(self, name: str, key: str, level: str = "cycles") -> bool:
+        """Whether feature `key` at `level` ('cycles' or 'diffs') has been
+        derived for every cycle of waveform `name`."""
+        feature = getattr(self, level)[name].get(key)
+        return feature is not None and len(feature) == self.n_cycles(name)
+
+    def extend(
+        self,
+        level: str,
+        name: str,
+        key: str,
+        n_keep: int,
+        new: np.ndarray,
+    ) -> np.ndarray:
+        """Replaces everything after the first `n_keep` elements of a feature
+        with `new`, e.g. to extend it to cover newly found cycles.
+
+        Takes time proportional to the length of `new` and of the replaced
+        elements (amortized), not of the whole feature. Features that depend
+        on this one are truncated as if it had been set, by comparing only
+        the replaced elements.
+
+        Args:
+            level: 'waveform', 'cycles' or 'diffs'
+            name: Name of the waveform
+            key: Name of the feature
+            n_keep: Number of leading elements of the feature to keep
+            new: Elements to follow them
+
+        Returns:
+            The extended feature
+        """
+        new = np.asarray(new)
+        features = getattr(self, level)[name]
+        old = features.get(key)
+        n_keep = 0 if old is None else min(n_keep, len(old))
+        # Compare before writing, as `old` may be a view of the same buffer
+        n_unchanged = (
+            0
+            if old is None
+            else n_keep + _common_prefix_length(old[n_keep:], new)
+        )
+        buffer = _extend_buffer(
+            self._buffers.get((level, name, key)), old, n_keep, new
+        )
+        self._buffers[(level, name, key)] = buffer
+        features.set(key, buffer[: n_keep + len(new)], n_unchanged)
+        return features[key]
+
+    def check_column(self, name: str, column: np.ndarray):
+        """Discards the cycle-level features and diffs of waveform `name` if
+        its values have changed since this was last called, so that they are
+        derived again. Troughs are kept, as they are only found again on
+        request.
+
+        Called by trough finding, feature extraction and everything derived
+        from features (e.g. diffs and rolling statistics). Only
+        `FINGERPRINT_SAMPLES` evenly spaced samples are compared, so that
+        this takes the same time however long the waveform is, and appending
+        samples (see `Waveforms.append`) doesn't count as a change. Changes
+        to the whole waveform (e.g. rescaling it) or replacing it are
+        detected, but call `invalidate` after editing individual samples.
+
+        Args:
+            name: Name of the waveform
+            column: Its current values, i.e. `Waveforms.column(name)`
+        """
+        fingerprint = self._fingerprints.get(name)
+        if fingerprint is not None:
+            n_samples, positions, values = fingerprint
+            if len(column) < n_samples or not np.array_equal(
+                column[positions], values, equal_nan=True
+            ):
+                # Deleting a feature may delete others derived from it
+                self.cycles[name].clear()
+                self.diffs[name].clear()
+                fingerprint = None
+            elif len(column) == n_samples:
+                return
+        positions = np.linspace(
+            0, len(column) - 1, min(FINGERPRINT_SAMPLES, len(column))
+        ).astype(np.intp)
+        self._fingerprints[name] = (
+            len(column),
+            positions,
+            np.array(column[positions]),
+        )
+
+    def invalidate(self, name: str):
+        """Discards all features of waveform `name`, e.g. after its values have
+        been changed."""
+        self.waveform[name].clear()
+        self.cycles[name].clear()
+        self.diffs[name].clear()
+        self._cycle_indices.pop(name, None)
+        self._fingerprints.pop(name, None)
+        for buffer_key in list(self._buffers):
+            if buffer_key[1] == name:
+                del self._buffers[buffer_key]
+
+    def _on_waveform_feature_change(
+        self,
+        name: str,
+        key: str,
+        old: Optional[np.ndarray],
+        new: Optional[np.ndarray],
+        n_unchanged: Optional[int] = None,
+    ):
+        if key != "troughs":
+            return
+        self._cycle_indices.pop(name, None)
+        if n_unchanged is None:
+            n_unchanged = _common_prefix_length(old, new)
+        n_unchanged_cycles = max(n_unchanged - 1, 0)
+        for features in self.cycles[name], self.diffs[name]:
+            for feature_name in list(features.keys()):
+                _truncate(features, feature_name, n_unchanged_cycles)
+
+    def _on_cycles_feature_change(
+        self,
+        name: str,
+        key: str,
+        old: Optional[np.ndarray],
+        new: Optional[np.ndarray],
+        n_unchanged: Optional[int] = None,
+    ):
+        # Rolling statistics of the feature, named as by
+        #  `medical_waveforms.features.rolling.rolling_key`
+        rolling = [
+            dependent
+            for dependent in self.cycles[name]
+            if dependent.startswith(f"{key}_rolling_")
+        ]
+        if key not in self.diffs[name] and not rolling:
+            return
+        if n_unchanged is None:
+            n_unchanged = _common_prefix_length(old, new)
+        if key in self.diffs[name]:
+            _truncate(self.diffs[name], key, n_unchanged)
+        for dependent in rolling:
+            # Trailing windows only depend on earlier cycles
+            _truncate(self.cycles[name], dependent, n_unchanged)
 
     @staticmethod
     def _init_features_container(
-        waveform_names,
+        waveform_names, on_change: Optional[Callable] = None
     ) -> Dict[str, Dict[str, np.ndarray]]:
         """Makes a holder for features (the features themselves haven't been
         derived yet)"""
-        return {name: {} for name in waveform_names}
+        return {name: _Features(name, on_change) for name in waveform_names}
+
+
+class CycleIndex:
+    """Start and end samples and times of each cycle in a waveform, for
+    finding cycles by time or sample in O(log n_cycles) time.
+
+    Cycle `i` runs from sample `starts[i]` to sample `ends[i]` inclusive, and
+    the last sample of one cycle is the first of the next.
+    """
+
+    def __init__(
+        self, troughs: np.ndarray, times: Union[np.ndarray, UniformTimeAxis]
+    ):
+        """
+        Args:
+            troughs: Trough indices, i.e.
+                `FeaturesContainer.waveform[name]['troughs']`
+            times: Timestamps of the waveform, i.e. `Waveforms.times`
+        """
+        self.starts = troughs[:-1]
+        self.ends = troughs[1:]
+        boundary_times = np.asarray(times[troughs], dtype=float)
+        self.start_times = boundary_times[:-1]
+        self.end_times = boundary_times[1:]
+
+    def __len__(self) -> int:
+        return self.starts.size
+
+    def cycle_at_time(self, time: Union[float, np.ndarray]) -> np.ndarray:
+        """Finds the cycle containing each timestamp.
+
+        Args:
+            time: Timestamp(s) (seconds)
+
+        Returns:
+            The number of the cycle containing each timestamp, or -1 for
+                timestamps outside every cycle. A timestamp on the boundary
+                between two cycles is in the later cycle.
+        """
+        return self._containing(self.start_times, self.end_times, time)
+
+    def cycle_at_sample(self, sample: Union[int, np.ndarray]) -> np.ndarray:
+        """As for `cycle_at_time`, but finds the cycle containing each sample
+        index."""
+        return self._containing(self.starts, self.ends, sample)
+
+    def window(self, start_time: float, end_time: float) -> slice:
+        """Finds the cycles that start within a time window.
+
+        Args:
+            start_time: Start of the window (seconds, inclusive)
+            end_time: End of the window (seconds, exclusive)
+
+        Returns:
+            Slice of cycle numbers, for indexing cycle-level features
+        """
+        return slice(
+            int(np.searchsorted(self.start_times, start_time, side="left")),
+            int(np.searchsorted(self.start_times, end_time, side="left")),
+        )
+
+    def select(
+        self,
+        features: Union[Mapping[str, np.ndarray], pd.DataFrame],
+        start_time: float,
+        end_time: float,
+    ) -> Union[Dict[str, np.ndarray], pd.DataFrame]:
+        """Gets cycle-level features for the cycles that start within a time
+        window, as views rather than copies.
+
+        Args:
+            features: Cycle-level features, e.g.
+                `FeaturesContainer.cycles[name]`, `FeaturesContainer.diffs[
+                name]` or the output of `medical_waveforms.quality.
+                check_cycles`
+            start_time: As for `window`
+            end_time: As for `window`
+
+        Returns:
+            `features` for just the cycles in the window
+        """
+        cycles = self.window(start_time, end_time)
+        if isinstance(features, pd.DataFrame):
+            return features.iloc[cycles]
+        return {key: feature[cycles] for key, feature in features.items()}
+
+    @staticmethod
+    def _containing(
+        starts: np.ndarray,
+        ends: np.ndarray,
+        position: Union[float, np.ndarray],
+    ) -> np.ndarray:
+        if starts.size == 0:
+            return np.full(np.shape(position), -1)
+        cycle = np.searchsorted(starts, position, side="right") - 1
+        inside = (cycle >= 0) & (position <= ends[np.maximum(cycle, 0)])
+        return np.where(inside, cycle, -1)
+
+
+class _Features(UserDict):
+    """The features of one waveform. Calls `on_change(name, key, old, new)`
+    whenever a feature is set or deleted."""
+
+    def __init__(self, name: str, on_change: Optional[Callable] = None):
+        self.name = name
+        self._on_change = on_change
+        super().__init__()
+
+    def __setitem__(self, key: str, value: np.ndarray):
+        self.set(key, value)
+
+    def set(
+        self, key: str, value: np.ndarray, n_unchanged: Optional[int] = None
+    ):
+        """Sets a feature, optionally stating how many of its leading elements
+        are unchanged so that they needn't be compared."""
+        old = self.data.get(key)
+        self.data[key] = value
+        if self._on_change is not None:
+            self._on_change(self.name, key, old, value, n_unchanged)
+
+    def __delitem__(self, key: str):
+        old = self.data.pop(key)
+        if self._on_change is not None:
+            self._on_change(self.name, key, old, None, 0)
+
+
+def _common_prefix_length(
+    a: Optional[np.ndarray], b: Optional[np.ndarray]
+) -> int:
+    """The number of leading elements that are the same in `a` and `b`."""
+    if a is None or b is None:
+        return 0
+    n = min(len(a), len(b))
+    if n == 0:
+        return 0
+    if a is b or _is_prefix_of(a[:n], b):
+        # The same elements, e.g. when a feature is truncated
+        return n
+    differs = a[:n] != b[:n]
+    if np.issubdtype(a.dtype, np.floating):
+        differs &= ~(np.isnan(a[:n]) & np.isnan(b[:n]))
+    if differs.ndim > 1:
+        # Compare rows, e.g. of resampled cycles
+        differs = differs.reshape(n, -1).any(axis=1)
+    return int(np.argmax(differs)) if differs.any() else n
+
+
+def _truncate(features: Dict[str, np.ndarray], key: str, n: int):
+    """Keeps only the first `n` elements of `features[key]`, deleting it if it
+    would be empty."""
+    if n == 0:
+        del features[key]
+    elif len(features[key]) > n:
+        features[key] = features[key][:n]
+
+
+def _is_prefix_of(view: np.ndarray, buffer: Optional[np.ndarray]) -> bool:
+    """Whether `view` is the first `len(view)` elements of `buffer`, in the
+    same memory."""
+    return (
+        buffer is not None
+        and view.dtype == buffer.dtype
+        and view.shape[1:] == buffer.shape[1:]
+        and len(view) <= len(buffer)
+        and (len(view) < 2 or view.strides == buffer.strides)
+        and view.__array_interface__["data"][0]
+        == buffer.__array_interface__["data"][0]
+    )
+
+
+def _extend_buffer(
+    buffer: Optional[np.ndarray],
+    old: Optional[np.ndarray],
+    n_keep: int,
+    new: np.ndarray,
+) -> np.ndarray:
+    """Writes `new` after the first `n_keep` elements of `old` in a growable
+    buffer, as `np.concatenate([old[:n_keep], new])` would make them.
+
+    `buffer` is reused if `old` is a view of its start and it has room for
+    `new`. Otherwise a buffer with twice the room needed is made, so that
+    repeatedly extending an array takes amortized time proportional to the
+    number of new elements.
+
+    Returns:
+        The buffer, whose first `n_keep` + len(`new`) elements are the result
+    """
+    new = np.asarray(new)
+    n = n_keep + len(new)
+    if old is None or n_keep == 0:
+        dtype, shape = new.dtype, new.shape[1:]
+    else:
+        dtype = np.result_type(old.dtype, new.dtype)
+        shape = old.shape[1:]
+    if not (
+        old is not None
+        and _is_prefix_of(old, buffer)
+        and buffer.dtype == dtype
+        and buffer.shape[1:] == shape
+        and len(buffer) >= n
+    ):
+        grown = np.empty((max(2 * n, 16),) + shape, dtype=dtype)
+        if n_keep:
+            grown[:n_keep] = old[:n_keep]
+        buffer = grown
+    if len(new):
+        buffer[n_keep:n] = new
+    return buffer
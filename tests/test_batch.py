@@ -0,0 +1,152 @@
+import os
+
+import pandas as pd
+import pytest
+
+from medical_waveforms import batch, synthetic
+from medical_waveforms.features import cycles
+
+
+@pytest.fixture(scope="function")
+def recordings_directory(tmp_path):
+    recordings = tmp_path / "recordings"
+    recordings.mkdir()
+    for i, heart_rate in enumerate([60.0, 75.0]):
+        synthetic.synthetic_arterial_pressure_data(
+            systolic_pressure=120.0,
+            diastolic_pressure=80.0,
+            heart_rate=heart_rate,
+            n_beats_target=10.3,
+            hertz=100.0,
+        ).to_csv(recordings / f"recording_{i}.csv", index=False)
+    (recordings / "corrupt.csv").write_text("not,a\nrecording")
+    return recordings
+
+
+def test_find_recordings_from_manifest(tmp_path, recordings_directory):
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("recordings/recording_1.csv\n\n")
+    assert batch.find_recordings(manifest) == [
+        tmp_path / "recordings" / "recording_1.csv"
+    ]
+
+
+def test_output_paths(tmp_path):
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("ward_a/bed.csv\nward_b/bed.csv\n")
+    recordings = batch.find_recordings(manifest)
+    assert batch.output_paths(recordings, tmp_path / "output", "csv") == [
+        tmp_path / "output" / "ward_a" / "bed.csv",
+        tmp_path / "output" / "ward_b" / "bed.csv",
+    ]
+
+    with pytest.raises(ValueError, match="share"):
+        batch.output_paths(
+            [tmp_path / "bed.csv", tmp_path / "bed.parquet"],
+            tmp_path / "output",
+            "csv",
+        )
+
+
+def test_run_batch(tmp_path, recordings_directory):
+    summary = batch.run_batch(
+        recordings_directory,
+        tmp_path / "output",
+        name="pressure",
+        feature_extractors=[cycles.Duration],
+        scale=25,
+        output_format="csv",
+        max_workers=2,
+    ).set_index("path")
+
+    corrupt = str(recordings_directory / "corrupt.csv")
+    assert summary.status[corrupt] == "failed"
+    assert (summary.drop(index=corrupt).status == "succeeded").all()
+
+    results = pd.read_csv(tmp_path / "output" / "recording_0.csv")
+    assert (
+        len(results)
+        == summary.n_cycles[str(recordings_directory / "recording_0.csv")]
+    )
+    assert results.check_all.all()
+    assert results.Duration.between(0.98, 1.02).all()
+    assert "MinimumValue_diff" in results.columns
+
+
+_process_recording = batch.process_recording
+_retry_tasks = batch._retry_tasks
+
+
+def _process_or_die(path, output_path, **kwargs):
+    if path.stem == "corrupt":
+        os._exit(1)
+    return _process_recording(path, output_path, **kwargs)
+
+
+def test_run_batch_retries_after_worker_dies(
+    tmp_path, recordings_directory, monkeypatch
+):
+    monkeypatch.setattr(batch, "process_recording", _process_or_die)
+    summary = batch.run_batch(
+        recordings_directory,
+        tmp_path / "output",
+        name="pressure",
+        scale=25,
+        output_format="csv",
+        max_workers=2,
+    ).set_index("path")
+
+    corrupt = str(recordings_directory / "corrupt.csv")
+    assert summary.error[corrupt] == "Worker process died"
+    assert (summary.drop(index=corrupt).status == "succeeded").all()
+
+
+def test_run_batch_carries_on_in_parallel_after_worker_dies(
+    tmp_path, recordings_directory, monkeypatch
+):
+    # The crash is early in the batch, with more recordings still queued
+    #  than there are workers
+    recording = (recordings_directory / "recording_0.csv").read_text()
+    for i in range(2, 10):
+        (recordings_directory / f"recording_{i}.csv").write_text(recording)
+    retried = []
+
+    def retry_tasks(tasks, kwargs, summaries):
+        retried.extend(path for path, _ in tasks)
+        _retry_tasks(tasks, kwargs, summaries)
+
+    monkeypatch.setattr(batch, "process_recording", _process_or_die)
+    monkeypatch.setattr(batch, "_retry_tasks", retry_tasks)
+    summary = batch.run_batch(
+        recordings_directory,
+        tmp_path / "output",
+        name="pressure",
+        scale=25,
+        output_format="csv",
+        max_workers=2,
+    ).set_index("path")
+
+    corrupt = recordings_directory / "corrupt.csv"
+    assert len(summary) == 11
+    assert summary.error[str(corrupt)] == "Worker process died"
+    assert (summary.drop(index=str(corrupt)).status == "succeeded").all()
+    # Only the recordings in flight alongside the culprit were retried
+    assert corrupt in retried
+    assert len(retried) <= 2
+
+
+def test_main(tmp_path, recordings_directory):
+    batch.main(
+        [
+            str(recordings_directory),
+            str(tmp_path / "output"),
+            "--name",
+            "pressure",
+            "--format",
+            "csv",
+            "--workers",
+            "1",
+        ]
+    )
+    summary = pd.read_csv(tmp_path / "output" / "summary.csv")
+    assert len(summary) == 3
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+from numpy.testing import assert_equal
+
+from medical_waveforms import channels, quality, synthetic, waveforms
+from medical_waveforms.features import cycles
+
+
+@pytest.fixture(scope="function")
+def multichannel_waveforms() -> waveforms.Waveforms:
+    data = synthetic.synthetic_arterial_pressure_data(
+        systolic_pressure=120.0,
+        diastolic_pressure=80.0,
+        heart_rate=60.0,
+        n_beats_target=10.3,
+        hertz=100.0,
+    )
+    data["cvp"] = data.pressure / 10.0
+    data["pressure_2"] = data.pressure + 20.0
+    return waveforms.Waveforms(data)
+
+
+@pytest.mark.parametrize("use_processes", [False, True])
+def test_process_channels(multichannel_waveforms, use_processes):
+    configs = {
+        "pressure": channels.ChannelConfig(
+            scale=25, checks=quality.ArterialPressureChecks()
+        ),
+        "cvp": channels.ChannelConfig(
+            scale=30, feature_extractors=(cycles.MeanValue,)
+        ),
+    }
+    check_results = channels.process_channels(
+        multichannel_waveforms, configs, use_processes=use_processes
+    )
+    assert set(check_results) == {"pressure", "cvp"}
+    assert check_results["cvp"] is None
+    assert check_results["pressure"]["all"].all()
+
+    # Same as processing each channel in turn
+    for name, config in configs.items():
+        expected, _ = channels.process_channel(
+            waveforms.Waveforms(multichannel_waveforms.waveforms.copy()),
+            name,
+            config,
+        )
+        assert_equal(
+            multichannel_waveforms.features.waveform[name]["troughs"],
+            expected.features.waveform[name]["troughs"],
+        )
+        assert (
+            multichannel_waveforms.features.cycles[name].keys()
+            == expected.features.cycles[name].keys()
+        )
+    assert multichannel_waveforms.features.waveform["pressure_2"] == {}
+
+
+def test_process_channels_single_config(multichannel_waveforms):
+    check_results = channels.process_channels(
+        multichannel_waveforms,
+        channels.ChannelConfig(scale=25),
+        names=["pressure", "pressure_2"],
+    )
+    assert list(check_results) == ["pressure", "pressure_2"]
+    assert_equal(
+        multichannel_waveforms.features.waveform["pressure"]["troughs"],
+        multichannel_waveforms.features.waveform["pressure_2"]["troughs"],
+    )
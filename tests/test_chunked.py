@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from medical_waveforms import batch, channels, chunked, quality, synthetic
+from medical_waveforms.features import morphology, waveform
+from medical_waveforms.waveforms import Waveforms
+
+
+@pytest.fixture(scope="function")
+def data() -> pd.DataFrame:
+    data = synthetic.synthetic_arterial_pressure_data(
+        systolic_pressure=120.0,
+        diastolic_pressure=80.0,
+        heart_rate=75.0,
+        n_beats_target=100.3,
+        hertz=100.0,
+    )
+    data["pressure"] += np.random.default_rng(0).normal(size=len(data))
+    # Flatten part of the signal so that some cycles fail their checks
+    data.loc[3000:3500, "pressure"] = 40.0
+    return data
+
+
+def expected_cycles(
+    data: pd.DataFrame, config: channels.ChannelConfig
+) -> pd.DataFrame:
+    waveforms, checked = channels.process_channel(
+        Waveforms(data.copy()), "pressure", config
+    )
+    return batch.cycles_table(waveforms, "pressure", checked)
+
+
+def blocks(data: pd.DataFrame, block_size: int):
+    for block_start in range(0, len(data), block_size):
+        yield data.iloc[block_start : block_start + block_size]
+
+
+@pytest.mark.parametrize("block_size", [97, 1200, 20000])
+@pytest.mark.parametrize("detector", [None, waveform.UpstrokeTroughDetector()])
+def test_process_in_chunks_matches_in_memory(data, block_size, detector):
+    config = channels.ChannelConfig(
+        chunk_size=1500,
+        detector=detector,
+        checks=quality.ArterialPressureChecks(),
+    )
+    cycles_tables = list(
+        chunked.process_in_chunks(
+            blocks(data, block_size),
+            "pressure",
+            config,
+            chunk_size=config.chunk_size,
+        )
+    )
+    assert len(cycles_tables) > 1
+    actual = pd.concat(cycles_tables)
+    expected = expected_cycles(data, config)
+    assert not expected["check_all"].all()
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2, 3])
+@pytest.mark.parametrize("detector", [None, waveform.UpstrokeTroughDetector()])
+def test_find_troughs_matches_chunked_find_troughs(seed, detector):
+    # Non-periodic data, so that troughs depend on exactly which samples
+    #  each window sees
+    data = pd.DataFrame(
+        {
+            "time": np.arange(20000) / 100.0,
+            "pressure": np.cumsum(
+                np.random.default_rng(seed).normal(size=20000)
+            ),
+        }
+    )
+    config = channels.ChannelConfig(chunk_size=1500, detector=detector)
+    actual = pd.concat(
+        chunked.process_in_chunks(
+            blocks(data, 2300),
+            "pressure",
+            config,
+            chunk_size=config.chunk_size,
+        )
+    )
+    expected = waveform.find_troughs(
+        Waveforms(data.copy()),
+        "pressure",
+        chunk_size=config.chunk_size,
+        detector=detector,
+    ).features.waveform["pressure"]["troughs"]
+    np.testing.assert_equal(
+        np.append(actual["start_index"], actual["end_index"].iloc[-1]),
+        expected,
+    )
+
+
+def test_process_in_chunks_with_history_dependent_features(data):
+    config = channels.ChannelConfig(
+        chunk_size=1500,
+        feature_extractors=(morphology.TemplateCorrelation,),
+        checks=quality.ArterialPressureChecks(
+            mean_pressure_baseline=quality.BaselineCheck(
+                feature=morphology.AreaUnderCurve, window=10
+            )
+        ),
+    )
+    actual = pd.concat(
+        chunked.process_in_chunks(
+            blocks(data, 1000),
+            "pressure",
+            config,
+            chunk_size=config.chunk_size,
+            context_cycles=60,
+        )
+    )
+    expected = expected_cycles(data, config)
+    pd.testing.assert_frame_equal(actual, expected[actual.columns])
+
+
+def test_process_in_chunks_fits_in_one_chunk(data):
+    config = channels.ChannelConfig(checks=quality.ArterialPressureChecks())
+    actual = pd.concat(
+        chunked.process_in_chunks(
+            blocks(data, 1000), "pressure", config, chunk_size=len(data)
+        )
+    )
+    pd.testing.assert_frame_equal(actual, expected_cycles(data, config))
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".parquet", ".npy"])
+def test_read_blocks(tmp_path, data, suffix):
+    path = tmp_path / f"recording{suffix}"
+    if suffix == ".csv":
+        data.to_csv(path, index=False)
+    elif suffix == ".parquet":
+        pytest.importorskip("pyarrow")
+        data.to_parquet(path, index=False)
+    else:
+        np.save(path, data.to_records(index=False))
+    read = list(chunked.read_blocks(path, 3000))
+    assert [len(block) for block in read] == [3000, 3000, 2025]
+    pd.testing.assert_frame_equal(
+        pd.concat(read, ignore_index=True), data, check_dtype=False
+    )
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+import pytest
+from numpy.testing import assert_equal
+
+from medical_waveforms import cohort, quality, synthetic, waveforms
+from medical_waveforms.features import cycles, morphology, waveform
+
+
+@pytest.fixture(scope="function")
+def records() -> dict:
+    records = {}
+    for i, heart_rate in enumerate([60.0, 75.0, 90.0, 110.0]):
+        data = synthetic.synthetic_arterial_pressure_data(
+            systolic_pressure=120.0 + 5 * i,
+            diastolic_pressure=80.0,
+            heart_rate=heart_rate,
+            n_beats_target=40.3 + 5 * i,
+            hertz=100.0,
+        )
+        data["pressure"] += np.random.default_rng(i).normal(size=len(data))
+        records[f"bed-{i}"] = data
+    return records
+
+
+@pytest.fixture(scope="function")
+def checks() -> quality.ArterialPressureChecks:
+    return quality.ArterialPressureChecks(
+        template=quality.TemplateCheck(),
+        baseline=quality.BaselineCheck(feature=cycles.MeanValue, window=5),
+    )
+
+
+def test_check_cycles_matches_each_record(records, checks):
+    c = cohort.Cohort(records).find_troughs("pressure")
+    checked = c.check_cycles("pressure", checks)
+    assert checked.index.names == ["record", "cycle"]
+    assert len(checked) == c.n_cycles("pressure")
+    assert not checked["all"].all()
+
+    split = c.split("pressure", checked)
+    for record_id, data in records.items():
+        wf = waveform.find_troughs(waveforms.Waveforms(data), "pressure")
+        assert_equal(
+            c.record(record_id).features.waveform["pressure"]["troughs"],
+            wf.features.waveform["pressure"]["troughs"],
+        )
+        expected = quality.check_cycles(wf, "pressure", checks)
+        pd.testing.assert_frame_equal(split[record_id], expected)
+        pd.testing.assert_frame_equal(
+            checked.loc[record_id],
+            expected,
+            check_index_type=False,
+            check_names=False,
+        )
+        for key, feature in c.cycles["pressure"].items():
+            np.testing.assert_allclose(
+                c.split("pressure", feature)[record_id],
+                wf.features.cycles["pressure"][key],
+                err_msg=key,
+            )
+
+
+@pytest.mark.parametrize(
+    "feature_extractor",
+    [
+        cycles.MaximumValue,
+        cycles.MeanNegativeFirstDifference,
+        cycles.CyclesPerMinute,
+        morphology.ResampledCycles,
+        morphology.DicroticNotchTime,
+        morphology.TemplateCorrelation,
+    ],
+)
+def test_extract_feature(records, feature_extractor):
+    c = cohort.Cohort(
+        {
+            record_id: data.drop(columns="time")
+            for record_id, data in records.items()
+        },
+        hertz=100.0,
+    ).find_troughs("pressure")
+    feature = c.extract_feature("pressure", feature_extractor)
+    for record_id in records:
+        wf = c.record(record_id)
+        wf.features.cycles["pressure"].clear()
+        wf = feature_extractor().extract_feature(wf, "pressure")
+        np.testing.assert_allclose(
+            c.split("pressure", feature)[record_id],
+            wf.features.cycles["pressure"][feature_extractor().class_name],
+        )
+
+
+def test_cycles_never_span_records(records):
+    c = cohort.Cohort(list(records.values())).find_troughs("pressure")
+    starts, ends = c.cycle_bounds("pressure")
+    assert starts.size == c.n_cycles("pressure")
+    records_of_starts = np.searchsorted(c.offsets, starts, side="right")
+    records_of_ends = np.searchsorted(c.offsets, ends, side="right")
+    assert_equal(records_of_starts, records_of_ends)
+    assert c.record_ids == (0, 1, 2, 3)
+
+    diffs = c.calculate_absolute_diffs("pressure", cycles.Duration)
+    assert_equal(diffs[c.cycle_offsets("pressure")[:-1]], 0.0)
+
+
+def test_records_without_cycles(records, checks):
+    records["flat"] = records["bed-0"].assign(pressure=80.0)
+    c = cohort.Cohort(records, dtype=np.float32).find_troughs("pressure")
+    assert c.buffers["pressure"].dtype == np.float32
+    checked = c.check_cycles("pressure", checks)
+    assert len(c.split("pressure", checked)["flat"]) == 0
+    assert c.cycles["pressure"]["MeanValue"].dtype == np.float32
+
+
+def test_validate_columns(records):
+    records["other"] = records["bed-0"].rename(columns={"pressure": "ppg"})
+    with pytest.raises(AssertionError):
+        cohort.Cohort(records)
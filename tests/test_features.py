@@ -1,10 +1,21 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import pandas as pd
 import pytest
 from numpy.testing import assert_allclose, assert_equal
+from pyampd import ampd as pyampd
 
 from medical_waveforms import synthetic, waveforms
-from medical_waveforms.features import cycles, diffs, waveform
+from medical_waveforms.features import (
+    ampd,
+    cycles,
+    diffs,
+    morphology,
+    rolling,
+    segments,
+    waveform,
+)
 
 
 @pytest.fixture(scope="function")
@@ -32,8 +43,166 @@ def test_find_troughs(abp_waveforms_fixture):
     )
 
 
+def test_find_troughs_chunked():
+    data = synthetic.synthetic_arterial_pressure_data(
+        systolic_pressure=120.0,
+        diastolic_pressure=80.0,
+        heart_rate=75.0,
+        n_beats_target=40.3,
+        hertz=100.0,
+    )
+    expected = waveform.find_troughs(
+        waveforms.Waveforms(data.copy()), name="pressure", scale=20
+    ).features.waveform["pressure"]["troughs"]
+    chunked = waveform.find_troughs(
+        waveforms.Waveforms(data.copy()),
+        name="pressure",
+        scale=20,
+        chunk_size=500,
+    ).features.waveform["pressure"]["troughs"]
+    assert expected.size == 41
+    assert_equal(chunked, expected)
+
+
+class TestAMPD:
+    @pytest.fixture
+    def x(self) -> np.ndarray:
+        return synthetic.synthetic_arterial_pressure_data(
+            systolic_pressure=120.0,
+            diastolic_pressure=80.0,
+            heart_rate=75.0,
+            n_beats_target=40.3,
+            hertz=100.0,
+        ).pressure.values
+
+    @pytest.mark.parametrize("scale", [5, 50, 2000])
+    @pytest.mark.parametrize("max_bytes", [None, 10**5])
+    def test_matches_pyampd(self, x, scale, max_bytes):
+        assert_equal(
+            ampd.find_troughs(x, scale, max_bytes),
+            pyampd.find_peaks(-x, scale),
+        )
+
+    def test_estimate_scale(self, x):
+        # 80 timesteps per cycle
+        assert ampd.estimate_scale(x) == 81
+        assert_equal(ampd.find_troughs(x), pyampd.find_peaks(-x))
+
+    def test_max_bytes_too_small(self, x):
+        with pytest.raises(ValueError):
+            ampd.find_troughs(x, scale=50, max_bytes=100)
+
+
+def test_find_troughs_in_shared_read_only_data(tmp_path, abp_data_fixture):
+    for column in abp_data_fixture.columns:
+        np.save(tmp_path / f"{column}.npy", abp_data_fixture[column].values)
+    paths = {
+        column: tmp_path / f"{column}.npy"
+        for column in abp_data_fixture.columns
+    }
+    shared = waveforms.Waveforms.from_npy(paths).column("pressure")
+    assert not shared.flags.writeable
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(
+            executor.map(
+                lambda detector: detector.detect(shared, 10.0),
+                [waveform.AMPDTroughDetector()] * 4
+                + [waveform.UpstrokeTroughDetector()] * 4,
+            )
+        )
+    for troughs in results:
+        assert_equal(troughs, np.array([0, 10, 20]))
+    assert_equal(shared, abp_data_fixture.pressure.values)
+
+
+class TestUpstrokeTroughDetector:
+    def test_find_troughs(self, abp_data_fixture):
+        w = waveform.find_troughs(
+            waveforms.Waveforms(abp_data_fixture),
+            name="pressure",
+            detector=waveform.UpstrokeTroughDetector(),
+        )
+        assert_equal(
+            w.features.waveform["pressure"]["troughs"], np.array([0, 10, 20])
+        )
+
+    @pytest.mark.parametrize("heart_rate", [45.0, 75.0, 150.0])
+    def test_agrees_with_ampd(self, heart_rate):
+        data = synthetic.synthetic_arterial_pressure_data(
+            systolic_pressure=120.0,
+            diastolic_pressure=80.0,
+            heart_rate=heart_rate,
+            n_beats_target=30.3,
+            hertz=100.0,
+        )
+        w = waveforms.Waveforms(data)
+        expected = waveform.find_troughs(
+            w, name="pressure", scale=100
+        ).features.waveform["pressure"]["troughs"]
+        chunked = waveform.find_troughs(
+            w,
+            name="pressure",
+            chunk_size=500,
+            detector=waveform.UpstrokeTroughDetector(),
+        ).features.waveform["pressure"]["troughs"]
+        assert_equal(chunked, expected)
+
+    @pytest.mark.parametrize(
+        "hertz, noise",
+        [(100.0, 1.0), (125.0, 1.0), (250.0, 0.5), (250.0, 1.0)],
+    )
+    def test_agrees_with_ampd_in_noise(self, hertz, noise):
+        data = synthetic.synthetic_arterial_pressure_data(
+            systolic_pressure=120.0,
+            diastolic_pressure=80.0,
+            heart_rate=75.0,
+            n_beats_target=200.3,
+            hertz=hertz,
+        )
+        expected = waveform.AMPDTroughDetector(scale=int(hertz)).detect(
+            data["pressure"].to_numpy(), hertz
+        )
+        data["pressure"] += np.random.default_rng(0).normal(
+            scale=noise, size=len(data)
+        )
+        troughs = waveform.UpstrokeTroughDetector().detect(
+            data["pressure"].to_numpy(), hertz
+        )
+        assert abs(troughs.size - expected.size) <= 1
+        # Noise shifts the lowest sample around the flat bottom of each trough
+        nearest = expected[
+            np.abs(expected[:, None] - troughs[None, :]).argmin(axis=0)
+        ]
+        assert np.mean(np.abs(nearest - troughs) <= 0.05 * hertz) > 0.85
+
+    def test_scale_and_detector_are_exclusive(self, abp_data_fixture):
+        with pytest.raises(AssertionError):
+            waveform.find_troughs(
+                waveforms.Waveforms(abp_data_fixture),
+                name="pressure",
+                scale=5,
+                detector=waveform.UpstrokeTroughDetector(),
+            )
+
+
+def test_features_follow_in_place_changes(abp_waveforms_fixture):
+    wf = cycles.MaximumValue().extract_feature(
+        abp_waveforms_fixture, "pressure"
+    )
+    maximum = wf.features.cycles["pressure"]["MaximumValue"].copy()
+    wf.waveforms["pressure"] *= 10
+    wf = waveform.find_troughs(wf, "pressure")
+    wf = cycles.MaximumValue().ensure_feature(wf, "pressure")
+    assert_allclose(
+        wf.features.cycles["pressure"]["MaximumValue"], maximum * 10
+    )
+
+
 def test_get_cycles(abp_waveforms_fixture):
-    expected = cycles.get_cycles(abp_waveforms_fixture, "pressure")
+    expected = cycles.get_cycles(
+        abp_waveforms_fixture, "pressure", as_dataframes=True
+    )
     assert len(expected) == 2
     assert_equal(
         expected[0].pressure.values,
@@ -45,6 +214,285 @@ def test_get_cycles(abp_waveforms_fixture):
     )
 
 
+class TestCycleViews:
+    def test_views(self, abp_waveforms_fixture):
+        views = cycles.get_cycles(abp_waveforms_fixture, "pressure")
+        pressure = abp_waveforms_fixture.column("pressure")
+        assert len(views) == 2
+        for cycle, expected in zip(
+            views, cycles.get_cycles(abp_waveforms_fixture, "pressure", True)
+        ):
+            assert_equal(cycle.times, expected.time.values)
+            assert_equal(cycle.values, expected.pressure.values)
+            assert np.shares_memory(cycle.values, pressure)
+        assert_equal(views[-1].values, pressure[10:21])
+        assert len(views[1:]) == 1
+        with pytest.raises(IndexError):
+            views[2]
+
+    def test_batches(self, abp_waveforms_fixture):
+        views = cycles.get_cycles(abp_waveforms_fixture, "pressure")
+        batches = list(views.batches(1))
+        assert len(batches) == 2
+        values, times, starts, ends = batches[1]
+        assert_equal(values, abp_waveforms_fixture.column("pressure")[10:21])
+        assert_equal(starts, np.array([0]))
+        assert_equal(ends, np.array([10]))
+
+    def test_per_cycle_feature_extractor(self, abp_waveforms_fixture):
+        class Range(cycles.PerCycleFeatureExtractor):
+            def compute_cycle(self, cycle):
+                return np.ptp(cycle.values)
+
+        wf = Range().extract_feature(abp_waveforms_fixture, "pressure")
+        wf = cycles.MaximumMinusMinimumValue().extract_feature(wf, "pressure")
+        assert_equal(
+            wf.features.cycles["pressure"]["Range"],
+            wf.features.cycles["pressure"]["MaximumMinusMinimumValue"],
+        )
+
+        float32 = waveforms.Waveforms(
+            abp_waveforms_fixture.waveforms, dtype=np.float32
+        )
+        float32.features.waveform["pressure"].update(
+            abp_waveforms_fixture.features.waveform["pressure"]
+        )
+        range_ = Range().extract_feature(float32, "pressure")
+        assert range_.features.cycles["pressure"]["Range"].dtype == np.float64
+
+        class Float32Range(Range):
+            dtype = None
+
+        range_ = Float32Range().extract_feature(float32, "pressure")
+        assert (
+            range_.features.cycles["pressure"]["Float32Range"].dtype
+            == np.float32
+        )
+
+
+class TestSegments:
+    def test_cycle_bounds(self):
+        starts, ends = segments.cycle_bounds(np.array([0, 10, 20]))
+        assert_equal(starts, np.array([0, 10]))
+        assert_equal(ends, np.array([10, 20]))
+
+    def test_segment_reduce_includes_shared_troughs(self):
+        values = np.array([5.0, 1.0, 2.0, 9.0, 3.0])
+        starts, ends = np.array([0, 3]), np.array([3, 4])
+        assert_equal(
+            segments.segment_reduce(np.add, values, starts, ends),
+            np.array([17.0, 12.0]),
+        )
+        assert_equal(
+            segments.segment_reduce(
+                np.add, values, starts, ends, include_end=False
+            ),
+            np.array([8.0, 9.0]),
+        )
+
+    def test_segment_mean_ignores_nans(self):
+        values = np.array([1.0, np.nan, 3.0, np.nan, np.nan])
+        assert_equal(
+            segments.segment_mean(values, np.array([0, 2]), np.array([2, 4])),
+            np.array([2.0, 3.0]),
+        )
+
+    def test_segment_resample(self):
+        values = np.array([0.0, 2.0, 4.0, 1.0, 1.0, 3.0])
+        resampled = segments.segment_resample(
+            values, np.array([0, 2]), np.array([2, 5]), length=4
+        )
+        assert resampled.dtype == np.float32
+        assert_allclose(
+            resampled,
+            np.array([[0.0, 4 / 3, 8 / 3, 4.0], [4.0, 1.0, 1.0, 3.0]]),
+            rtol=1e-6,
+        )
+
+    def test_matches_per_cycle_extraction(self, abp_waveforms_fixture):
+        wf = cycles.MeanValue().extract_feature(
+            abp_waveforms_fixture, "pressure"
+        )
+        assert_allclose(
+            wf.features.cycles["pressure"]["MeanValue"],
+            np.array(
+                [
+                    cycle.values.mean()
+                    for cycle in cycles.get_cycles(wf, "pressure")
+                ]
+            ),
+        )
+
+
+class TestMorphology:
+    @pytest.fixture(scope="function")
+    def wf(self) -> waveforms.Waveforms:
+        wf = waveforms.Waveforms(
+            synthetic.synthetic_arterial_pressure_data(
+                systolic_pressure=120.0,
+                diastolic_pressure=80.0,
+                heart_rate=60.0,
+                n_beats_target=3.3,
+                hertz=100.0,
+            )
+        )
+        return waveform.find_troughs(wf, name="pressure")
+
+    def test_resampled_cycles(self, wf):
+        wf = morphology.ResampledCycles().extract_feature(wf, "pressure")
+        resampled = wf.features.cycles["pressure"]["ResampledCycles"]
+        assert resampled.shape == (3, 100)
+        troughs = wf.features.waveform["pressure"]["troughs"]
+        assert_allclose(
+            resampled[:, [0, -1]],
+            wf.column("pressure")[np.stack([troughs[:-1], troughs[1:]], 1)],
+            rtol=1e-6,
+        )
+
+    @pytest.mark.parametrize(
+        "feature_extractor,expected",
+        [
+            (morphology.TimeToPeak, 0.13),
+            (morphology.AreaUnderCurve, 12.63),
+            (morphology.MaximumUpstrokeSlope, 506.6),
+            (morphology.DicroticNotchTime, 0.34),
+        ],
+    )
+    def test_extract_feature(self, wf, feature_extractor, expected):
+        wf = feature_extractor().extract_feature(wf, "pressure")
+        assert_allclose(
+            wf.features.cycles["pressure"][feature_extractor.__name__][0],
+            expected,
+            rtol=1e-3,
+        )
+
+    def test_extend_feature(self, wf):
+        expected = morphology.AreaUnderCurve().extract_feature(wf, "pressure")
+        expected = expected.features.cycles["pressure"]["AreaUnderCurve"]
+        troughs = wf.features.waveform["pressure"]["troughs"]
+        wf.features.waveform["pressure"]["troughs"] = troughs[:2]
+        assert len(wf.features.cycles["pressure"]["ResampledCycles"]) == 1
+        wf.features.waveform["pressure"]["troughs"] = troughs
+        wf = morphology.AreaUnderCurve().ensure_feature(wf, "pressure")
+        assert_equal(
+            wf.features.cycles["pressure"]["AreaUnderCurve"], expected
+        )
+
+
+class TestTemplateCorrelation:
+    @pytest.fixture(scope="function")
+    def wf(self) -> waveforms.Waveforms:
+        data = synthetic.synthetic_arterial_pressure_data(
+            systolic_pressure=120.0,
+            diastolic_pressure=80.0,
+            heart_rate=75.0,
+            n_beats_target=80.3,
+            hertz=100.0,
+        )
+        # Damp the 50th beat
+        data.loc[3920:4000, "pressure"] = 90.0
+        wf = waveforms.Waveforms(data)
+        return waveform.find_troughs(wf, name="pressure")
+
+    def test_extract_feature(self, wf):
+        wf = morphology.TemplateCorrelation().extract_feature(wf, "pressure")
+        correlations = wf.features.cycles["pressure"]["TemplateCorrelation"]
+        assert correlations.size == 80
+        assert (np.delete(correlations, 49) > 0.95).all()
+        assert correlations[49] < 0.5
+
+    @pytest.mark.parametrize("hertz", [100.0, 125.0, 250.0])
+    @pytest.mark.parametrize(
+        "detector", [None, waveform.UpstrokeTroughDetector()]
+    )
+    def test_noise(self, hertz, detector):
+        data = synthetic.synthetic_arterial_pressure_data(
+            systolic_pressure=120.0,
+            diastolic_pressure=80.0,
+            heart_rate=75.0,
+            n_beats_target=300.3,
+            hertz=hertz,
+        )
+        # Damp the 150th beat
+        data.loc[int(119.2 * hertz) : int(120.0 * hertz), "pressure"] = 90.0
+        data["pressure"] += np.random.default_rng(0).normal(size=len(data))
+        wf = waveform.find_troughs(
+            waveforms.Waveforms(data), name="pressure", detector=detector
+        )
+        wf = morphology.TemplateCorrelation().extract_feature(wf, "pressure")
+        correlations = wf.features.cycles["pressure"]["TemplateCorrelation"]
+        # Troughs found a few timesteps early or late don't fail normal beats
+        assert np.mean(correlations < 0.9) < 0.03
+        damped = wf.features.cycle_index("pressure", wf.times).cycle_at_time(
+            119.6
+        )
+        assert correlations[damped] < 0.9
+
+    @pytest.mark.parametrize("first_cycle", [1, 29, 30, 45, 79])
+    def test_extend_feature(self, wf, first_cycle):
+        expected = morphology.TemplateCorrelation().extract_feature(
+            wf, "pressure"
+        )
+        expected = expected.features.cycles["pressure"]["TemplateCorrelation"]
+        troughs = wf.features.waveform["pressure"]["troughs"]
+        wf.features.waveform["pressure"]["troughs"] = troughs[
+            : first_cycle + 1
+        ]
+        wf.features.waveform["pressure"]["troughs"] = troughs
+        wf = morphology.TemplateCorrelation().ensure_feature(wf, "pressure")
+        assert_equal(
+            wf.features.cycles["pressure"]["TemplateCorrelation"], expected
+        )
+
+
+def test_features_from_memory_mapped_waveforms(
+    tmp_path, abp_data_fixture, abp_waveforms_fixture
+):
+    for column in abp_data_fixture.columns:
+        np.save(tmp_path / f"{column}.npy", abp_data_fixture[column].values)
+    wf = waveforms.Waveforms.from_npy(
+        {column: tmp_path / f"{column}.npy" for column in ("time", "pressure")}
+    )
+    wf = waveform.find_troughs(wf, name="pressure")
+    assert_equal(
+        wf.features.waveform["pressure"]["troughs"],
+        abp_waveforms_fixture.features.waveform["pressure"]["troughs"],
+    )
+    assert_equal(
+        cycles.get_cycles(wf, "pressure")[1].values,
+        abp_data_fixture.pressure.values[10:21],
+    )
+    for feature_extractor in (cycles.MeanValue, cycles.CyclesPerMinute):
+        wf = feature_extractor().extract_feature(wf, "pressure")
+        expected = feature_extractor()
+        expected.extract_feature(abp_waveforms_fixture, "pressure")
+        assert_equal(
+            wf.features.cycles["pressure"][expected.class_name],
+            abp_waveforms_fixture.features.cycles["pressure"][
+                expected.class_name
+            ],
+        )
+
+
+def test_features_with_uniform_time_axis(
+    abp_data_fixture, abp_waveforms_fixture
+):
+    wf = waveforms.Waveforms(abp_data_fixture.drop(columns="time"), hertz=10.0)
+    wf = waveform.find_troughs(wf, name="pressure")
+    assert_allclose(
+        cycles.get_cycles(wf, "pressure")[1].times,
+        abp_data_fixture.time.values[10:21],
+    )
+    for feature_extractor in (cycles.Duration, cycles.CyclesPerMinute):
+        fe = feature_extractor()
+        wf = fe.extract_feature(wf, "pressure")
+        fe.extract_feature(abp_waveforms_fixture, "pressure")
+        assert_allclose(
+            wf.features.cycles["pressure"][fe.class_name],
+            abp_waveforms_fixture.features.cycles["pressure"][fe.class_name],
+        )
+
+
 class TestDuration:
     def test_extract_feature(self, abp_waveforms_fixture):
         wf = cycles.Duration().extract_feature(
@@ -138,3 +586,228 @@ def test_calculate_diffs(abp_waveforms_fixture):
     assert_equal(
         wf.features.diffs["pressure"]["Duration"], np.array([0.0, 0.0])
     )
+
+
+@pytest.fixture(scope="function")
+def int16_abp_data_fixture() -> pd.DataFrame:
+    data = synthetic.synthetic_arterial_pressure_data(
+        systolic_pressure=120.0,
+        diastolic_pressure=80.0,
+        heart_rate=75.0,
+        n_beats_target=20.3,
+        hertz=100.0,
+        dtype=np.int16,
+    )
+    assert data["pressure"].dtype == np.int16
+    data["pressure"] += np.random.default_rng(0).integers(
+        -2, 3, len(data), dtype=np.int16
+    )
+    return data
+
+
+class TestFloat32:
+    def _features(
+        self, data: pd.DataFrame, detector: waveform.TroughDetector
+    ) -> waveforms.Waveforms:
+        wf = waveform.find_troughs(
+            waveforms.Waveforms(data), "pressure", detector=detector
+        )
+        for feature_extractor in (
+            cycles.MaximumValue,
+            cycles.MinimumValue,
+            cycles.MaximumMinusMinimumValue,
+            cycles.MeanValue,
+            cycles.MeanNegativeFirstDifference,
+            cycles.Duration,
+        ):
+            wf = diffs.calculate_absolute_diffs(
+                wf, "pressure", feature_extractor
+            )
+        return wf
+
+    @pytest.mark.parametrize(
+        "detector",
+        [
+            waveform.AMPDTroughDetector(),
+            waveform.UpstrokeTroughDetector(),
+        ],
+    )
+    @pytest.mark.parametrize("dtype", [np.int16, np.float32])
+    def test_matches_float64(self, int16_abp_data_fixture, detector, dtype):
+        expected = self._features(
+            int16_abp_data_fixture.astype({"pressure": float}), detector
+        )
+        wf = self._features(
+            int16_abp_data_fixture.astype({"pressure": dtype}), detector
+        )
+        assert_equal(
+            wf.features.waveform["pressure"]["troughs"],
+            expected.features.waveform["pressure"]["troughs"],
+        )
+        assert wf.features.n_cycles("pressure") == 20
+        for level in "cycles", "diffs":
+            for key, feature in getattr(wf.features, level)[
+                "pressure"
+            ].items():
+                assert feature.dtype == (
+                    np.float64 if key == "Duration" else np.float32
+                ), key
+                # Within 1 ulp of the features (see `compute_dtype`)
+                eps = np.finfo(feature.dtype).eps
+                # Over finite values, as e.g. MeanNegativeFirstDifference
+                #  is -inf for cycles with no falling samples
+                values = wf.features.cycles["pressure"][key]
+                scale = np.abs(values[np.isfinite(values)]).max()
+                assert_allclose(
+                    feature,
+                    getattr(expected.features, level)["pressure"][key],
+                    rtol=eps,
+                    atol=2 * eps * scale if level == "diffs" else 0,
+                )
+
+    def test_waveforms_dtype(self, int16_abp_data_fixture):
+        wf = self._features(
+            waveforms.Waveforms(
+                int16_abp_data_fixture, dtype=np.float32
+            ).waveforms,
+            waveform.UpstrokeTroughDetector(),
+        )
+        assert wf.column("pressure").dtype == np.float32
+        assert wf.features.cycles["pressure"]["MeanValue"].dtype == np.float32
+
+    def test_extend_keeps_dtype(self, int16_abp_data_fixture):
+        wf = self._features(
+            int16_abp_data_fixture.astype({"pressure": np.float32}),
+            waveform.UpstrokeTroughDetector(),
+        )
+        troughs = wf.features.waveform["pressure"]["troughs"]
+        wf.features.waveform["pressure"]["troughs"] = troughs[:1]
+        wf.features.waveform["pressure"]["troughs"] = troughs
+        wf = diffs.calculate_absolute_diffs(wf, "pressure", cycles.MeanValue)
+        assert wf.features.cycles["pressure"]["MeanValue"].dtype == np.float32
+        assert wf.features.diffs["pressure"]["MeanValue"].dtype == np.float32
+
+
+class TestRolling:
+    @pytest.fixture(scope="function")
+    def values(self) -> np.ndarray:
+        return np.random.default_rng(0).normal(size=500)
+
+    @pytest.mark.parametrize("statistic", ["median", "mean", "std"])
+    def test_rolling(self, values, statistic):
+        expected = [
+            getattr(pd.Series(values[max(i - 49, 0) : i + 1]), statistic)()
+            for i in range(values.size)
+        ]
+        assert_allclose(
+            rolling.rolling(values, statistic, window=50), expected
+        )
+
+    def test_rolling_mad(self, values):
+        def mad(window: np.ndarray) -> float:
+            return np.median(np.abs(window - np.median(window)))
+
+        expected = [mad(values[max(i - 49, 0) : i + 1]) for i in range(500)]
+        assert_allclose(rolling.rolling(values, "mad", window=50), expected)
+
+        times = np.cumsum(np.random.default_rng(1).uniform(0.2, 1.0, 500))
+        expected = [
+            mad(values[(times > t - 10.0) & (times <= t)]) for t in times
+        ]
+        assert_allclose(
+            rolling.rolling(values, "mad", times=times, span=10.0), expected
+        )
+        assert_allclose(
+            rolling.rolling(values, "median", times=times, span=10.0),
+            [
+                np.median(values[(times > t - 10.0) & (times <= t)])
+                for t in times
+            ],
+        )
+
+    def test_rolling_mad_ties_and_nans(self):
+        values = np.random.default_rng(2).integers(0, 5, 300).astype(float)
+        values[::7] = np.nan
+        expected = []
+        for i in range(values.size):
+            window = values[max(i - 9, 0) : i + 1]
+            window = window[~np.isnan(window)]
+            expected.append(
+                np.median(np.abs(window - np.median(window)))
+                if window.size
+                else np.nan
+            )
+        assert_equal(rolling.rolling(values, "mad", window=10), expected)
+
+    def test_rolling_span(self, values):
+        times = np.cumsum(np.full(values.size, 0.5))
+        assert_allclose(
+            rolling.rolling(values, "mean", times=times, span=10.0),
+            rolling.rolling(values, "mean", window=20),
+        )
+
+    @pytest.mark.parametrize(
+        "window, span",
+        [(5, None), (None, 4.0)],
+    )
+    @pytest.mark.parametrize("statistic", ["median", "mad", "mean", "std"])
+    def test_calculate_rolling_statistic_extends(
+        self, window, span, statistic
+    ):
+        data = synthetic.synthetic_arterial_pressure_data(
+            systolic_pressure=120.0,
+            diastolic_pressure=80.0,
+            heart_rate=75.0,
+            n_beats_target=30.3,
+            hertz=100.0,
+        )
+        data["pressure"] += np.random.default_rng(0).normal(size=len(data))
+        wf = waveform.find_troughs(waveforms.Waveforms(data), "pressure")
+        key = rolling.rolling_key(cycles.MeanValue, statistic, window, span)
+        expected = rolling.calculate_rolling_statistic(
+            wf, "pressure", cycles.MeanValue, statistic, window, span
+        ).features.cycles["pressure"][key]
+        assert expected.size == 30
+
+        troughs = wf.features.waveform["pressure"]["troughs"]
+        wf.features.waveform["pressure"]["troughs"] = troughs[:15]
+        wf = rolling.calculate_rolling_statistic(
+            wf, "pressure", cycles.MeanValue, statistic, window, span
+        )
+        assert wf.features.cycles["pressure"][key].size == 14
+        wf.features.waveform["pressure"]["troughs"] = troughs
+        wf = rolling.calculate_rolling_statistic(
+            wf, "pressure", cycles.MeanValue, statistic, window, span
+        )
+        assert_allclose(wf.features.cycles["pressure"][key], expected)
+
+    def test_calculate_baseline_deviation(self):
+        wf = waveforms.Waveforms({"signal": np.zeros(40)}, hertz=1.0)
+        wf.features.waveform["signal"]["troughs"] = np.arange(0, 40, 4)
+        wf.features.cycles["signal"]["MeanValue"] = np.array(
+            [1.0, 1.0, 1.0, 2.0, 1.0, 3.0, 2.0, 1.0, 20.0]
+        )
+        wf = rolling.calculate_baseline_deviation(
+            wf, "signal", cycles.MeanValue, window=4
+        )
+        deviations = wf.features.cycles["signal"][
+            "MeanValue_rolling_deviation_4"
+        ]
+        assert_allclose(deviations[:3], 0.0)
+        assert np.isinf(deviations[3])
+        assert deviations[-1] > 5.0
+
+        # Only the new cycles' deviations are calculated
+        troughs = wf.features.waveform["signal"]["troughs"]
+        wf.features.waveform["signal"]["troughs"] = np.append(troughs, 39)
+        wf.features.cycles["signal"]["MeanValue"] = np.append(
+            wf.features.cycles["signal"]["MeanValue"], 1.0
+        )
+        wf = rolling.calculate_baseline_deviation(
+            wf, "signal", cycles.MeanValue, window=4
+        )
+        extended = wf.features.cycles["signal"][
+            "MeanValue_rolling_deviation_4"
+        ]
+        assert_equal(extended[:-1], deviations)
+        assert np.shares_memory(extended, deviations)
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+from numpy.testing import assert_equal
+
+from medical_waveforms import quality, synthetic, waveforms
+from medical_waveforms.channels import ChannelConfig
+from medical_waveforms.features import cycles, waveform
+from medical_waveforms.pipeline import Diff, Pipeline
+
+
+@pytest.fixture(scope="function")
+def wf() -> waveforms.Waveforms:
+    data = synthetic.synthetic_arterial_pressure_data(
+        systolic_pressure=120.0,
+        diastolic_pressure=80.0,
+        heart_rate=60.0,
+        n_beats_target=10.3,
+        hertz=100.0,
+    )
+    data["pressure_2"] = data["pressure"]
+    return waveforms.Waveforms(data)
+
+
+@pytest.fixture(scope="function")
+def pipeline() -> Pipeline:
+    return Pipeline(
+        ChannelConfig(scale=50, checks=quality.ArterialPressureChecks())
+    )
+
+
+def test_steps(pipeline):
+    pipeline.request("pressure", "heart_rate", cycles.MeanValue)
+    pipeline.request("pressure", Diff(cycles.MaximumValue), cycles.MeanValue)
+    assert pipeline.steps("pressure") == [
+        ("troughs", None),
+        ("cycles", cycles.MeanValue),
+        ("diffs", cycles.MaximumValue),
+        ("checks", "heart_rate"),
+    ]
+    assert pipeline.steps("pressure_2") == []
+
+    pipeline.request("pressure", "all")
+    assert [
+        step for level, step in pipeline.steps("pressure") if level == "checks"
+    ] == list(quality.CheckPlan(quality.ArterialPressureChecks()).check_names)
+
+
+def test_request_unknown_check(pipeline):
+    with pytest.raises(AssertionError):
+        pipeline.request("pressure", "not_a_check")
+
+
+def test_run_derives_only_requested_outputs(wf, pipeline):
+    pipeline.request("pressure", "heart_rate", Diff(cycles.MaximumValue))
+    results = pipeline.run(wf)
+
+    assert list(results) == ["pressure"]
+    assert list(results["pressure"].columns) == [
+        "heart_rate",
+        "MaximumValue_diff",
+    ]
+    assert len(results["pressure"]) == 10
+    assert results["pressure"]["heart_rate"].all()
+    assert set(wf.features.cycles["pressure"]) == {
+        "CyclesPerMinute",
+        "Duration",
+        "MaximumValue",
+    }
+    assert not wf.features.waveform["pressure_2"]
+
+
+def test_run_matches_eager_processing(wf, pipeline):
+    pipeline.request("pressure", cycles.MeanValue, "all")
+    pipeline.request("pressure_2", "all")
+    results = pipeline.run(wf)
+
+    expected_wf = waveform.find_troughs(
+        waveforms.Waveforms(wf.waveforms.copy()), "pressure", scale=50
+    )
+    expected = quality.check_cycles(
+        expected_wf, "pressure", quality.ArterialPressureChecks()
+    )
+    for name in "pressure", "pressure_2":
+        assert_equal(results[name]["all"].to_numpy(), expected["all"])
+    assert_equal(
+        results["pressure"]["MeanValue"].to_numpy(),
+        expected_wf.features.cycles["pressure"]["MeanValue"],
+    )
+
+
+def test_run_reuses_troughs(wf):
+    troughs = np.array([0, 100, 200])
+    wf.features.waveform["pressure"]["troughs"] = troughs
+    results = Pipeline().request("pressure", cycles.Duration, "all").run(wf)
+    pd.testing.assert_frame_equal(
+        results["pressure"],
+        pd.DataFrame({"Duration": [1.0, 1.0], "all": [True, True]}),
+    )
+    assert wf.features.waveform["pressure"]["troughs"] is troughs
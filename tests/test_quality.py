@@ -1,11 +1,13 @@
 from lib2to3.pytree import Base
 
+import numpy as np
 import pandas as pd
 import pytest
+from numpy.testing import assert_allclose
 from pydantic import BaseModel
 
 from medical_waveforms import quality, synthetic, waveforms
-from medical_waveforms.features import cycles, waveform
+from medical_waveforms.features import cycles, diffs, rolling, waveform
 
 
 class TestArterialPressureChecks:
@@ -75,3 +77,264 @@ def test_check_cycles(abp_flush_waveforms_fixture):
     for column in expected_columns:
         assert (check_results[column].values[:3] == True).all()
         assert (check_results[column].values[3:] == False).all()
+
+
+class TestCheckPlan:
+    def test_shares_features_between_checks(self):
+        plan = quality.CheckPlan(
+            quality.ArterialPressureChecks(
+                lenient_diastolic_pressure=quality.CycleCheck(
+                    feature=cycles.MinimumValue, min=10.0, max=250.0
+                )
+            )
+        )
+        assert len(plan.check_names) == 10
+        assert len(plan.sources) == 9
+        assert plan.sources.count(("cycles", cycles.MinimumValue)) == 1
+
+    def test_run(self, abp_flush_waveforms_fixture):
+        checks = quality.ArterialPressureChecks()
+        check_results = quality.CheckPlan(checks).run(
+            abp_flush_waveforms_fixture, "pressure"
+        )
+        assert list(check_results.columns) == list(vars(checks)) + ["all"]
+        assert check_results["all"].tolist() == [
+            True,
+            True,
+            True,
+            False,
+            False,
+        ]
+
+
+def test_check_cycles_reuses_features(abp_flush_waveforms_fixture):
+    checks = quality.ArterialPressureChecks()
+    quality.check_cycles(abp_flush_waveforms_fixture, "pressure", checks)
+    cached = dict(abp_flush_waveforms_fixture.features.cycles["pressure"])
+
+    quality.check_cycles(abp_flush_waveforms_fixture, "pressure", checks)
+    for feature_name, feature in cached.items():
+        assert (
+            abp_flush_waveforms_fixture.features.cycles["pressure"][
+                feature_name
+            ]
+            is feature
+        )
+
+
+def test_check_cycles_follow_in_place_changes(abp_flush_waveforms_fixture):
+    class Checks(BaseModel):
+        map_diff: quality.DiffCheck = quality.DiffCheck(
+            feature=cycles.MeanValue, threshold=15.0
+        )
+
+    def derive(w: waveforms.Waveforms) -> tuple:
+        w = diffs.calculate_absolute_diffs(w, "pressure", cycles.MeanValue)
+        w = rolling.calculate_baseline_deviation(
+            w, "pressure", cycles.MeanValue, window=3
+        )
+        return (
+            quality.check_cycles(w, "pressure", Checks()),
+            w.features.diffs["pressure"]["MeanValue"].copy(),
+            dict(w.features.cycles["pressure"]),
+        )
+
+    w = abp_flush_waveforms_fixture
+    check_results, _, _ = derive(w)
+    # Rescale in place (e.g. from Pa to hPa), keeping the troughs
+    w.waveforms["pressure"] /= 100
+    rescaled_results, mean_diffs, features = derive(w)
+
+    expected_w = waveforms.Waveforms(w.waveforms.copy())
+    expected_w.features.waveform["pressure"]["troughs"] = w.features.waveform[
+        "pressure"
+    ]["troughs"]
+    expected_results, expected_diffs, expected_features = derive(expected_w)
+    assert not expected_results.equals(check_results)
+    pd.testing.assert_frame_equal(rescaled_results, expected_results)
+    assert_allclose(mean_diffs, expected_diffs)
+    assert features.keys() == expected_features.keys()
+    for key, feature in expected_features.items():
+        assert_allclose(features[key], feature, err_msg=key)
+
+
+def test_template_check(abp_flush_waveforms_fixture):
+    checks = quality.ArterialPressureChecks(template=quality.TemplateCheck())
+    check_results = quality.check_cycles(
+        abp_flush_waveforms_fixture, "pressure", checks
+    )
+    assert check_results["template"].tolist() == [True] * 3 + [False] * 2
+    assert (
+        "template"
+        not in quality.CheckPlan(quality.ArterialPressureChecks()).check_names
+    )
+
+
+def test_update_check_cycles():
+    data = synthetic.synthetic_arterial_pressure_data(
+        systolic_pressure=120,
+        diastolic_pressure=80,
+        heart_rate=72,
+        n_beats_target=12.3,
+        hertz=100,
+    )
+    checks = quality.ArterialPressureChecks()
+    expected_w = waveform.find_troughs(
+        waveforms.Waveforms(data.copy()), "pressure", scale=25
+    )
+    expected = quality.check_cycles(expected_w, "pressure", checks)
+
+    # Stream the same data in one-second blocks
+    w = waveforms.Waveforms(data.iloc[:200].copy())
+    w = waveform.find_troughs(w, "pressure", scale=25)
+    check_results = quality.check_cycles(w, "pressure", checks)
+    for start in range(200, data.shape[0], 100):
+        w.append(data.iloc[start : start + 100])
+        w = waveform.update_troughs(w, "pressure", scale=25)
+        check_results = quality.update_check_cycles(
+            w, "pressure", checks, check_results
+        )
+
+    pd.testing.assert_frame_equal(check_results, expected)
+    for feature_name, feature in expected_w.features.diffs["pressure"].items():
+        assert_allclose(w.features.diffs["pressure"][feature_name], feature)
+
+
+def test_baseline_check():
+    data = synthetic.synthetic_arterial_pressure_data(
+        systolic_pressure=120.0,
+        diastolic_pressure=80.0,
+        heart_rate=75.0,
+        n_beats_target=80.3,
+        hertz=100.0,
+    )
+    data["pressure"] += np.random.default_rng(0).normal(
+        scale=0.5, size=len(data)
+    )
+    # Raise the 50th beat, which is still within physiological limits
+    data.loc[3925:3990, "pressure"] += 15.0
+    w = waveform.find_troughs(waveforms.Waveforms(data), "pressure")
+
+    class Checks(BaseModel):
+        mean_pressure: quality.BaselineCheck = quality.BaselineCheck(
+            feature=cycles.MeanValue, window=20
+        )
+        mean_pressure_span: quality.BaselineCheck = quality.BaselineCheck(
+            feature=cycles.MeanValue, span=16.0
+        )
+
+    check_results = quality.check_cycles(w, "pressure", Checks())
+    for check_name in "mean_pressure", "mean_pressure_span":
+        passed = check_results[check_name].to_numpy()
+        assert not passed[49]
+        assert passed[20:49].all() and passed[50:].all()
+
+
+class TestSignalQualityIndex:
+    @pytest.fixture(scope="function")
+    def data(self) -> pd.DataFrame:
+        data = synthetic.synthetic_arterial_pressure_data(
+            systolic_pressure=120,
+            diastolic_pressure=80,
+            heart_rate=72,
+            n_beats_target=60.3,
+            hertz=100,
+        )
+        # Flatten part of the signal so that some cycles fail
+        data.loc[2000:2600, "pressure"] = 40.0
+        return data
+
+    def test_signal_quality_index(self, data):
+        w = waveform.find_troughs(waveforms.Waveforms(data), "pressure")
+        check_results = quality.check_cycles(
+            w, "pressure", quality.ArterialPressureChecks()
+        )
+        sqi = quality.signal_quality_index(
+            w, "pressure", check_results, windows=[5.0, 20.0]
+        )
+        assert list(sqi) == [5.0, 20.0]
+
+        start_times = w.times[w.features.waveform["pressure"]["troughs"][:-1]]
+        for window, aggregated in sqi.items():
+            expected = check_results.groupby(
+                np.floor(start_times / window) * window
+            ).mean()
+            assert aggregated["n_cycles"].sum() == len(check_results)
+            assert_allclose(
+                aggregated.loc[expected.index, expected.columns], expected
+            )
+        # The flattened signal has a window without any cycles
+        assert sqi[5.0].loc[20.0, "n_cycles"] == 0
+        assert np.isnan(sqi[5.0].loc[20.0, "all"])
+        assert sqi[5.0]["all"].min() < 1.0
+
+    def test_update_signal_quality_index(self, data):
+        checks = quality.ArterialPressureChecks()
+
+        # Stream the data in one-second blocks
+        w = waveforms.Waveforms(data.iloc[:200].copy())
+        w = waveform.find_troughs(w, "pressure", scale=50)
+        check_results = quality.check_cycles(w, "pressure", checks)
+        sqi = quality.signal_quality_index(w, "pressure", check_results)
+        for start in range(200, data.shape[0], 100):
+            w.append(data.iloc[start : start + 100])
+            w = waveform.update_troughs(w, "pressure", scale=50)
+            check_results = quality.update_check_cycles(
+                w, "pressure", checks, check_results
+            )
+            sqi = quality.update_signal_quality_index(
+                w, "pressure", check_results, sqi
+            )
+
+        expected = quality.signal_quality_index(w, "pressure", check_results)
+        for window, aggregated in expected.items():
+            pd.testing.assert_frame_equal(sqi[window], aggregated)
+
+
+class TestPackedCheckResults:
+    @pytest.fixture(scope="function")
+    def checked(self) -> pd.DataFrame:
+        checked = pd.DataFrame(
+            {
+                "a": [True, False, False, True, False, True],
+                "b": [True, True, False, True, True, False],
+            },
+            index=pd.RangeIndex(3, 9),
+        )
+        checked["all"] = checked.all(axis=1)
+        return checked
+
+    def test_round_trip(self, checked):
+        packed = quality.PackedCheckResults.from_dataframe(checked)
+        assert packed.failures.dtype == np.uint8
+        assert packed.failures.tolist() == [0, 1, 3, 0, 1, 2]
+        pd.testing.assert_frame_equal(packed.to_dataframe(), checked)
+
+    def test_queries(self, checked):
+        packed = quality.PackedCheckResults.from_dataframe(checked)
+        assert packed.failed_checks(5) == ["a", "b"]
+        assert packed.failed_checks(6) == []
+        assert packed.failure_counts().to_dict() == {"a": 3, "b": 2, "all": 4}
+        assert packed.failure_runs().to_dict("list") == {
+            "first_cycle": [4, 7],
+            "n_cycles": [2, 2],
+        }
+        assert packed.failure_runs("b").to_dict("list") == {
+            "first_cycle": [5, 8],
+            "n_cycles": [1, 1],
+        }
+
+    def test_save_load(self, tmp_path, checked):
+        path = tmp_path / "checked.npz"
+        quality.PackedCheckResults.from_dataframe(checked).save(path)
+        loaded = quality.PackedCheckResults.load(path)
+        pd.testing.assert_frame_equal(loaded.to_dataframe(), checked)
+
+    def test_run_packed(self, abp_flush_waveforms_fixture):
+        plan = quality.CheckPlan(quality.ArterialPressureChecks())
+        packed = plan.run_packed(abp_flush_waveforms_fixture, "pressure")
+        assert packed.failures.dtype == np.uint16
+        pd.testing.assert_frame_equal(
+            packed.to_dataframe(),
+            plan.run(abp_flush_waveforms_fixture, "pressure"),
+        )
@@ -0,0 +1,279 @@
+import asyncio
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from medical_waveforms import chunked, quality, synthetic
+from medical_waveforms.channels import ChannelConfig
+from medical_waveforms.features import waveform
+from medical_waveforms.service import StreamingService, simulate_monitor
+
+CONFIG = ChannelConfig(
+    detector=waveform.UpstrokeTroughDetector(),
+    checks=quality.ArterialPressureChecks(),
+)
+
+
+def bed_data(heart_rate: float) -> pd.DataFrame:
+    return synthetic.synthetic_arterial_pressure_data(
+        systolic_pressure=120.0,
+        diastolic_pressure=80.0,
+        heart_rate=heart_rate,
+        n_beats_target=30.3,
+        hertz=100.0,
+    )
+
+
+def expected_records(bed: str, data: pd.DataFrame) -> list:
+    blocks = [
+        data.iloc[start : start + 100] for start in range(0, len(data), 100)
+    ]
+    table = pd.concat(
+        chunked.process_in_chunks(blocks, "pressure", CONFIG, chunk_size=500)
+    )
+    return [
+        {"bed": bed, **record}
+        for record in table.rename_axis("cycle")
+        .reset_index()
+        .to_dict("records")
+    ]
+
+
+def drain(results: asyncio.Queue) -> list:
+    records = []
+    while not results.empty():
+        records.append(results.get_nowait())
+    return records
+
+
+def test_feed():
+    beds = {"bed-1": bed_data(60.0), "bed-2": bed_data(90.0)}
+
+    async def main():
+        service = StreamingService(config=CONFIG, chunk_size=500)
+        all_results = service.subscribe()
+        bed_1_results = service.subscribe("bed-1")
+
+        async def feed(bed, data):
+            for start in range(0, len(data), 100):
+                await service.feed(bed, data.iloc[start : start + 100])
+            await service.end(bed)
+
+        await asyncio.gather(*(feed(bed, data) for bed, data in beds.items()))
+        await service.close()
+        return drain(all_results), drain(bed_1_results)
+
+    all_records, bed_1_records = asyncio.run(main())
+    for bed, data in beds.items():
+        expected = expected_records(bed, data)
+        assert len(expected) > 20
+        assert [r for r in all_records if r["bed"] == bed] == expected
+    assert bed_1_records == expected_records("bed-1", beds["bed-1"])
+
+
+def test_slow_subscriber_drops_oldest_results():
+    async def main():
+        service = StreamingService(
+            config=CONFIG, chunk_size=500, max_pending_results=5
+        )
+        results = service.subscribe()
+        data = bed_data(60.0)
+        for start in range(0, len(data), 100):
+            await service.feed("bed-1", data.iloc[start : start + 100])
+        await service.end("bed-1")
+        await service.close()
+        return drain(results)
+
+    records = asyncio.run(main())
+    expected = expected_records("bed-1", bed_data(60.0))
+    assert records == expected[-5:]
+
+
+@pytest.mark.parametrize("use_unix_socket", [True, False])
+def test_serve(tmp_path, use_unix_socket):
+    beds = {f"bed-{i}": bed_data(60.0 + 10 * i) for i in range(3)}
+    expected = {bed: expected_records(bed, data) for bed, data in beds.items()}
+    n_expected = sum(len(records) for records in expected.values())
+
+    async def main():
+        service = StreamingService(config=CONFIG, chunk_size=500)
+        if use_unix_socket:
+            address = {"path": tmp_path / "service.sock"}
+            server = await service.serve(**address)
+            reader, writer = await asyncio.open_unix_connection(
+                str(address["path"])
+            )
+        else:
+            server = await service.serve()
+            address = {"port": server.sockets[0].getsockname()[1]}
+            reader, writer = await asyncio.open_connection(
+                "127.0.0.1", address["port"]
+            )
+        writer.write(b'{"subscribe": null}\n')
+        await writer.drain()
+        # Wait for the subscription to be registered
+        while not service._subscribers:
+            await asyncio.sleep(0.01)
+
+        await asyncio.gather(
+            *(
+                simulate_monitor(bed, data=data, speed=None, **address)
+                for bed, data in beds.items()
+            )
+        )
+        records = [
+            json.loads(await asyncio.wait_for(reader.readline(), 10))
+            for _ in range(n_expected)
+        ]
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        await service.close()
+        return records
+
+    records = asyncio.run(main())
+    for bed, bed_records in expected.items():
+        assert [r for r in records if r["bed"] == bed] == bed_records
+
+
+def test_failed_bed_raises_and_others_carry_on():
+    async def main():
+        service = StreamingService(
+            config=CONFIG, chunk_size=500, max_pending_blocks=1
+        )
+        results = service.subscribe()
+        broken = bed_data(60.0).rename(columns={"pressure": "other"})
+        data = bed_data(90.0)
+
+        async def feed_broken():
+            with pytest.raises(RuntimeError) as error:
+                for start in range(0, len(broken), 100):
+                    await service.feed(
+                        "bed-1", broken.iloc[start : start + 100]
+                    )
+            assert isinstance(error.value.__cause__, KeyError)
+            with pytest.raises(RuntimeError):
+                await service.end("bed-1")
+
+        async def feed():
+            for start in range(0, len(data), 100):
+                await service.feed("bed-2", data.iloc[start : start + 100])
+            await service.end("bed-2")
+
+        await asyncio.wait_for(asyncio.gather(feed_broken(), feed()), 10)
+        await service.close()
+        return drain(results)
+
+    records = asyncio.run(main())
+    assert [r for r in records if r["bed"] == "bed-1"] == [
+        {"bed": "bed-1", "error": "KeyError('pressure')"}
+    ]
+    assert [r for r in records if r["bed"] == "bed-2"] == expected_records(
+        "bed-2", bed_data(90.0)
+    )
+
+
+def test_serve_replies_to_bad_messages():
+    async def main():
+        service = StreamingService(config=CONFIG, chunk_size=500)
+        server = await service.serve()
+        reader, writer = await asyncio.open_connection(
+            "127.0.0.1", server.sockets[0].getsockname()[1]
+        )
+        replies = []
+        for message in (b"not json\n", b'{"bed": "bed-1"}\n', b"[1, 2]\n"):
+            writer.write(message)
+            await writer.drain()
+            replies.append(
+                json.loads(await asyncio.wait_for(reader.readline(), 10))
+            )
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        await service.close()
+        return replies
+
+    replies = asyncio.run(main())
+    assert [list(reply) for reply in replies] == [["error"]] * 3
+    assert "KeyError('samples')" in replies[1]["error"]
+
+
+def test_serve_replies_to_oversized_messages():
+    async def main():
+        service = StreamingService(config=CONFIG, chunk_size=500)
+        server = await service.serve(max_message_bytes=1000)
+        reader, writer = await asyncio.open_connection(
+            "127.0.0.1", server.sockets[0].getsockname()[1]
+        )
+        replies = []
+        for message in (
+            json.dumps({"bed": "bed-1", "samples": [0.0] * 2000}),
+            json.dumps({"bed": "bed-1"}),
+        ):
+            writer.write(message.encode() + b"\n")
+            await writer.drain()
+            replies.append(
+                json.loads(await asyncio.wait_for(reader.readline(), 10))
+            )
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        await service.close()
+        return replies
+
+    replies = asyncio.run(main())
+    assert "longer than the server's limit" in replies[0]["error"]
+    # The rest of the oversized message was discarded
+    assert "KeyError('samples')" in replies[1]["error"]
+
+
+def test_serve_writes_missing_values_as_null():
+    async def main():
+        service = StreamingService(config=CONFIG, chunk_size=500)
+        server = await service.serve()
+        reader, writer = await asyncio.open_connection(
+            "127.0.0.1", server.sockets[0].getsockname()[1]
+        )
+        writer.write(b'{"subscribe": null}\n')
+        await writer.drain()
+        while not service._subscribers:
+            await asyncio.sleep(0.01)
+        service._publish(
+            "bed-1",
+            pd.DataFrame(
+                {
+                    "MeanValue": [np.nan, 90.0],
+                    "MeanNegativeFirstDifference": np.array(
+                        [-np.inf, 1.0], dtype=np.float32
+                    ),
+                }
+            ),
+        )
+        lines = [
+            await asyncio.wait_for(reader.readline(), 10) for _ in range(2)
+        ]
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        await service.close()
+        return lines
+
+    lines = asyncio.run(main())
+    # Strict JSON, without NaN or Infinity
+    records = [json.loads(line, parse_constant=pytest.fail) for line in lines]
+    assert records == [
+        {
+            "bed": "bed-1",
+            "cycle": 0,
+            "MeanValue": None,
+            "MeanNegativeFirstDifference": None,
+        },
+        {
+            "bed": "bed-1",
+            "cycle": 1,
+            "MeanValue": 90.0,
+            "MeanNegativeFirstDifference": 1.0,
+        },
+    ]
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+from numpy.testing import assert_equal
+
+from medical_waveforms import quality, storage, synthetic, waveforms
+from medical_waveforms.features import morphology, waveform
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.fixture(scope="function")
+def wf() -> waveforms.Waveforms:
+    data = synthetic.synthetic_arterial_pressure_data(
+        systolic_pressure=120.0,
+        diastolic_pressure=80.0,
+        heart_rate=75.0,
+        n_beats_target=20.3,
+        hertz=100.0,
+    )
+    return waveform.find_troughs(waveforms.Waveforms(data), "pressure")
+
+
+@pytest.mark.parametrize("file_format", storage.FILE_FORMATS)
+@pytest.mark.parametrize("chunk_size", [None, 7])
+def test_save_load_features(tmp_path, wf, file_format, chunk_size):
+    checked = quality.check_cycles(
+        wf, "pressure", quality.ArterialPressureChecks()
+    )
+    wf = morphology.ResampledCycles().ensure_feature(wf, "pressure")
+    storage.save_features(
+        wf,
+        tmp_path,
+        checked={
+            "pressure": quality.PackedCheckResults.from_dataframe(checked)
+        },
+        file_format=file_format,
+        chunk_size=chunk_size,
+    )
+
+    loaded = storage.load_features(
+        waveforms.Waveforms(wf.waveforms.copy()), tmp_path
+    )
+    for level in "waveform", "cycles", "diffs":
+        expected = getattr(wf.features, level)["pressure"]
+        actual = getattr(loaded.features, level)["pressure"]
+        assert set(actual) == set(expected)
+        for key, feature in expected.items():
+            assert_equal(actual[key], feature)
+    assert loaded.features.cycles["pressure"]["ResampledCycles"].shape == (
+        20,
+        100,
+    )
+    pd.testing.assert_frame_equal(
+        storage.load_check_results(tmp_path, "pressure"), checked
+    )
+
+
+def test_load_features_memory_maps_arrow(tmp_path, wf):
+    quality.check_cycles(wf, "pressure", quality.ArterialPressureChecks())
+    storage.save_features(wf, tmp_path)
+    loaded = storage.load_features(
+        waveforms.Waveforms(wf.waveforms.copy()), tmp_path
+    )
+    feature = loaded.features.cycles["pressure"]["MeanValue"]
+    assert not feature.flags.owndata and not feature.flags.writeable
+    assert storage.load_check_results(tmp_path, "pressure") is None
+
+    # Loaded features are truncated and extended like any others
+    troughs = loaded.features.waveform["pressure"]["troughs"]
+    loaded.features.waveform["pressure"]["troughs"] = troughs[:-5]
+    loaded.features.waveform["pressure"]["troughs"] = troughs
+    checked = quality.check_cycles(
+        loaded, "pressure", quality.ArterialPressureChecks()
+    )
+    assert len(checked) == 20
+    assert_equal(
+        loaded.features.cycles["pressure"]["MeanValue"],
+        wf.features.cycles["pressure"]["MeanValue"],
+    )
+
+
+def test_save_features_skips_stale_features(tmp_path, wf):
+    quality.check_cycles(wf, "pressure", quality.ArterialPressureChecks())
+    wf.features.cycles["pressure"]["Stale"] = np.zeros(3)
+    storage.save_features(wf, tmp_path)
+    loaded = storage.load_features(
+        waveforms.Waveforms(wf.waveforms.copy()), tmp_path
+    )
+    assert "Stale" not in loaded.features.cycles["pressure"]
+    assert "MeanValue" in loaded.features.cycles["pressure"]
@@ -1,5 +1,6 @@
 import wave
 
+import numpy as np
 import pandas as pd
 import pytest
 
@@ -33,3 +34,246 @@ class TestWaveforms:
         assert example_waveforms.features.waveform == {"signal": {}}
         assert example_waveforms.features.cycles == {"signal": {}}
         assert example_waveforms.features.diffs == {"signal": {}}
+
+    def test_append(self, example_data):
+        w = waveforms.Waveforms(waveforms=example_data.copy())
+        w.append(pd.DataFrame({"time": [4, 5], "signal": [0.2, 0.3]}))
+        assert w.waveforms.time.tolist() == [1, 2, 3, 4, 5]
+        assert w.waveforms.index.tolist() == [0, 1, 2, 3, 4]
+
+    def test_append_grows_buffers(self, example_data):
+        w = waveforms.Waveforms(waveforms=example_data.copy())
+        w.append(pd.DataFrame({"time": [4, 5], "signal": [0.2, 0.3]}))
+        signal = w.column("signal")
+        w.append(pd.DataFrame({"time": [6], "signal": [0.5]}))
+        # Appended to the same buffer, rather than copying the column
+        assert np.shares_memory(w.column("signal"), signal)
+        assert w.column("signal").tolist() == [0.1, 0.4, 0.8, 0.2, 0.3, 0.5]
+        assert isinstance(w.waveforms, pd.DataFrame)
+
+    def test_append_validates_columns(self, example_data):
+        w = waveforms.Waveforms(waveforms=example_data.copy())
+        with pytest.raises(Exception):
+            w.append(pd.DataFrame({"time": [4], "other": [0.2]}))
+
+
+class TestFeaturesContainer:
+    @pytest.fixture(scope="function")
+    def features(self):
+        features = waveforms.FeaturesContainer(("signal",))
+        features.waveform["signal"]["troughs"] = np.array([0, 10, 20, 30])
+        features.cycles["signal"]["Duration"] = np.array([1.0, 1.0, 1.0])
+        features.diffs["signal"]["Duration"] = np.array([0.0, 0.0, 0.0])
+        return features
+
+    def test_is_current(self, features):
+        assert features.n_cycles("signal") == 3
+        assert features.is_current("signal", "Duration")
+        assert features.is_current("signal", "Duration", level="diffs")
+        assert not features.is_current("signal", "MeanValue")
+
+    def test_trough_change_truncates_derived_features(self, features):
+        features.waveform["signal"]["troughs"] = np.array([0, 10, 21, 30])
+        assert features.cycles["signal"]["Duration"].tolist() == [1.0]
+        assert features.diffs["signal"]["Duration"].tolist() == [0.0]
+
+        features.waveform["signal"]["troughs"] = np.array([5, 10])
+        assert features.cycles["signal"] == {}
+        assert features.diffs["signal"] == {}
+
+    def test_cycles_feature_change_truncates_diffs(self, features):
+        features.cycles["signal"]["Duration"] = np.array([1.0, 2.0, 1.0])
+        assert features.diffs["signal"]["Duration"].tolist() == [0.0]
+
+    def test_cycles_feature_change_truncates_rolling_statistics(
+        self, features
+    ):
+        features.cycles["signal"]["Duration_rolling_median_2"] = np.ones(3)
+        features.cycles["signal"]["DurationRatio"] = np.ones(3)
+        features.cycles["signal"]["Duration"] = np.array([1.0, 1.0, 2.0])
+        assert features.cycles["signal"]["Duration_rolling_median_2"].size == 2
+        assert features.cycles["signal"]["DurationRatio"].size == 3
+
+        del features.cycles["signal"]["Duration"]
+        assert "Duration_rolling_median_2" not in features.cycles["signal"]
+
+    def test_check_column(self, features):
+        column = np.arange(40.0)
+        features.check_column("signal", column)
+        features.check_column("signal", np.arange(50.0))
+        assert features.is_current("signal", "Duration")
+
+        column *= 10
+        features.check_column("signal", column)
+        assert features.cycles["signal"] == {}
+        assert features.diffs["signal"] == {}
+        assert features.n_cycles("signal") == 3
+
+    def test_extend(self, features):
+        troughs = features.waveform["signal"]["troughs"]
+        features.extend("waveform", "signal", "troughs", 3, np.array([31]))
+        assert features.cycles["signal"]["Duration"].tolist() == [1.0, 1.0]
+
+        extended = features.extend(
+            "waveform", "signal", "troughs", 4, np.array([40, 50])
+        )
+        assert extended.tolist() == [0, 10, 20, 31, 40, 50]
+        assert troughs.tolist() == [0, 10, 20, 30]
+        assert features.cycles["signal"]["Duration"].tolist() == [1.0, 1.0]
+        # Later extensions reuse the same buffer
+        assert np.shares_memory(
+            features.extend("waveform", "signal", "troughs", 6, [60]),
+            extended,
+        )
+
+        features.extend("cycles", "signal", "Duration", 1, np.array([1.0]))
+        assert features.diffs["signal"]["Duration"].tolist() == [0.0, 0.0]
+
+    def test_invalidate(self, features):
+        features.invalidate("signal")
+        assert features.waveform["signal"] == {}
+        assert features.cycles["signal"] == {}
+
+
+class TestCycleIndex:
+    @pytest.fixture(scope="function")
+    def features(self):
+        features = waveforms.FeaturesContainer(("signal",))
+        features.waveform["signal"]["troughs"] = np.array([2, 10, 20, 30])
+        features.cycles["signal"]["Duration"] = np.array([0.8, 1.0, 1.0])
+        return features
+
+    @pytest.fixture(scope="function")
+    def times(self):
+        return waveforms.UniformTimeAxis(hertz=10.0, n_samples=40)
+
+    def test_lookups(self, features, times):
+        index = features.cycle_index("signal", times)
+        assert len(index) == 3
+        assert index.start_times.tolist() == [0.2, 1.0, 2.0]
+        assert index.cycle_at_time(1.5) == 1
+        assert index.cycle_at_time(
+            np.array([0.0, 0.2, 1.0, 3.0, 3.1])
+        ).tolist() == [-1, 0, 1, 2, -1]
+        assert index.cycle_at_sample(
+            np.array([1, 2, 9, 10, 30, 31])
+        ).tolist() == [-1, 0, 0, 1, 2, -1]
+
+    def test_select(self, features, times):
+        index = features.cycle_index("signal", times)
+        assert index.window(0.5, 2.0) == slice(1, 2)
+        selected = index.select(features.cycles["signal"], 0.5, 2.5)
+        assert selected["Duration"].tolist() == [1.0, 1.0]
+        assert np.shares_memory(
+            selected["Duration"], features.cycles["signal"]["Duration"]
+        )
+        checked = pd.DataFrame({"all": [True, False, True]})
+        assert index.select(checked, 0.0, 1.5)["all"].tolist() == [
+            True,
+            False,
+        ]
+
+    def test_rebuilt_when_troughs_change(self, features, times):
+        index = features.cycle_index("signal", times)
+        assert features.cycle_index("signal", times) is index
+        features.waveform["signal"]["troughs"] = np.array([2, 10, 20, 30, 39])
+        assert len(features.cycle_index("signal", times)) == 4
+
+
+class TestArrayBackedWaveforms:
+    @pytest.fixture(scope="class")
+    def example_columns(self):
+        return {
+            "time": np.array([1.0, 2.0, 3.0]),
+            "signal": np.array([0.1, 0.4, 0.8]),
+        }
+
+    def test_mapping(self, example_columns):
+        w = waveforms.Waveforms(waveforms=example_columns)
+        assert w.names == ("signal",)
+        assert w.n_samples == 3
+        assert w.column("signal") is example_columns["signal"]
+
+    def test_validate_column_lengths(self):
+        with pytest.raises(Exception):
+            waveforms.Waveforms(
+                waveforms={"time": np.arange(3), "signal": np.arange(4)}
+            )
+
+    def test_from_npy(self, tmp_path, example_columns):
+        np.save(tmp_path / "time.npy", example_columns["time"])
+        np.save(tmp_path / "signal.npy", example_columns["signal"])
+        w = waveforms.Waveforms.from_npy(
+            {
+                "time": tmp_path / "time.npy",
+                "signal": tmp_path / "signal.npy",
+            }
+        )
+        assert isinstance(w.column("signal"), np.memmap)
+        assert w.column("signal").tolist() == [0.1, 0.4, 0.8]
+
+    def test_from_structured_npy(self, tmp_path, example_columns):
+        records = np.zeros(3, dtype=[("time", float), ("signal", float)])
+        records["time"] = example_columns["time"]
+        records["signal"] = example_columns["signal"]
+        np.save(tmp_path / "records.npy", records)
+        w = waveforms.Waveforms.from_npy(tmp_path / "records.npy")
+        assert w.names == ("signal",)
+        assert np.shares_memory(w.column("signal"), w.waveforms)
+
+    def test_append(self, example_columns):
+        w = waveforms.Waveforms(waveforms=dict(example_columns))
+        w.append({"time": np.array([4.0]), "signal": np.array([0.2])})
+        assert w.column("signal").tolist() == [0.1, 0.4, 0.8, 0.2]
+
+    def test_dtype(self, example_columns):
+        structured = np.zeros(3, dtype=[("time", float), ("signal", float)])
+        structured["signal"] = example_columns["signal"]
+        for store in (
+            pd.DataFrame(example_columns),
+            dict(example_columns),
+            structured,
+        ):
+            w = waveforms.Waveforms(waveforms=store, dtype=np.float32)
+            assert w.column("signal").dtype == np.float32
+            assert w.column("time").dtype == np.float64
+            assert w.select(["signal"]).column("signal").dtype == np.float32
+            w.append({"time": np.array([4.0]), "signal": np.array([0.2])})
+            assert w.column("signal").dtype == np.float32
+            assert w.n_samples == 4
+
+    def test_compute_dtype(self):
+        assert waveforms.compute_dtype(np.float32) == np.float32
+        assert waveforms.compute_dtype(np.float64) == np.float64
+        assert waveforms.compute_dtype(np.int16) == np.float32
+        assert waveforms.compute_dtype(np.uint16) == np.float32
+        assert waveforms.compute_dtype(np.int32) == np.float64
+
+
+class TestUniformTimeAxis:
+    def test_indexing(self):
+        times = waveforms.UniformTimeAxis(
+            hertz=10.0, n_samples=5, start_time=2
+        )
+        assert len(times) == 5
+        assert times[np.array([0, 4, -1])].tolist() == [2.0, 2.4, 2.4]
+        assert len(times[1:3]) == 2
+        assert times[1:3][0] == times[1]
+        np.testing.assert_allclose(np.asarray(times), [2, 2.1, 2.2, 2.3, 2.4])
+
+    def test_waveforms_without_time_column(self):
+        w = waveforms.Waveforms(
+            pd.DataFrame({"signal": [0.1, 0.4, 0.8]}), hertz=2.0, start_time=1
+        )
+        assert w.names == ("signal",)
+        assert w.column("time").tolist() == [1.0, 1.5, 2.0]
+
+        w.append(pd.DataFrame({"signal": [0.2]}))
+        assert w.column("time").tolist() == [1.0, 1.5, 2.0, 2.5]
+
+    def test_validate_no_time_column(self):
+        with pytest.raises(Exception):
+            waveforms.Waveforms(
+                pd.DataFrame({"time": [1, 2], "signal": [0.1, 0.2]}),
+                hertz=1.0,
+            )